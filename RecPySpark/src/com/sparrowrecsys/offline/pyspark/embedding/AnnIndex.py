@@ -0,0 +1,289 @@
+"""
+=====================================================================================
+AnnIndex.py - 纯 NumPy 实现的 IVF-Flat 近似最近邻 (ANN) 索引
+
+embeddingLSH 依赖 Spark: 每次查找都要提交一个 Spark 作业，延迟在秒级，
+只适合离线演示。相似电影查询需要亚毫秒级的响应，本模块提供一个不依赖 Spark 的本地索引，
+直接从 item2vecEmb.csv / itemGraphEmb.csv (或 EmbeddingStore 的二进制文件) 构建。
+
+IVF-Flat (Inverted File, 倒排文件) 原理:
+    1. 训练: 用 k-means 把所有向量聚成 numLists 个簇，每个簇的中心叫"质心"
+    2. 建索引: 每个向量放入离它最近的质心对应的倒排列表 (list)
+    3. 查询: 先算查询向量与所有质心的相似度，只在最相近的 numProbes 个列表里做精确比较
+    需要比较的向量数从 N 降到约 N * numProbes / numLists，numProbes 越大召回越高、速度越慢
+
+相似度使用余弦相似度: 建索引和查询时都先做 L2 归一化，余弦相似度就等于内积
+
+存储布局 (与 TransitionGraph 的 CSR 类似):
+    listVectors: 按倒排列表顺序重新排列的向量矩阵，同一列表的向量在内存中连续
+    listRows:    listVectors 第 i 行对应的原始行号
+    listOffsets: 第 l 个列表占据 listVectors[listOffsets[l]:listOffsets[l+1]]
+
+用法:
+    index = IvfFlatIndex.fromEmbeddingFile('modeldata2/item2vecEmb.csv')
+    index.similarItems(['158', '1'], k=20)     # 批量查相似电影
+    index.save('item2vecEmb.ivf.npz')
+    index = IvfFlatIndex.load('item2vecEmb.ivf.npz')
+=====================================================================================
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+from EmbeddingStore import EMB_SUFFIX, EmbeddingStore, readTextEmbeddings
+
+
+def normalizeRows(matrix):
+    """L2 归一化每一行，零向量保持为零"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def topKRows(scores, k):
+    """
+    对二维得分矩阵的每一行取得分最高的 k 个位置 (按得分降序)
+
+    先用 argpartition 在 O(n) 内选出前 k 个，再只对这 k 个排序，比整行 argsort 快得多
+
+    返回:
+        (位置矩阵, 得分矩阵)，形状均为 (行数, min(k, 列数))
+    """
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64), np.zeros((scores.shape[0], 0), dtype=scores.dtype)
+    if k < scores.shape[1]:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    topScores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-topScores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(topScores, order, axis=1)
+
+
+def loadEmbeddingMatrix(embPath):
+    """
+    读取 Embedding 文件: 文本格式 (movieId:v1 v2 ...) 或 EmbeddingStore 的 .emb 二进制格式
+
+    返回:
+        (物品ID列表, float32 矩阵)
+    """
+    if embPath.endswith(EMB_SUFFIX):
+        store = EmbeddingStore.load(embPath[:-len(EMB_SUFFIX)])
+        return store.itemIds, np.asarray(store.vectors)
+    return readTextEmbeddings(embPath)
+
+
+def sphericalKMeans(vectors, numClusters, numIterations=20, seed=0):
+    """
+    球面 k-means: 输入为归一化向量，按内积 (余弦相似度) 分配，质心每轮重新归一化
+
+    空簇用随机选取的向量重新初始化
+
+    返回:
+        (质心矩阵 numClusters x dim, 每个向量所属的簇编号)
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), numClusters, replace=False)].copy()
+    assignment = np.zeros(len(vectors), dtype=np.int64)
+    for _ in range(numIterations):
+        newAssignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, newAssignment, vectors)
+        sizes = np.bincount(newAssignment, minlength=numClusters)
+        empty = np.flatnonzero(sizes == 0)
+        sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = normalizeRows(sums)
+        if np.array_equal(newAssignment, assignment):
+            break
+        assignment = newAssignment
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+class IvfFlatIndex:
+    """
+    IVF-Flat 余弦相似度索引
+
+    参数:
+        itemIds: 物品ID列表
+        centroids: 质心矩阵 (numLists x dim)，已归一化
+        listOffsets, listRows, listVectors: 倒排列表 (见模块说明)
+        numProbes: 默认每次查询探测的列表数
+    """
+
+    def __init__(self, itemIds, centroids, listOffsets, listRows, listVectors, numProbes=8):
+        self.itemIds = [str(itemId) for itemId in itemIds]
+        self.itemIndex = {itemId: row for row, itemId in enumerate(self.itemIds)}
+        self.centroids = centroids
+        self.listOffsets = listOffsets
+        self.listRows = listRows
+        self.listVectors = listVectors
+        self.numProbes = numProbes
+        # 原始行号 -> listVectors 中的位置，用于按物品ID取回自己的向量
+        self.rowPositions = np.empty(len(listRows), dtype=np.int64)
+        self.rowPositions[listRows] = np.arange(len(listRows))
+
+    @property
+    def numLists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, itemIds, vectors, numLists=None, numProbes=8, kmeansIterations=20, seed=0):
+        """
+        从 Embedding 矩阵构建索引
+
+        参数:
+            numLists: 倒排列表数，默认 sqrt(N)，是常用的经验值
+            numProbes: 默认查询时探测的列表数
+        """
+        vectors = normalizeRows(vectors)
+        if len(vectors) == 0:
+            raise ValueError("cannot build an index over an empty embedding matrix")
+        numLists = numLists or int(np.sqrt(len(vectors)))
+        numLists = max(1, min(numLists, len(vectors)))
+        centroids, assignment = sphericalKMeans(vectors, numLists, kmeansIterations, seed)
+        listRows = np.argsort(assignment, kind='stable')
+        listOffsets = np.zeros(numLists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=numLists), out=listOffsets[1:])
+        return cls(itemIds, centroids, listOffsets, listRows, np.ascontiguousarray(vectors[listRows]),
+                   min(numProbes, numLists))
+
+    @classmethod
+    def fromEmbeddingFile(cls, embPath, **kwargs):
+        """从 item2vecEmb.csv / itemGraphEmb.csv 或 .emb 二进制文件构建索引"""
+        itemIds, vectors = loadEmbeddingMatrix(embPath)
+        return cls.build(itemIds, vectors, **kwargs)
+
+    def search(self, queries, k, numProbes=None):
+        """
+        批量 k 近邻查询
+
+        参数:
+            queries: 查询向量矩阵 (Q x dim)，不需要预先归一化
+            k: 每个查询返回的近邻数
+            numProbes: 本次查询探测的列表数，默认使用构建时的设置
+
+        返回:
+            (行号矩阵, 余弦相似度矩阵)，形状均为 (Q, k)；
+            候选不足 k 个时，行号补 -1，相似度补 -inf
+        """
+        queries = normalizeRows(np.atleast_2d(queries))
+        numProbes = min(numProbes or self.numProbes, self.numLists)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        if numProbes == self.numLists:
+            # 探测全部列表即精确搜索，直接整批矩阵乘法
+            top, topScores = topKRows(queries @ self.listVectors.T, k)
+            rows[:, :top.shape[1]] = self.listRows[top]
+            scores[:, :top.shape[1]] = topScores
+            return rows, scores
+
+        probes, _ = topKRows(queries @ self.centroids.T, numProbes)
+        for q in range(len(queries)):
+            positions = np.concatenate([np.arange(self.listOffsets[l], self.listOffsets[l + 1])
+                                        for l in probes[q]])
+            top, topScores = topKRows((self.listVectors[positions] @ queries[q])[None, :], k)
+            rows[q, :top.shape[1]] = self.listRows[positions[top[0]]]
+            scores[q, :top.shape[1]] = topScores[0]
+        return rows, scores
+
+    def similarItems(self, itemIds, k, numProbes=None):
+        """
+        批量查询相似物品 (不包含物品自身)
+
+        返回:
+            列表，每个元素是 [(物品ID, 相似度), ...]，与 findSynonyms 的返回格式相同
+        """
+        queryRows = np.array([self.itemIndex[itemId] for itemId in itemIds], dtype=np.int64)
+        rows, scores = self.search(self.listVectors[self.rowPositions[queryRows]], k + 1, numProbes)
+        results = []
+        for q, queryRow in enumerate(queryRows):
+            neighbors = [(self.itemIds[row], float(score)) for row, score in zip(rows[q], scores[q])
+                         if row >= 0 and row != queryRow]
+            results.append(neighbors[:k])
+        return results
+
+    def save(self, path):
+        """保存为 .npz 文件，只包含数组，加载时不需要 pickle"""
+        np.savez(path, itemIds=np.array(self.itemIds), centroids=self.centroids, listOffsets=self.listOffsets,
+                 listRows=self.listRows, listVectors=self.listVectors, numProbes=np.int64(self.numProbes))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['itemIds'].tolist(), data['centroids'], data['listOffsets'], data['listRows'],
+                       data['listVectors'], int(data['numProbes']))
+
+
+def bruteForceSearch(vectors, queries, k):
+    """精确 k 近邻 (余弦相似度)，作为召回率的基准"""
+    return topKRows(normalizeRows(np.atleast_2d(queries)) @ normalizeRows(vectors).T, k)
+
+
+def recallAtK(approxRows, exactRows):
+    """召回率 recall@k = |近似结果 ∩ 精确结果| / |精确结果|，对所有查询取平均"""
+    hits = [len(set(a[a >= 0]) & set(e[e >= 0])) / max(1, np.count_nonzero(e >= 0))
+            for a, e in zip(approxRows, exactRows)]
+    return float(np.mean(hits))
+
+
+def latencyPercentiles(seconds):
+    """把一组单次查询耗时 (秒) 转换为毫秒级的 p50 / p95 / p99"""
+    milliseconds = np.asarray(seconds) * 1000
+    return {'p50Ms': float(np.percentile(milliseconds, 50)), 'p95Ms': float(np.percentile(milliseconds, 95)),
+            'p99Ms': float(np.percentile(milliseconds, 99))}
+
+
+def benchmarkAnnIndex(embPath, k=10, numQueries=1000, numLists=None, numProbesList=(1, 2, 4, 8, 16), seed=0):
+    """
+    在真实 Embedding 文件上测量 IVF-Flat 的召回率和延迟
+
+    查询向量为随机选取的物品自身的向量，与"查相似电影"的实际用法一致
+
+    返回:
+        列表，每个 numProbes 对应一个字典: recall@k、单次查询延迟的 p50/p95/p99、批量查询吞吐，
+        第一个元素为暴力搜索的基准
+    """
+    itemIds, vectors = loadEmbeddingMatrix(embPath)
+    startTime = time.time()
+    index = IvfFlatIndex.build(itemIds, vectors, numLists=numLists, seed=seed)
+    buildSeconds = time.time() - startTime
+
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), min(numQueries, len(vectors)), replace=False)]
+    exactRows, _ = bruteForceSearch(vectors, queries, k)
+
+    def measure(searchOne, searchBatch):
+        latencies = []
+        for query in queries:
+            startTime = time.perf_counter()
+            searchOne(query)
+            latencies.append(time.perf_counter() - startTime)
+        startTime = time.perf_counter()
+        rows = searchBatch(queries)
+        batchSeconds = time.perf_counter() - startTime
+        return rows, dict(latencyPercentiles(latencies), batchQueriesPerSec=len(queries) / batchSeconds)
+
+    normalized = normalizeRows(vectors)
+    _, stats = measure(lambda query: topKRows((normalized @ normalizeRows(query))[None, :], k),
+                       lambda batch: bruteForceSearch(normalized, batch, k)[0])
+    results = [dict(stats, method='bruteForce', recall=1.0)]
+    for numProbes in numProbesList:
+        rows, stats = measure(lambda query: index.search(query, k, numProbes),
+                              lambda batch: index.search(batch, k, numProbes)[0])
+        results.append(dict(stats, method='ivfFlat', numLists=index.numLists,
+                            numProbes=min(numProbes, index.numLists), recall=recallAtK(rows, exactRows),
+                            buildSeconds=buildSeconds))
+    return results
+
+
+if __name__ == '__main__':
+    # 用法: python AnnIndex.py [Embedding 文件路径]，默认使用仓库中的 modeldata2/item2vecEmb.csv
+    repoRoot = os.path.abspath(os.path.join(os.path.dirname(__file__), *([os.pardir] * 7)))
+    embPath = sys.argv[1] if len(sys.argv) > 1 else \
+        os.path.join(repoRoot, 'src', 'main', 'resources', 'webroot', 'modeldata2', 'item2vecEmb.csv')
+    for result in benchmarkAnnIndex(embPath):
+        print(result)
@@ -17,6 +17,7 @@ Embedding.py - 推荐系统中的嵌入向量 (Embedding) 生成模块
 """
 
 import os
+import sys
 
 # 设置 PySpark 使用的 Python 解释器，确保 driver 和 worker 使用相同版本
 os.environ['PYSPARK_PYTHON'] = '/opt/anaconda3/envs/sparrow/bin/python'
@@ -26,14 +27,32 @@ from pyspark import SparkConf
 from pyspark.sql import SparkSession
 from pyspark.sql.functions import *
 from pyspark.sql.types import *
+from pyspark.sql.window import Window
 from pyspark.ml.feature import BucketedRandomProjectionLSH
 from pyspark.mllib.feature import Word2Vec
+from pyspark.ml.functions import vector_to_array
 from pyspark.ml.linalg import Vectors
+from pyspark.ml.stat import Summarizer
 import random
+import time
 from collections import defaultdict
 import numpy as np
 from pyspark.sql import functions as F
 
+from EmbeddingStore import exportEmbeddings, vectorsToMatrix
+from LshTuning import LSH_MODEL_DIR, loadLshParams
+from ProductQuantizer import quantizeEmbeddings
+from RedisPublisher import RedisPublisher
+from UserEmbUpdater import saveUserState, userStatePath
+from RandomWalk import AliasWalkEngine, Node2VecWalkEngine, distributedRandomWalk, parallelRandomWalk
+from SkipGram import SkipGramTrainer
+from TransitionGraph import buildTransitionGraph
+from WalkCorpus import readWalkCorpus, writeWalkCorpus
+
+# 原始数据统一由 util/MovieLensLoader 加载 (显式 Schema + Parquet 缓存)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'util'))
+from MovieLensLoader import loadRatings
+
 
 class UdfFunction:
     """
@@ -75,7 +94,33 @@ class UdfFunction:
         return [x[0] for x in pairs]
 
 
-def processItemSequence(spark, rawSampleDataPath):
+def sortedMovieIds(movieCol="movieId", timestampCol="timestamp"):
+    """
+    UdfFunction.sortF 的 Spark 原生实现，用在 groupBy 之后的 agg 中
+
+    做法: collect_list 收集 (timestamp, movieId) 结构体，sort_array 按结构体字段依次升序排序
+    (先比较 timestamp，相同时再比较 movieId)，最后取出 movieId 字段组成数组
+
+    为什么比 UDF 快？
+    - Python UDF 需要把每个用户的两个列表序列化后发给 Python 进程，排好序再传回 JVM
+    - 这里的排序全部在 JVM 内完成，没有 Python 进程和序列化开销，Catalyst 也能继续优化整个计划
+
+    与 sortF 的区别:
+    - CSV 读入的 timestamp 是字符串，sortF 按字符串字典序比较，'999999999' 会排在 '1000000000' 之后；
+      这里先转成 long 再比较，得到的是真正的时间顺序
+    - 时间戳相同时，sortF 保留 collect_list 的收集顺序 (不确定)，这里按 movieId 排序，结果是确定的
+
+    返回:
+        Column，按时间升序排列的 movieId 字符串数组
+    """
+    return F.sort_array(F.collect_list(F.struct(F.col(timestampCol).cast("long").alias("ts"),
+                                                F.col(movieCol).cast("string").alias("movieId")))) \
+        .getField("movieId")
+
+
+def processItemSequence(spark, rawSampleDataPath, sessionGapSeconds=None, maxSequenceLength=None,
+                        longSequencePolicy='chunk', minSequenceLength=1, numPartitions=None,
+                        reportStats=False):
     """
     处理原始评分数据，生成用户的观影序列
     
@@ -89,12 +134,31 @@ def processItemSequence(spark, rawSampleDataPath):
     - 在推荐场景中，用户连续观看的电影之间可能存在某种关联
     - 保持时序可以捕捉用户的兴趣演化和物品之间的转移关系
     
+    会话切分与长度控制:
+    - 默认每个用户的全部历史 (可能跨越好几年) 是一条序列，少数重度用户的序列极长，
+      构建序列时成为长尾任务，Word2Vec 也在毫无关联的远距离上下文上浪费计算
+    - sessionGapSeconds: 相邻两次评分间隔超过它时切成新的会话，每个会话是一条序列
+    - maxSequenceLength: 序列长度上限，超长的会话按 longSequencePolicy 处理:
+        'chunk':    按时间顺序切成多段，每段不超过 maxSequenceLength
+        'truncate': 只保留最近的 maxSequenceLength 部电影
+    - minSequenceLength: 丢弃更短的序列 (切分后只剩 1 部电影的序列对 Word2Vec 没有上下文)
+    会话编号和段内位置用窗口函数在 JVM 中计算，窗口按 userId 分区，
+    后面按 (userId, sessionId, chunkId) 分组聚合时不会再产生一次 Shuffle
+    
     参数:
         spark: SparkSession 实例
         rawSampleDataPath: 原始评分数据文件路径 (CSV格式)
+        sessionGapSeconds: 会话切分的不活跃间隔 (秒)，None 表示不切分
+        maxSequenceLength: 序列长度上限，None 表示不限制
+        longSequencePolicy: 'chunk' 或 'truncate'
+        minSequenceLength: 最短序列长度
+        numPartitions: 设置后把序列轮询 (round-robin) 重新分区，同一重度用户切出的多段序列
+            会分散到不同分区，而不是全部留在按 userId 哈希到的那个分区
+        reportStats: 是否打印并附带序列长度分布和分区均衡情况 (见 sequenceStats)
     
     返回:
-        RDD，每个元素是一个用户的观影序列列表，如 ['858', '50', '593', '457']
+        RDD，每个元素是一条观影序列列表，如 ['858', '50', '593', '457']；
+        reportStats=True 时返回 (RDD, 统计字典)
     
     数据流程图:
         原始数据 -> 筛选高分 -> 按用户分组 -> 时间排序 -> 生成序列
@@ -106,34 +170,156 @@ def processItemSequence(spark, rawSampleDataPath):
         └─────────────────────┘        │['10','20','30']        │  用户3
                                        └────────────────────────┘
     """
-    # 读取CSV格式的评分数据
-    # 数据格式: userId, movieId, rating, timestamp
-    ratingSamples = spark.read.format("csv").option("header", "true").load(rawSampleDataPath)
+    # 读取评分数据 (第一次运行时转换为 Parquet 缓存，之后直接读取缓存)
+    # 数据格式: userId int, movieId int, rating double, timestamp long
+    ratingSamples = loadRatings(spark, rawSampleDataPath)
     
-    # 注册自定义排序函数为 Spark UDF
-    # ArrayType(StringType()) 表示返回值是字符串数组类型
-    sortUdf = udf(UdfFunction.sortF, ArrayType(StringType()))
-    
-    # 数据处理流水线:
+    # 数据处理流水线 (按时间排序由 sortedMovieIds 用 Spark 内置函数完成，不需要注册 Python UDF):
     userSeq = ratingSamples \
         .where(F.col("rating") >= 3.5) \
         .groupBy("userId") \
-        .agg(sortUdf(F.collect_list("movieId"), F.collect_list("timestamp")).alias('movieIds')) \
+        .agg(sortedMovieIds().alias('movieIds')) \
         .withColumn("movieIdStr", array_join(F.col("movieIds"), " "))
     # 解释:
     # 1. where(rating >= 3.5): 只保留评分>=3.5的记录，过滤掉用户不感兴趣的电影
-    #    注意: CSV 读取的 rating 是字符串类型，Spark 会自动进行类型转换后比较
+    #    rating 已由 loadRatings 按 Schema 读成 double，直接按数值比较
     # 2. groupBy("userId"): 按用户ID分组
-    # 3. collect_list(): 将每个用户的movieId和timestamp收集成列表
-    # 4. sortUdf(): 调用自定义函数按时间排序
-    # 5. array_join(): 将数组转换为空格分隔的字符串，方便后续处理
+    # 3. sortedMovieIds(): collect_list 收集每个用户的 (timestamp, movieId)，sort_array 按时间排序，
+    #    取出 movieId 字符串数组 (见 sortedMovieIds 的说明)
+    # 4. array_join(): 将数组转换为空格分隔的字符串，方便后续处理
+    
+    if sessionGapSeconds is not None or maxSequenceLength is not None:
+        userSeq = sessionSequences(ratingSamples.where(F.col("rating") >= 3.5), sessionGapSeconds,
+                                   maxSequenceLength, longSequencePolicy)
+    if minSequenceLength > 1:
+        userSeq = userSeq.where(F.size("movieIds") >= minSequenceLength)
     
     # 返回 RDD 格式的观影序列
     # 每个元素是一个列表，如 ['858', '50', '593', '457']
-    return userSeq.select('movieIdStr').rdd.map(lambda x: x[0].split(' '))
+    samples = userSeq.select('movieIdStr').rdd.map(lambda x: x[0].split(' '))
+    if numPartitions is not None:
+        samples = samples.repartition(numPartitions)
+    if reportStats:
+        return samples, sequenceStats(samples)
+    return samples
+
+
+def sessionSequences(ratingSamples, sessionGapSeconds, maxSequenceLength, longSequencePolicy='chunk'):
+    """
+    按不活跃间隔把用户历史切成会话，并对超长会话分段或截断
+
+    每条评分依次计算:
+    - sessionId: 与前一条评分的间隔超过 sessionGapSeconds 时加 1 (lag + 累加和)
+    - chunkId:   在会话内按时间的位置 / maxSequenceLength ('chunk')；
+                 'truncate' 时只保留会话内最近的 maxSequenceLength 条，chunkId 恒为 0
+
+    参数:
+        ratingSamples: 已经筛选过高分的评分 DataFrame (userId, movieId, rating, timestamp)
+
+    返回:
+        DataFrame (userId, sessionId, chunkId, movieIds, movieIdStr)，每行一条序列
+    """
+    if longSequencePolicy not in ('chunk', 'truncate'):
+        raise ValueError("longSequencePolicy must be 'chunk' or 'truncate', got %r" % (longSequencePolicy,))
+    rated = ratingSamples.withColumn("ts", F.col("timestamp").cast("long"))
+    userWindow = Window.partitionBy("userId").orderBy("ts", "movieId")
+    if sessionGapSeconds is not None:
+        newSession = (F.col("ts") - F.lag("ts").over(userWindow) > sessionGapSeconds).cast("int")
+        rated = rated.withColumn("sessionId", F.sum(F.coalesce(newSession, F.lit(0))).over(
+            userWindow.rowsBetween(Window.unboundedPreceding, Window.currentRow)))
+    else:
+        rated = rated.withColumn("sessionId", F.lit(0))
+
+    if maxSequenceLength is None:
+        rated = rated.withColumn("chunkId", F.lit(0))
+    elif longSequencePolicy == 'chunk':
+        sessionWindow = Window.partitionBy("userId", "sessionId").orderBy("ts", "movieId")
+        rated = rated.withColumn("chunkId", F.floor((F.row_number().over(sessionWindow) - 1) / maxSequenceLength))
+    else:
+        recentWindow = Window.partitionBy("userId", "sessionId").orderBy(F.col("ts").desc(), F.col("movieId").desc())
+        rated = rated.where(F.row_number().over(recentWindow) <= maxSequenceLength).withColumn("chunkId", F.lit(0))
+
+    return rated.groupBy("userId", "sessionId", "chunkId") \
+        .agg(sortedMovieIds().alias("movieIds")) \
+        .withColumn("movieIdStr", array_join(F.col("movieIds"), " "))
+
+
+def sequenceStats(samples, percentiles=(50, 90, 99)):
+    """
+    统计观影序列的长度分布和分区均衡情况
+
+    - 长度分布: 序列数、总长度、均值、分位数、最大值
+    - 分区均衡: 每个分区的电影总数 (正比于该分区 Word2Vec / 图构建的工作量)，
+      skew = 最大分区 / 平均分区，越接近 1 越均衡，远大于 1 说明存在长尾任务
+
+    参数:
+        samples: processItemSequence 返回的 RDD
+
+    返回:
+        字典
+    """
+    lengths = np.array(samples.map(len).collect(), dtype=np.int64)
+    partitionTokens = np.array(samples.mapPartitions(lambda rows: [sum(len(row) for row in rows)]).collect(),
+                               dtype=np.int64)
+    stats = {
+        'sequences': int(len(lengths)),
+        'tokens': int(lengths.sum()),
+        'meanLength': float(lengths.mean()) if len(lengths) else 0.0,
+        'maxLength': int(lengths.max()) if len(lengths) else 0,
+        'partitions': int(len(partitionTokens)),
+        'maxPartitionTokens': int(partitionTokens.max()) if len(partitionTokens) else 0,
+        'partitionSkew': float(partitionTokens.max() / max(partitionTokens.mean(), 1e-12))
+        if len(partitionTokens) else 0.0,
+    }
+    for p in percentiles:
+        stats['p%dLength' % p] = float(np.percentile(lengths, p)) if len(lengths) else 0.0
+    print("item sequence stats:", stats)
+    return stats
+
+
+def benchmarkSortedMovieIds(spark, rawSampleDataPath):
+    """
+    在完整评分数据上对比 sortF UDF 与 sortedMovieIds 的结果和耗时
+
+    结果检查:
+    - 参照实现是一个按 (long 时间戳, movieId) 排序的 Python UDF，原生实现必须与它逐个用户完全一致
+    - 另外统计旧版 sortF (字符串时间戳) 与原生实现顺序不同的用户数，即旧实现排错的用户数
+
+    计时用 noop 输出强制计算所有列，避免优化器把没用到的 UDF 列裁剪掉
+
+    返回:
+        字典，包含两种实现的耗时、加速比、不一致的用户数
+    """
+    ratingSamples = loadRatings(spark, rawSampleDataPath).where(F.col("rating") >= 3.5).cache()
+    ratingSamples.count()
+
+    sortUdf = udf(UdfFunction.sortF, ArrayType(StringType()))
+    referenceUdf = udf(lambda movies, timestamps: [m for _, m in sorted(zip(timestamps, movies))],
+                       ArrayType(StringType()))
+    legacy = ratingSamples.groupBy("userId") \
+        .agg(sortUdf(F.collect_list(F.col("movieId").cast("string")),
+                     F.collect_list(F.col("timestamp").cast("string"))).alias("movieIds"))
+    native = ratingSamples.groupBy("userId").agg(sortedMovieIds().alias("movieIds"))
+    reference = ratingSamples.groupBy("userId") \
+        .agg(referenceUdf(F.collect_list(F.col("movieId").cast("string")), F.collect_list("timestamp"))
+             .alias("movieIds"))
+
+    timings = {}
+    for name, df in (('udfSeconds', legacy), ('nativeSeconds', native)):
+        startTime = time.time()
+        df.write.format("noop").mode("overwrite").save()
+        timings[name] = time.time() - startTime
+
+    mismatchUsers = native.exceptAll(reference).count() + reference.exceptAll(native).count()
+    legacyOrderUsers = native.exceptAll(legacy).count()
+    ratingSamples.unpersist()
+    result = dict(timings, speedup=timings['udfSeconds'] / timings['nativeSeconds'],
+                  mismatchUsers=mismatchUsers, legacyMisorderedUsers=legacyOrderUsers)
+    print("sortF vs sortedMovieIds:", result)
+    return result
 
 
-def embeddingLSH(spark, movieEmbMap):
+def embeddingLSH(spark, movieEmbMap, indexPath=None):
     """
     使用 LSH (Locality Sensitive Hashing，局部敏感哈希) 对电影 Embedding 进行索引
     
@@ -157,6 +343,8 @@ def embeddingLSH(spark, movieEmbMap):
     参数:
         spark: SparkSession 实例
         movieEmbMap: 字典，key 是电影ID，value 是 Embedding 向量列表
+        indexPath: LSH 索引目录 (可选)。目录中有 LshTuning.tuneEmbeddingLSH 保存的 lshParams.json 时，
+                   使用调优选出的 bucketLength / numHashTables；训练好的模型保存到 indexPath/model
     """
     # 将字典格式的 Embedding 转换为 DataFrame 格式
     movieEmbSeq = []
@@ -174,15 +362,24 @@ def embeddingLSH(spark, movieEmbMap):
     # outputCol: 输出的桶ID列名
     # bucketLength: 桶的宽度，值越小桶越多，精度越高但速度越慢
     # numHashTables: 哈希表数量，数量越多召回率越高但速度越慢
+    # 没有调优结果时使用默认值 bucketLength=0.1, numHashTables=3
+    lshParams = loadLshParams(indexPath)
+    print("LSH params: bucketLength=%s, numHashTables=%s" % (lshParams['bucketLength'], lshParams['numHashTables']))
     bucketProjectionLSH = BucketedRandomProjectionLSH(
         inputCol="emb", 
         outputCol="bucketId", 
-        bucketLength=0.1,  # 桶宽度
-        numHashTables=3     # 使用3个独立的哈希表
+        bucketLength=lshParams['bucketLength'],    # 桶宽度
+        numHashTables=lshParams['numHashTables']   # 独立哈希表的个数
     )
+    if 'seed' in lshParams:
+        # 与调优时使用相同的随机投影，调优测得的召回率才能复现
+        bucketProjectionLSH.setSeed(lshParams['seed'])
     
     # 训练 LSH 模型 (学习投影向量)
     bucketModel = bucketProjectionLSH.fit(movieEmbDF)
+    if indexPath:
+        # 模型与 lshParams.json 放在同一目录下
+        bucketModel.write().overwrite().save(os.path.join(indexPath, LSH_MODEL_DIR))
     
     # 对所有电影 Embedding 进行转换，得到桶ID
     embBucketResult = bucketModel.transform(movieEmbDF)
@@ -200,7 +397,8 @@ def embeddingLSH(spark, movieEmbMap):
     bucketModel.approxNearestNeighbors(movieEmbDF, sampleEmb, 5).show(truncate=False)
 
 
-def trainItem2vec(spark, samples, embLength, embOutputPath, saveToRedis, redisKeyPrefix):
+def trainItem2vec(spark, samples, embLength, embOutputPath, saveToRedis, redisKeyPrefix, backend='mllib',
+                  exportFormat='text', pqSubspaces=None, redisClient=None, lshIndexPath=None):
     """
     训练 Item2Vec 模型，学习物品的 Embedding 向量
     
@@ -228,20 +426,45 @@ def trainItem2vec(spark, samples, embLength, embOutputPath, saveToRedis, redisKe
     
     参数:
         spark: SparkSession 实例
-        samples: RDD，每个元素是一个物品序列列表
+        samples: RDD，每个元素是一个物品序列列表；
+                 也可以是 WalkCorpus.writeWalkCorpus 写出的语料目录，此时按分片惰性读取
         embLength: Embedding 向量的维度 (通常 10-300)
         embOutputPath: Embedding 向量的输出文件路径
-        saveToRedis: 是否保存到 Redis (当前未实现)
+        saveToRedis: 是否保存到 Redis，key 为 <redisKeyPrefix>:<movieId>，值为 "v1 v2 ..."，
+                     通过 RedisPublisher 管道批量写入，24 小时过期
         redisKeyPrefix: Redis 键前缀
+        backend: 训练后端
+                 'mllib' (默认): pyspark.mllib.feature.Word2Vec，适合大规模分布式训练
+                 'numpy': SkipGram.SkipGramTrainer，单机纯 NumPy 多线程训练，
+                          省去 JVM 序列化和向量回收的开销，适合单机放得下的物品库
+        exportFormat: 输出格式，见 EmbeddingStore.exportEmbeddings
+                      'text' (默认): movieId:emb1 emb2 ... 文本文件
+                      'binary': float32 矩阵 + ID 索引，可用 EmbeddingStore.load 零拷贝加载
+                      'both': 两种都写
+        pqSubspaces: 设置后额外做乘积量化 (见 ProductQuantizer)，每个向量压缩为 pqSubspaces 个 uint8，
+                     写出 item2vecEmb.pq.npz 并打印内存节省与召回损失；embLength 必须能被它整除
+        redisClient: saveToRedis 时使用的客户端，默认连接 localhost:6379；
+                     也可以传入 RedisPublisher.InMemoryRedis 在本地运行
+        lshIndexPath: LSH 索引目录，传给 embeddingLSH: 读取其中 LshTuning 调优保存的 lshParams.json，
+                      训练好的 LSH 模型保存在同一目录下；不设置时使用默认参数且不保存模型
     
     返回:
-        训练好的 Word2Vec 模型
+        训练好的 Word2Vec 模型 (numpy 后端返回接口相同的 SkipGramModel)
     """
+    # 传入的是游走语料目录时，转换为按分片惰性读取的 RDD
+    if isinstance(samples, str):
+        samples = readWalkCorpus(spark, samples)
+    
     # 创建 Word2Vec 模型并设置参数
-    word2vec = Word2Vec() \
-        .setVectorSize(embLength) \
-        .setWindowSize(5) \
-        .setNumIterations(10)
+    if backend == 'numpy':
+        word2vec = SkipGramTrainer(vectorSize=embLength, windowSize=5, numIterations=10)
+        # 本地训练器接收本地序列列表
+        samples = samples.collect()
+    else:
+        word2vec = Word2Vec() \
+            .setVectorSize(embLength) \
+            .setWindowSize(5) \
+            .setNumIterations(10)
     # 参数说明:
     # - VectorSize: Embedding 向量维度，维度越高表达能力越强，但训练越慢
     # - WindowSize: 上下文窗口大小，决定了考虑多少个相邻物品
@@ -259,19 +482,20 @@ def trainItem2vec(spark, samples, embLength, embOutputPath, saveToRedis, redisKe
         print(synonym, cosineSimilarity)
     
     # 保存 Embedding 向量到文件
-    # 创建输出目录
-    embOutputDir = '/'.join(embOutputPath.split('/')[:-1])
-    if not os.path.exists(embOutputDir):
-        os.makedirs(embOutputDir)
-    
-    # 写入文件，格式: movieId:emb1 emb2 emb3 ...
-    with open(embOutputPath, 'w') as f:
-        for movie_id in model.getVectors():
-            vectors = " ".join([str(emb) for emb in model.getVectors()[movie_id]])
-            f.write(movie_id + ":" + vectors + "\n")
+    # getVectors() 每次调用都要从 JVM 重新取回整个向量表，所以只调用一次，
+    # 再一次性转换成 (ID 列表, float32 矩阵)
+    movieEmbMap = model.getVectors()
+    movieIds, embMatrix = vectorsToMatrix(movieEmbMap)
+    
+    # 文本格式: movieId:emb1 emb2 emb3 ...；二进制格式: item2vecEmb.emb + item2vecEmb.ids
+    exportEmbeddings(embOutputPath, movieIds, embMatrix, exportFormat=exportFormat)
+    if pqSubspaces:
+        quantizeEmbeddings(embOutputPath, movieIds, embMatrix, pqSubspaces)
+    if saveToRedis:
+        RedisPublisher(redisClient).publishEmbeddings(redisKeyPrefix, movieIds, embMatrix)
     
     # 使用 LSH 对 Embedding 建立索引，用于快速相似搜索
-    embeddingLSH(spark, model.getVectors())
+    embeddingLSH(spark, movieEmbMap, indexPath=lshIndexPath)
     
     return model
 
@@ -333,6 +557,11 @@ def generateTransitionMatrix(samples):
     参数:
         samples: RDD，每个元素是一个物品序列
     
+    注意:
+        countByValue 会把全部物品对的计数拉回 Driver，并用嵌套字典存储，
+        只适合小规模数据。graphEmb 使用 TransitionGraph.buildTransitionGraph，
+        它在集群上聚合计数并输出紧凑的 CSR 结构
+    
     返回:
         transitionMatrix: 转移概率矩阵，transitionMatrix[i][j] = P(j|i)
         itemDistribution: 物品分布，itemDistribution[i] = 物品 i 作为起点的概率
@@ -473,7 +702,8 @@ def oneRandomWalk(transitionMatrix, itemDistribution, sampleLength):
     return sample
 
 
-def randomWalk(transitionMatrix, itemDistribution, sampleCount, sampleLength):
+def randomWalk(transitionMatrix, itemDistribution, sampleCount, sampleLength, engine='alias', seed=None,
+               numWorkers=None):
     """
     批量执行随机游走，生成多条采样序列
     
@@ -482,22 +712,42 @@ def randomWalk(transitionMatrix, itemDistribution, sampleCount, sampleLength):
     - 多次游走从不同起点出发，可以更全面地覆盖图结构
     - 更多的样本有助于 Word2Vec 学习更准确的向量表示
     
+    三种游走引擎:
+    - 'alias' (默认): 预先构建 alias 表，每步采样 O(1)，见 RandomWalk.AliasWalkEngine
+    - 'multiprocess': alias 引擎 + 单机进程池，子进程通过共享内存访问转移图，
+      适合 setMaster('local') 的单机运行，见 RandomWalk.parallelRandomWalk
+    - 'roulette': 逐条调用 oneRandomWalk，每步线性扫描，仅用于对照和基准测试
+    
     参数:
         transitionMatrix: 转移概率矩阵
         itemDistribution: 物品分布
         sampleCount: 游走次数 (生成多少条序列)
         sampleLength: 每条游走序列的长度
+        engine: 游走引擎，'alias'、'multiprocess' 或 'roulette'
+        seed: alias 引擎的随机种子，相同种子生成相同的游走
+        numWorkers: 'multiprocess' 模式的进程数，默认使用全部 CPU 核心
     
     返回:
         samples: 所有随机游走序列的列表
     """
+    if engine == 'multiprocess':
+        walkEngine = AliasWalkEngine.fromTransitionMatrix(transitionMatrix, itemDistribution)
+        return parallelRandomWalk(walkEngine, sampleCount, sampleLength, numWorkers=numWorkers, seed=seed or 0)
+    if engine == 'alias':
+        walkEngine = AliasWalkEngine.fromTransitionMatrix(transitionMatrix, itemDistribution, seed=seed)
+        return walkEngine.walks(sampleCount, sampleLength)
+    
     samples = []
     for i in range(sampleCount):
         samples.append(oneRandomWalk(transitionMatrix, itemDistribution, sampleLength))
     return samples
 
 
-def graphEmb(samples, spark, embLength, embOutputFilename, saveToRedis, redisKeyPrefix):
+def graphEmb(samples, spark, embLength, embOutputFilename, saveToRedis, redisKeyPrefix, walkSeed=0,
+             walkCorpusDir=None, walkCorpusFormat='text', sampleCount=20000, sampleLength=10,
+             transitionGraph=None, pruneTopK=None, pruneMinCount=None, popularityDamping=None,
+             walkP=1.0, walkQ=1.0, exportFormat='text', pqSubspaces=None, redisClient=None,
+             walkMode='distributed', numWorkers=None, lshIndexPath=None):
     """
     Graph Embedding (图嵌入) - DeepWalk 算法实现
     
@@ -521,25 +771,70 @@ def graphEmb(samples, spark, embLength, embOutputFilename, saveToRedis, redisKey
         embOutputFilename: 输出文件路径
         saveToRedis: 是否保存到 Redis
         redisKeyPrefix: Redis 键前缀
+        walkSeed: 随机游走的基础种子，每个分区在此基础上派生自己的种子
+        walkCorpusDir: 设置后，游走语料由 Driver 流式写入该目录的分片压缩文件，
+                       再由 trainItem2vec 惰性读取，内存占用与 sampleCount 无关
+        walkCorpusFormat: 游走语料格式，'text' 或 'int32'
+        sampleCount: 随机游走条数
+        sampleLength: 每条游走的长度
+        transitionGraph: 已有的转移图 (如 TransitionGraph.IncrementalGraphStore 增量维护的图)，
+                         传入时跳过 Step 1，samples 参数不再使用
+        pruneTopK: 每个节点最多保留的出边数，限制热门电影的出度
+        pruneMinCount: 出现次数低于该值的转移边视为噪声丢弃
+        popularityDamping: 热度衰减指数，降低热门终点的转移权重
+        walkP, walkQ: node2vec 的返回参数 p 和进出参数 q，
+                      默认都为 1，即一阶 DeepWalk 游走；否则使用二阶有偏游走
+        exportFormat: Embedding 输出格式 'text' / 'binary' / 'both'
+        pqSubspaces: 设置后对输出的 Embedding 做乘积量化，见 trainItem2vec
+        redisClient: saveToRedis 时使用的客户端，见 trainItem2vec
+        walkMode: 未设置 walkCorpusDir 时游走的生成方式
+                  'distributed' (默认): 广播游走引擎，在各个 Executor 上生成，见 RandomWalk.distributedRandomWalk
+                  'multiprocess': 在 Driver 上用进程池经共享内存生成，再 parallelize 成 RDD，
+                                  适合 setMaster('local') 的单机运行，见 RandomWalk.parallelRandomWalk
+        numWorkers: 'multiprocess' 模式的进程数，默认使用全部 CPU 核心
+        lshIndexPath: LSH 索引目录，见 trainItem2vec
     """
-    # Step 1: 从原始序列构建转移矩阵
-    transitionMatrix, itemDistribution = generateTransitionMatrix(samples)
-    
-    # Step 2: 设置随机游走参数
-    sampleCount = 20000   # 生成 20000 条随机游走序列
-    sampleLength = 10     # 每条序列长度为 10
-    
-    # Step 3: 执行随机游走，生成新序列
-    newSamples = randomWalk(transitionMatrix, itemDistribution, sampleCount, sampleLength)
-    
-    # Step 4: 将新序列转换为 RDD 格式
-    rddSamples = spark.sparkContext.parallelize(newSamples)
-    
-    # Step 5: 使用随机游走序列训练 Word2Vec
-    trainItem2vec(spark, rddSamples, embLength, embOutputFilename, saveToRedis, redisKeyPrefix)
+    if walkMode not in ('distributed', 'multiprocess'):
+        raise ValueError("walkMode must be 'distributed' or 'multiprocess', got %r" % walkMode)
+    # Step 1: 从原始序列分布式地构建 CSR 转移图
+    # 相比 generateTransitionMatrix，物品对在集群上聚合，Driver 只持有紧凑的 NumPy 数组
+    if transitionGraph is None:
+        transitionGraph = buildTransitionGraph(samples)
+    print("transition graph ready, " + transitionGraph.summary())
+    if pruneTopK or pruneMinCount or popularityDamping:
+        transitionGraph = transitionGraph.prune(pruneTopK, pruneMinCount, popularityDamping)
+        print("transition graph pruned, " + transitionGraph.summary())
+    
+    # Step 2: 构建 alias 游走引擎
+    # 默认 sampleCount=20000 条随机游走序列，每条长度 sampleLength=10
+    if walkP == 1.0 and walkQ == 1.0:
+        walkEngine = AliasWalkEngine.fromGraph(transitionGraph, seed=walkSeed)
+    else:
+        # node2vec 二阶游走，拒绝采样实现，内存仍为 O(边数)
+        walkEngine = Node2VecWalkEngine.fromGraph(transitionGraph, seed=walkSeed, p=walkP, q=walkQ)
+    
+    # Step 3: 生成随机游走语料
+    if walkCorpusDir:
+        # 流式写入分片文件，训练时惰性读取，适合千万级以上的游走数
+        writeWalkCorpus(walkEngine, walkCorpusDir, sampleCount, sampleLength, corpusFormat=walkCorpusFormat)
+        walkSamples = walkCorpusDir
+    elif walkMode == 'multiprocess':
+        # 单机多进程生成，子进程共享同一份 CSR + alias 数组
+        walks = parallelRandomWalk(walkEngine, sampleCount, sampleLength, numWorkers=numWorkers, seed=walkSeed)
+        walkSamples = spark.sparkContext.parallelize(walks)
+    else:
+        # 广播到各个 Executor 上分布式生成游走，Driver 不持有整个语料
+        walkSamples = distributedRandomWalk(spark, walkEngine, sampleCount, sampleLength, seed=walkSeed)
+    
+    # Step 4: 使用随机游走序列训练 Word2Vec
+    trainItem2vec(spark, walkSamples, embLength, embOutputFilename, saveToRedis, redisKeyPrefix,
+                  exportFormat=exportFormat, pqSubspaces=pqSubspaces, redisClient=redisClient,
+                  lshIndexPath=lshIndexPath)
 
 
-def generateUserEmb(spark, rawSampleDataPath, model, embLength, embOutputPath, saveToRedis, redisKeyPrefix):
+def generateUserEmb(spark, rawSampleDataPath, model, embLength, embOutputPath, saveToRedis, redisKeyPrefix,
+                    exportFormat='text', pqSubspaces=None, poolingModes=('sum',), decayHalfLifeDays=30.0,
+                    userEmbOutputDir=None, redisClient=None, saveUserState=False):
     """
     生成用户 Embedding 向量
     
@@ -553,7 +848,7 @@ def generateUserEmb(spark, rawSampleDataPath, model, embLength, embOutputPath, s
     3. 加权平均: 根据用户对物品的评分或交互时间进行加权
     4. 注意力机制: 使用神经网络学习不同物品的重要性权重
     
-    本函数使用求和方法:
+    本函数默认使用求和方法 (也可以通过 poolingModes 选择其他池化方式):
     UserEmb = Σ ItemEmb (对用户观看过的所有电影)
     
     优点:
@@ -574,46 +869,181 @@ def generateUserEmb(spark, rawSampleDataPath, model, embLength, embOutputPath, s
         embOutputPath: 输出文件路径
         saveToRedis: 是否保存到 Redis
         redisKeyPrefix: Redis 键前缀
+        exportFormat: 输出格式 'text' / 'binary' / 'both'，见 EmbeddingStore.exportEmbeddings
+        pqSubspaces: 设置后对用户表做乘积量化，写出 userEmb.pq.npz，
+                     并报告压缩后 user -> item 召回的损失
+        poolingModes: 池化方式，可以同时计算多种: 'sum' (默认)、'mean'、'ratingWeighted'、'timeDecay'，
+                      见 aggregateUserEmb；写入 embOutputPath 的是第一种
+        decayHalfLifeDays: 'timeDecay' 池化的半衰期 (天)
+        userEmbOutputDir: 设置后由 Executor 分区写出所有池化方式的结果 (见 writeUserEmbPartitions)；
+                          此时可以把 embOutputPath 设为 None，完全不经过 Driver
+        redisClient: saveToRedis 时使用的客户端，见 trainItem2vec
+        saveUserState: 同时写出第一种池化方式的每用户增量状态 (见 aggregateUserEmbState) 到
+                       userEmb.state.npz，UserEmbUpdater 以它为起点继续消费实时评分
     
     数据流程:
-        评分数据 + 物品Embedding -> Join -> 按用户聚合求和 -> 用户Embedding
+        评分数据 + 物品Embedding (广播) -> Join -> 按用户聚合 (JVM 内) -> 用户Embedding
+    
+    返回:
+        用户 Embedding 的 DataFrame (userId + 每种池化方式一列)
     """
     # 读取评分数据
-    ratingSamples = spark.read.format("csv").option("header", "true").load(rawSampleDataPath)
-    
-    # 将模型中的物品 Embedding 转换为列表格式
-    Vectors_list = []
-    for key, value in model.getVectors().items():
-        Vectors_list.append((key, list(value)))
-    
-    # 定义 DataFrame Schema
-    fields = [
-        StructField('movieId', StringType(), False),      # 电影ID
-        StructField('emb', ArrayType(FloatType()), False) # Embedding 向量
-    ]
-    schema = StructType(fields)
-    
-    # 创建物品 Embedding 的 DataFrame
-    Vectors_df = spark.createDataFrame(Vectors_list, schema=schema)
-    
-    # 将评分数据与物品 Embedding 进行 Join
-    # Inner Join 确保只保留有 Embedding 的电影
-    ratingSamples = ratingSamples.join(Vectors_df, on='movieId', how='inner')
-    
-    # 按用户聚合，对物品 Embedding 求和
-    # 1. 选择 userId 和 emb 列
-    # 2. 转换为 (userId, emb) 的 RDD
-    # 3. reduceByKey: 将同一用户的所有物品 Embedding 逐元素相加
-    result = ratingSamples.select('userId', 'emb').rdd \
-        .map(lambda x: (x[0], x[1])) \
-        .reduceByKey(lambda a, b: [a[i] + b[i] for i in range(len(a))]) \
-        .collect()
-    
-    # 保存用户 Embedding 到文件
-    with open(embOutputPath, 'w') as f:
-        for row in result:
-            vectors = " ".join([str(emb) for emb in row[1]])
-            f.write(row[0] + ":" + vectors + "\n")
+    ratingSamples = loadRatings(spark, rawSampleDataPath)
+    
+    # 将模型中的物品 Embedding 转换为 (ID 列表, 矩阵)，只调用一次 getVectors()
+    movieIds, itemEmbMatrix = vectorsToMatrix(model.getVectors())
+    
+    # 在 JVM 内按用户聚合，一次 groupBy 同时得到所有池化方式的结果
+    userEmb = aggregateUserEmb(spark, ratingSamples, movieIds, itemEmbMatrix, poolingModes, decayHalfLifeDays)
+    
+    # 分布式输出: 各个 Executor 直接写出自己负责的分区，数据不经过 Driver
+    if userEmbOutputDir:
+        writeUserEmbPartitions(userEmb, userEmbOutputDir, poolingModes)
+    
+    # 单文件输出 (在线服务加载的 userEmb.csv) 和 Redis: 只把第一种池化方式的结果收集到 Driver
+    if embOutputPath or saveToRedis:
+        result = userEmb.select('userId', poolingModes[0]).collect()
+        # userId 在 typed loader 中是 int，Embedding 文件 / Redis key 统一使用字符串ID
+        userIds = [str(row[0]) for row in result]
+        # aggregateUserEmb 输出的已经是 float32 数组；文本、二进制、PQ 和 Redis 共用这一个 float32 矩阵，
+        # 文件与 Redis 中的字符串完全相同 (与 trainItem2vec 一致)
+        userEmbMatrix = np.asarray([row[1] for row in result], dtype=np.float32).reshape(len(result), embLength)
+    if embOutputPath:
+        exportEmbeddings(embOutputPath, userIds, userEmbMatrix, exportFormat=exportFormat)
+        if pqSubspaces:
+            quantizeEmbeddings(embOutputPath, userIds, userEmbMatrix, pqSubspaces, itemVectors=itemEmbMatrix)
+        if saveUserState:
+            saveUserEmbState(spark, ratingSamples, movieIds, itemEmbMatrix, embOutputPath, poolingModes[0],
+                             decayHalfLifeDays)
+    if saveToRedis:
+        # 在线服务按 uEmb:<userId> 读取用户 Embedding
+        RedisPublisher(redisClient).publishEmbeddings(redisKeyPrefix, userIds, userEmbMatrix)
+    return userEmb
+
+
+USER_EMB_POOLING_MODES = ('sum', 'mean', 'ratingWeighted', 'timeDecay')
+
+
+def aggregateUserEmb(spark, ratingSamples, movieIds, itemEmbMatrix, poolingModes=('sum',), decayHalfLifeDays=30.0):
+    """
+    在 JVM 内聚合用户 Embedding，支持多种池化方式
+
+    原来的做法是把 (userId, emb) 转成 RDD，在 Python 里 reduceByKey 逐元素相加，
+    每条评分都要在 JVM 和 Python 之间序列化一次。这里改用 Spark ML 的 Summarizer:
+    - 物品 Embedding 表很小，广播 (broadcast) 到每个 Executor，与评分表 Join 时不需要 Shuffle 评分表
+    - Summarizer 是 JVM 内的向量聚合器，支持带权重的 sum / mean
+    - 所有池化方式放在同一个 agg 中，只做一次 groupBy (一次 Shuffle)
+
+    池化方式 (poolingModes 中的取值):
+        'sum':            Σ e_i，与原实现相同
+        'mean':           Σ e_i / n
+        'ratingWeighted': Σ r_i * e_i / Σ r_i，评分越高的电影权重越大
+        'timeDecay':      Σ w_i * e_i / Σ w_i，w_i = 0.5 ^ ((T - t_i) / 半衰期)，
+                          T 为数据中最晚的评分时间，越近期的行为权重越大
+
+    参数:
+        ratingSamples: 评分 DataFrame (userId, movieId, rating, timestamp)
+        movieIds, itemEmbMatrix: 物品 ID 列表和 Embedding 矩阵
+        poolingModes: 需要计算的池化方式
+        decayHalfLifeDays: timeDecay 的半衰期 (天)
+
+    返回:
+        DataFrame，列为 userId 以及每种池化方式一列 (float 数组)
+    """
+    unknownModes = [mode for mode in poolingModes if mode not in USER_EMB_POOLING_MODES]
+    if unknownModes or not poolingModes:
+        raise ValueError("poolingModes must be a non-empty subset of %s, got %s"
+                         % (USER_EMB_POOLING_MODES, list(poolingModes)))
+    
+    samples = joinItemEmb(spark, ratingSamples, movieIds, itemEmbMatrix)
+    
+    if 'timeDecay' in poolingModes:
+        latestTimestamp = samples.agg(F.max('timestamp')).head()[0]
+        halfLifeSeconds = decayHalfLifeDays * 24 * 3600
+        samples = samples.withColumn(
+            'decayWeight', F.pow(F.lit(0.5), (F.lit(latestTimestamp) - F.col('timestamp')) / F.lit(halfLifeSeconds)))
+    
+    poolingColumns = {
+        'sum': lambda: Summarizer.sum(F.col('emb')),
+        'mean': lambda: Summarizer.mean(F.col('emb')),
+        'ratingWeighted': lambda: Summarizer.mean(F.col('emb'), F.col('rating')),
+        'timeDecay': lambda: Summarizer.mean(F.col('emb'), F.col('decayWeight')),
+    }
+    userEmb = samples.groupBy('userId').agg(*[poolingColumns[mode]().alias(mode) for mode in poolingModes])
+    return userEmb.select('userId', *[vector_to_array(F.col(mode), 'float32').alias(mode) for mode in poolingModes])
+
+
+def joinItemEmb(spark, ratingSamples, movieIds, itemEmbMatrix):
+    """评分表与广播的物品 Embedding 表 Join，没有 Embedding 的电影被丢弃 (inner join)"""
+    itemEmbDF = spark.createDataFrame(
+        [(movieId, Vectors.dense(vector.tolist())) for movieId, vector in zip(movieIds, itemEmbMatrix)],
+        ['movieId', 'emb'])
+    return ratingSamples \
+        .select('userId', F.col('movieId').cast('string').alias('movieId'),
+                F.col('rating').cast('double').alias('rating'),
+                F.col('timestamp').cast('long').alias('timestamp')) \
+        .join(F.broadcast(itemEmbDF), on='movieId', how='inner')
+
+
+def aggregateUserEmbState(spark, ratingSamples, movieIds, itemEmbMatrix, poolingMode='sum', decayHalfLifeDays=30.0):
+    """
+    按 UserEmbUpdater 的状态定义聚合每个用户的 sums / weights / refTime
+
+    与 aggregateUserEmb 输出的向量一致 (sum 输出 sums，其余输出 sums / weights)，区别在于:
+    timeDecay 以每个用户自己最晚的评分时间为参考时间，而不是全局最晚时间。
+    两者只差一个对 sums 和 weights 相同的缩放，比值不变，但增量更新时新事件按用户的参考时间衰减旧状态。
+
+    返回:
+        DataFrame，列为 userId, sums (double 数组), weight, refTime
+    """
+    if poolingMode not in USER_EMB_POOLING_MODES:
+        raise ValueError("poolingMode must be one of %s, got %r" % (USER_EMB_POOLING_MODES, poolingMode))
+    samples = joinItemEmb(spark, ratingSamples, movieIds, itemEmbMatrix)
+    if poolingMode == 'timeDecay':
+        halfLifeSeconds = decayHalfLifeDays * 24 * 3600
+        userLatest = F.max('timestamp').over(Window.partitionBy('userId'))
+        weight = F.pow(F.lit(0.5), (userLatest - F.col('timestamp')) / F.lit(halfLifeSeconds))
+    elif poolingMode == 'ratingWeighted':
+        weight = F.col('rating')
+    else:
+        weight = F.lit(1.0)
+    samples = samples.withColumn('weight', weight)
+    return samples.groupBy('userId').agg(
+        vector_to_array(Summarizer.sum(F.col('emb'), F.col('weight'))).alias('sums'),
+        F.sum('weight').alias('weight'),
+        F.max('timestamp').alias('refTime'))
+
+
+def saveUserEmbState(spark, ratingSamples, movieIds, itemEmbMatrix, embOutputPath, poolingMode, decayHalfLifeDays):
+    """
+    写出 UserEmbUpdater 的初始状态 (userEmb.state.npz)
+
+    watermark 为批量数据中最晚的评分时间，更新器只消费晚于它的事件，已经计入批量结果的评分不会被重复累加
+    """
+    result = aggregateUserEmbState(spark, ratingSamples, movieIds, itemEmbMatrix, poolingMode,
+                                   decayHalfLifeDays).collect()
+    refTimes = [row['refTime'] for row in result]
+    saveUserState(userStatePath(embOutputPath), [str(row['userId']) for row in result],
+                  np.asarray([row['sums'] for row in result], dtype=np.float64).reshape(len(result), -1),
+                  [row['weight'] for row in result], refTimes, poolingMode, decayHalfLifeDays * 24 * 3600,
+                  watermark=max(refTimes) if refTimes else None)
+
+
+def writeUserEmbPartitions(userEmb, outputDir, poolingModes):
+    """
+    由各个 Executor 并行写出用户 Embedding，不经过 Driver
+
+    目录结构:
+        outputDir/parquet/part-*.parquet        userId + 每种池化方式一列 float 数组
+        outputDir/<poolingMode>/part-*          文本，每行 "userId:v1 v2 ..."，与 userEmb.csv 格式相同
+    """
+    userEmb = userEmb.cache()
+    userEmb.write.mode('overwrite').parquet(outputDir + '/parquet')
+    for mode in poolingModes:
+        userEmb.select(F.concat(F.col('userId').cast('string'), F.lit(':'),
+                                F.array_join(F.col(mode).cast('array<string>'), ' ')).alias('value')) \
+            .write.mode('overwrite').text(outputDir + '/' + mode)
+    userEmb.unpersist()
 
 
 # =====================================================================================
@@ -665,7 +1095,9 @@ if __name__ == '__main__':
         embLength,
         embOutputPath=file_path[7:] + "/webroot/modeldata2/item2vecEmb.csv",
         saveToRedis=False,
-        redisKeyPrefix="i2vEmb"
+        redisKeyPrefix="i2vEmb",
+        # 先运行 LshTuning.py 把调优参数写入该目录，LSH 模型会保存在它旁边
+        lshIndexPath=file_path[7:] + "/webroot/modeldata2/item2vecLsh"
     )
     
     # ========== Step 5: 训练 Graph Embedding ==========
@@ -675,7 +1107,9 @@ if __name__ == '__main__':
         spark, 
         embLength, 
         embOutputFilename=file_path[7:] + "/webroot/modeldata2/itemGraphEmb.csv",
-        saveToRedis=True, 
+        # 写入 Redis 需要 redis-py 和运行中的 redis-server (localhost:6379)；
+        # 本地演示可以改为 saveToRedis=True 并传入 redisClient=InMemoryRedis()
+        saveToRedis=False,
         redisKeyPrefix="graphEmb"
     )
     
@@ -688,5 +1122,7 @@ if __name__ == '__main__':
         embLength,
         embOutputPath=file_path[7:] + "/webroot/modeldata2/userEmb.csv",
         saveToRedis=False,
-        redisKeyPrefix="uEmb"
+        redisKeyPrefix="uEmb",
+        # 写出 userEmb.state.npz，UserEmbUpdater 从这里继续消费实时评分
+        saveUserState=True
     )
@@ -0,0 +1,379 @@
+"""
+=====================================================================================
+EmbeddingStore.py - Embedding 的二进制导出与内存映射 (mmap) 加载
+
+文本格式 "movieId:v1 v2 ..." 可读性好，但有两个问题:
+- 写出和解析都要做浮点数 <-> 字符串转换，物品多、维度高时很慢
+- 加载时必须把整个文件解析进内存，每个进程都有一份拷贝
+
+本模块提供一种二进制格式，由两个文件组成:
+
+    <basePath>.emb   固定 64 字节的文件头 + float32 行优先矩阵 (count x dim)
+    <basePath>.ids   物品ID，每行一个，第 i 行对应矩阵的第 i 行
+
+文件头布局 (小端序):
+    偏移  类型      含义
+    0     8 字节    魔数 b'SPRWEMB\\0'
+    8     uint32    格式版本号 (当前为 1)
+    12    uint32    维度 dim
+    16    uint64    向量个数 count
+    24    uint32    标志位，bit0 = 1 表示向量已做 L2 归一化
+    28    36 字节   保留，填 0
+
+加载时矩阵部分通过 np.memmap 直接映射到内存，不做任何拷贝:
+- 打开文件几乎不花时间，只有真正访问到的页才会从磁盘读入
+- 多个进程加载同一个文件时共享操作系统的页缓存
+=====================================================================================
+"""
+
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'SPRWEMB\0'
+FORMAT_VERSION = 1
+HEADER_FORMAT = '<8sIIQI36x'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+FLAG_NORMALIZED = 1
+
+EMB_SUFFIX = '.emb'
+IDS_SUFFIX = '.ids'
+
+
+def vectorsToMatrix(vectors):
+    """
+    把 {物品ID: 向量} 字典转换为 (物品ID列表, float32 矩阵)
+
+    只遍历一次 vectors，适用于 Word2VecModel.getVectors() 和 SkipGramModel.getVectors() 的返回值
+    """
+    itemIds = []
+    rows = []
+    for itemId, vector in vectors.items():
+        itemIds.append(str(itemId))
+        rows.append(list(vector))
+    return itemIds, np.asarray(rows, dtype=np.float32).reshape(len(itemIds), -1)
+
+
+def writeTextEmbeddings(path, itemIds, matrix):
+    """
+    以文本格式写出 Embedding，每行 "movieId:v1 v2 ..."，与原有的 csv 输出格式一致
+
+    float32 矩阵逐个元素用 np.float32 的 str 输出最短且能精确还原的小数 (如 -0.4448335)，
+    与 Scala 版本写出的文件一致；float64 矩阵按 Python float 输出
+
+    先写临时文件再 os.replace，在线服务重新加载时不会读到写了一半的文件
+    """
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'w') as f:
+        for itemId, row in zip(itemIds, matrix):
+            f.write(str(itemId) + ":" + formatEmbedding(row) + "\n")
+    os.replace(tmpPath, path)
+
+
+def formatEmbedding(row):
+    """把一个向量格式化为空格分隔的字符串 "v1 v2 ..."，文本文件和 Redis 中的值都使用这种格式"""
+    values = row if row.dtype == np.float32 else row.tolist()
+    return " ".join([str(emb) for emb in values])
+
+
+def readTextEmbeddings(path):
+    """
+    读取文本格式的 Embedding 文件，同一个ID出现多次时取最后一行
+
+    返回:
+        (物品ID列表, float32 矩阵)
+    """
+    itemIds = []
+    rows = []
+    index = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            itemId, values = line.split(':', 1)
+            vector = np.array(values.split(), dtype=np.float32)
+            # TextEmbeddingAppender 追加的更新行: 同一个ID以最后一行为准
+            if itemId in index:
+                rows[index[itemId]] = vector
+                continue
+            index[itemId] = len(itemIds)
+            itemIds.append(itemId)
+            rows.append(vector)
+    return itemIds, np.asarray(rows, dtype=np.float32).reshape(len(itemIds), -1)
+
+
+def writeEmbeddings(basePath, itemIds, matrix, normalize=False):
+    """
+    以二进制格式写出 Embedding
+
+    参数:
+        basePath: 输出路径 (不含扩展名)，生成 basePath.emb 和 basePath.ids
+        itemIds: 物品ID列表，长度等于矩阵行数
+        matrix: 二维数组 (count x dim)
+        normalize: 是否先做 L2 归一化。归一化后内积即余弦相似度，
+                   近邻检索时可以省掉每次查询的归一化
+
+    先写临时文件再 os.replace，读取方不会看到写了一半的文件
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if matrix.ndim != 2 or matrix.shape[0] != len(itemIds):
+        raise ValueError("matrix must be 2-D with one row per item, got shape %s for %d items"
+                         % (matrix.shape, len(itemIds)))
+    if normalize:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.maximum(norms, 1e-12)
+
+    outputDir = os.path.dirname(os.path.abspath(basePath))
+    if not os.path.exists(outputDir):
+        os.makedirs(outputDir)
+
+    flags = FLAG_NORMALIZED if normalize else 0
+    header = struct.pack(HEADER_FORMAT, MAGIC, FORMAT_VERSION, matrix.shape[1], matrix.shape[0], flags)
+    tmpPath = basePath + EMB_SUFFIX + '.tmp'
+    with open(tmpPath, 'wb') as f:
+        f.write(header)
+        matrix.tofile(f)
+    tmpIdsPath = basePath + IDS_SUFFIX + '.tmp'
+    with open(tmpIdsPath, 'w') as f:
+        for itemId in itemIds:
+            f.write(str(itemId) + "\n")
+    os.replace(tmpIdsPath, basePath + IDS_SUFFIX)
+    os.replace(tmpPath, basePath + EMB_SUFFIX)
+
+
+def readHeader(embPath):
+    """
+    读取并校验 .emb 文件头
+
+    返回:
+        字典 {'version', 'dim', 'count', 'normalized'}
+    """
+    with open(embPath, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+    if len(raw) != HEADER_SIZE:
+        raise ValueError("%s is too short to be an embedding file" % embPath)
+    magic, version, dim, count, flags = struct.unpack(HEADER_FORMAT, raw)
+    if magic != MAGIC:
+        raise ValueError("%s is not an embedding file (bad magic %r)" % (embPath, magic))
+    if version > FORMAT_VERSION:
+        raise ValueError("%s has format version %d, newest supported is %d" % (embPath, version, FORMAT_VERSION))
+    # 文件可以比 count 描述的更长: upsertEmbeddings 先追加数据、最后才更新 count
+    expectedSize = HEADER_SIZE + dim * count * 4
+    if os.path.getsize(embPath) < expectedSize:
+        raise ValueError("%s should hold at least %d bytes for %d x %d vectors, found %d"
+                         % (embPath, expectedSize, count, dim, os.path.getsize(embPath)))
+    return {'version': version, 'dim': dim, 'count': count, 'normalized': bool(flags & FLAG_NORMALIZED)}
+
+
+def upsertEmbeddings(basePath, itemIds, matrix):
+    """
+    就地更新二进制 Embedding 库中的部分向量，不存在的物品追加到末尾
+
+    - 已有的物品: 按行偏移直接覆盖对应的行，代价只与更新的行数有关
+    - 新物品: 追加到 .emb 与 .ids 的末尾，最后再更新文件头中的 count
+      (先写数据再改 count，已经打开的读取方仍然看到完整的旧视图)；
+      打开时先把两个文件截断到文件头记录的 count 行，丢弃上一次中断的追加留下的孤立行
+    - 库不存在时等同于 writeEmbeddings
+
+    库的归一化标志为真时，写入前同样做 L2 归一化。
+    每次调用都要读取整个 .ids 文件，反复更新同一个库时使用 EmbeddingStoreWriter
+    """
+    EmbeddingStoreWriter(basePath).upsert(itemIds, matrix)
+
+
+class EmbeddingStoreWriter(object):
+    """
+    反复 upsert 同一个二进制 Embedding 库时使用
+
+    物品ID -> 行号的索引在打开时读取一次，之后常驻内存，每次 upsert 的代价只与更新的行数有关。
+    假定打开之后只有这一个写入方；库被 writeEmbeddings 整体重写后需要重新创建
+    """
+
+    def __init__(self, basePath):
+        self.basePath = basePath
+        self.header = None
+        self.itemIds = []
+        self.index = {}
+        if os.path.exists(basePath + EMB_SUFFIX):
+            self.open()
+
+    def open(self):
+        header = readHeader(self.basePath + EMB_SUFFIX)
+        count = header['count']
+        with open(self.basePath + IDS_SUFFIX, 'rb') as f:
+            idLines = f.read().split(b"\n")[:count]
+        # 只有前 count 行是已提交的，截掉中断的追加留下的孤立行，保证 .emb 与 .ids 的行号一一对应
+        with open(self.basePath + EMB_SUFFIX, 'r+b') as f:
+            f.truncate(HEADER_SIZE + count * header['dim'] * 4)
+        with open(self.basePath + IDS_SUFFIX, 'r+b') as f:
+            f.truncate(sum(len(line) + 1 for line in idLines))
+        self.header = header
+        self.itemIds = [line.decode('utf-8') for line in idLines]
+        self.index = {itemId: row for row, itemId in enumerate(self.itemIds)}
+
+    def upsert(self, itemIds, matrix):
+        itemIds = [str(itemId) for itemId in itemIds]
+        if self.header is None:
+            writeEmbeddings(self.basePath, itemIds, matrix)
+            self.open()
+            return
+        dim = self.header['dim']
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[1] != dim or matrix.shape[0] != len(itemIds):
+            raise ValueError("expected %d x %d matrix for the upsert, got shape %s"
+                             % (len(itemIds), dim, matrix.shape))
+        if self.header['normalized']:
+            matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+        # 新物品在本批中出现多次时只追加一行，取最后一次的向量
+        added = {}
+        with open(self.basePath + EMB_SUFFIX, 'r+b') as f:
+            for i, itemId in enumerate(itemIds):
+                row = self.index.get(itemId)
+                if row is None:
+                    added[itemId] = i
+                    continue
+                f.seek(HEADER_SIZE + row * dim * 4)
+                f.write(matrix[i].tobytes())
+        if added:
+            with open(self.basePath + EMB_SUFFIX, 'ab') as f:
+                matrix[list(added.values())].tofile(f)
+            with open(self.basePath + IDS_SUFFIX, 'a') as f:
+                f.write("".join(itemId + "\n" for itemId in added))
+            count = self.header['count'] + len(added)
+            flags = FLAG_NORMALIZED if self.header['normalized'] else 0
+            with open(self.basePath + EMB_SUFFIX, 'r+b') as f:
+                f.write(struct.pack(HEADER_FORMAT, MAGIC, FORMAT_VERSION, dim, count, flags))
+            for itemId in added:
+                self.index[itemId] = len(self.itemIds)
+                self.itemIds.append(itemId)
+            self.header['count'] = count
+
+
+class TextEmbeddingAppender(object):
+    """
+    增量更新文本格式的 Embedding 文件: 更新过的行追加到文件末尾，不重写整个文件
+
+    同一个ID出现多次时以最后一行为准 (readTextEmbeddings 和 Java 端 DataManager 都逐行读取，后面的行覆盖前面的)。
+    追加的行数超过不同ID的个数时整体压缩重写一次 (临时文件 + os.replace)，
+    文件最多是压缩后的两倍大，重写的代价均摊到每条追加的行上是 O(1)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.itemIds = set()
+        self.lineCount = 0
+        if os.path.exists(path):
+            with open(path, 'r+b') as f:
+                data = f.read()
+                # 截掉中断的追加留下的半行
+                complete = data[:data.rfind(b'\n') + 1]
+                f.truncate(len(complete))
+            for line in complete.decode('utf-8').splitlines():
+                if line.strip():
+                    self.itemIds.add(line.split(':', 1)[0])
+                    self.lineCount += 1
+
+    def append(self, itemIds, matrix):
+        itemIds = [str(itemId) for itemId in itemIds]
+        with open(self.path, 'a') as f:
+            f.write("".join(itemId + ":" + formatEmbedding(row) + "\n" for itemId, row in zip(itemIds, matrix)))
+        self.itemIds.update(itemIds)
+        self.lineCount += len(itemIds)
+        if self.lineCount > 2 * len(self.itemIds):
+            self.compact()
+
+    def compact(self):
+        itemIds, matrix = readTextEmbeddings(self.path)
+        writeTextEmbeddings(self.path, itemIds, matrix)
+        self.lineCount = len(itemIds)
+
+
+class EmbeddingStore(object):
+    """
+    以内存映射方式打开的只读 Embedding 库
+
+    属性:
+        itemIds: 物品ID列表 (行号 -> 物品ID)
+        index: 字典 (物品ID -> 行号)
+        vectors: np.memmap，形状 (count, dim)，只读，与磁盘文件零拷贝共享
+        dim, count, normalized, version: 文件头中的信息
+
+    用法:
+        store = EmbeddingStore.load('modeldata2/item2vecEmb')
+        store['158']               # 单个向量
+        store.lookup(['1', '2'])   # 批量取向量，返回 (k, dim) 矩阵
+    """
+
+    def __init__(self, itemIds, vectors, header):
+        self.itemIds = itemIds
+        self.index = {itemId: row for row, itemId in enumerate(itemIds)}
+        self.vectors = vectors
+        self.dim = header['dim']
+        self.count = header['count']
+        self.normalized = header['normalized']
+        self.version = header['version']
+
+    @classmethod
+    def load(cls, basePath):
+        """
+        打开 writeEmbeddings 写出的文件，矩阵部分只做内存映射，不读入内存
+        """
+        embPath = basePath + EMB_SUFFIX
+        header = readHeader(embPath)
+        with open(basePath + IDS_SUFFIX) as f:
+            # 只取前 count 个ID，忽略正在追加、尚未计入文件头的部分
+            itemIds = [line.rstrip("\n") for line in f][:header['count']]
+        if len(itemIds) != header['count']:
+            raise ValueError("%s lists %d ids but %s holds %d vectors"
+                             % (basePath + IDS_SUFFIX, len(itemIds), embPath, header['count']))
+        if header['count'] == 0:
+            vectors = np.zeros((0, header['dim']), dtype=np.float32)
+        else:
+            vectors = np.memmap(embPath, dtype=np.float32, mode='r', offset=HEADER_SIZE,
+                                shape=(header['count'], header['dim']))
+        return cls(itemIds, vectors, header)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, itemId):
+        return itemId in self.index
+
+    def __getitem__(self, itemId):
+        return self.vectors[self.index[itemId]]
+
+    def lookup(self, itemIds):
+        """
+        批量取向量，返回 (len(itemIds), dim) 的矩阵 (一次花式索引，会拷贝这几行)
+        """
+        return self.vectors[[self.index[itemId] for itemId in itemIds]]
+
+    def toDict(self):
+        """
+        转换为 {物品ID: 向量列表}，与 model.getVectors() 的返回格式一致
+        """
+        return {itemId: self.vectors[row].tolist() for row, itemId in enumerate(self.itemIds)}
+
+
+def exportEmbeddings(embOutputPath, itemIds, matrix, exportFormat='text', normalize=False):
+    """
+    按 exportFormat 写出 Embedding，供 trainItem2vec / generateUserEmb 使用
+
+    参数:
+        embOutputPath: 文本格式的输出路径，如 .../item2vecEmb.csv；
+                       二进制文件写到去掉扩展名的同名路径，如 .../item2vecEmb.emb / .ids
+        exportFormat: 'text' (默认，兼容原有格式)、'binary' 或 'both'
+        normalize: 二进制格式是否做 L2 归一化
+    """
+    if exportFormat not in ('text', 'binary', 'both'):
+        raise ValueError("exportFormat must be 'text', 'binary' or 'both', got %r" % exportFormat)
+    outputDir = os.path.dirname(os.path.abspath(embOutputPath))
+    if not os.path.exists(outputDir):
+        os.makedirs(outputDir)
+    if exportFormat in ('text', 'both'):
+        writeTextEmbeddings(embOutputPath, itemIds, matrix)
+    if exportFormat in ('binary', 'both'):
+        writeEmbeddings(os.path.splitext(embOutputPath)[0], itemIds, matrix, normalize=normalize)
@@ -0,0 +1,178 @@
+"""
+=====================================================================================
+LshTuning.py - embeddingLSH 的参数扫描与自动调优
+
+embeddingLSH 写死了 bucketLength=0.1、numHashTables=3，既不知道召回率，也不知道代价。
+本模块在真实的 Embedding 文件上扫描这两个参数，对每组参数测量:
+    - recall@K:    与精确最近邻 (欧氏距离，和 approxNearestNeighbors 的排序依据一致) 相比的召回率
+    - candidates:  每次查询需要计算精确距离的候选物品数 (查询代价的主要来源)
+    - buildSeconds: fit + transform 的耗时
+    - queryMs:     真实调用 approxNearestNeighbors 的单次查询耗时
+然后选出满足目标召回率、候选集最小 (代价最低) 的参数，与 LSH 模型一起保存。
+
+候选集的计算方式与 Spark 的 approxNearestNeighbors (singleProbe) 相同:
+    1. 对每个物品求 hashDistance = min_t |h_t(物品) - h_t(查询)|，t 遍历所有哈希表
+    2. 取 hashDistance 的 (K / N + 0.05) 分位数作为阈值，保留 hashDistance <= 阈值的物品
+    3. 只对这些候选计算精确距离，取最近的 K 个
+哈希值直接来自 Spark 训练出的模型 (transform 的结果)，因此测到的召回率就是 Spark 上的真实召回率；
+只把候选筛选这一步搬到 NumPy 中批量完成，几百次查询几秒钟就能算完。
+
+调优结果保存在 indexPath/lshParams.json；trainItem2vec / graphEmb 的 lshIndexPath 设为同一目录时，
+embeddingLSH 会读取它，并把用这些参数训练的 LSH 模型保存到 indexPath/model
+=====================================================================================
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+from AnnIndex import loadEmbeddingMatrix, recallAtK, topKRows
+
+LSH_PARAMS_FILE = 'lshParams.json'
+LSH_MODEL_DIR = 'model'
+DEFAULT_LSH_PARAMS = {'bucketLength': 0.1, 'numHashTables': 3}
+# approxNearestNeighbors 中分位数的相对误差，与 Spark 源码中的常量一致
+SPARK_RELATIVE_ERROR = 0.05
+
+
+def loadLshParams(indexPath):
+    """读取 indexPath/lshParams.json，不存在时返回 embeddingLSH 原来的默认参数"""
+    paramsPath = os.path.join(indexPath, LSH_PARAMS_FILE) if indexPath else None
+    if not paramsPath or not os.path.exists(paramsPath):
+        return dict(DEFAULT_LSH_PARAMS)
+    with open(paramsPath) as f:
+        return json.load(f)
+
+
+def saveLshParams(indexPath, params):
+    """把选定的参数 (以及调优时的测量结果) 写入 indexPath/lshParams.json"""
+    if not os.path.exists(indexPath):
+        os.makedirs(indexPath)
+    tmpPath = os.path.join(indexPath, LSH_PARAMS_FILE + '.tmp')
+    with open(tmpPath, 'w') as f:
+        json.dump(params, f, indent=2)
+    os.replace(tmpPath, os.path.join(indexPath, LSH_PARAMS_FILE))
+
+
+def sparkCandidates(hashes, queryHashes, k):
+    """
+    按 approxNearestNeighbors (singleProbe) 的规则为每个查询筛选候选物品
+
+    参数:
+        hashes: 所有物品的哈希值矩阵 (N x numHashTables)
+        queryHashes: 查询的哈希值矩阵 (Q x numHashTables)
+
+    返回:
+        列表，每个元素为一个查询的候选行号数组
+    """
+    numItems = len(hashes)
+    quantile = k / numItems + SPARK_RELATIVE_ERROR
+    candidates = []
+    for queryHash in queryHashes:
+        hashDistance = np.abs(hashes - queryHash).min(axis=1)
+        if quantile >= 1:
+            candidates.append(np.arange(numItems))
+            continue
+        threshold = np.sort(hashDistance)[max(0, int(np.ceil(quantile * numItems)) - 1)]
+        candidates.append(np.flatnonzero(hashDistance <= threshold))
+    return candidates
+
+
+def evaluateLshConfig(spark, embDf, vectors, queryRows, exactRows, k, bucketLength, numHashTables,
+                      numLatencyQueries=3, seed=0):
+    """
+    测量一组 LSH 参数的召回率、候选集大小、构建耗时和查询延迟
+
+    参数:
+        embDf: DataFrame (row, emb)，row 为 vectors 中的行号
+        queryRows: 查询物品的行号
+        exactRows: 这些查询的精确 K 近邻行号
+        numLatencyQueries: 真实调用 approxNearestNeighbors 测延迟的次数 (每次都是一个 Spark 作业)
+    """
+    from pyspark.ml.feature import BucketedRandomProjectionLSH
+    from pyspark.ml.linalg import Vectors
+
+    startTime = time.time()
+    model = BucketedRandomProjectionLSH(inputCol='emb', outputCol='bucketId', bucketLength=bucketLength,
+                                        numHashTables=numHashTables, seed=seed).fit(embDf)
+    hashed = model.transform(embDf).cache()
+    hashRows = hashed.select('row', 'bucketId').collect()
+    buildSeconds = time.time() - startTime
+
+    hashes = np.zeros((len(vectors), numHashTables))
+    for record in hashRows:
+        hashes[record['row']] = [bucket[0] for bucket in record['bucketId']]
+
+    candidates = sparkCandidates(hashes, hashes[queryRows], k)
+    approxRows = np.full((len(queryRows), k), -1, dtype=np.int64)
+    for q, candidateRows in enumerate(candidates):
+        distances = np.linalg.norm(vectors[candidateRows] - vectors[queryRows[q]], axis=1)
+        top, _ = topKRows(-distances[None, :], k)
+        approxRows[q, :top.shape[1]] = candidateRows[top[0]]
+
+    latencies = []
+    for queryRow in queryRows[:numLatencyQueries]:
+        startTime = time.time()
+        model.approxNearestNeighbors(hashed, Vectors.dense(vectors[queryRow].tolist()), k).collect()
+        latencies.append(time.time() - startTime)
+    hashed.unpersist()
+
+    return {
+        'bucketLength': bucketLength,
+        'numHashTables': numHashTables,
+        'recall': recallAtK(approxRows, exactRows),
+        'meanCandidates': float(np.mean([len(c) for c in candidates])),
+        'buildSeconds': buildSeconds,
+        'queryMs': float(np.median(latencies) * 1000) if latencies else None,
+    }
+
+
+def tuneEmbeddingLSH(spark, embPath, targetRecall=0.9, k=5, bucketLengths=(0.05, 0.1, 0.2, 0.5, 1.0, 2.0),
+                     numHashTablesList=(1, 2, 3, 5, 8), numQueries=200, numLatencyQueries=3, indexPath=None, seed=0):
+    """
+    扫描 bucketLength x numHashTables，选出满足目标召回率且候选集最小的参数
+
+    参数:
+        embPath: Embedding 文件 (item2vecEmb.csv / itemGraphEmb.csv 或 .emb)
+        targetRecall: 目标 recall@k
+        k: 近邻数，默认与 embeddingLSH 演示中的 5 一致
+        indexPath: 设置后把选定参数和全部测量结果写入 indexPath/lshParams.json
+
+    返回:
+        (选定的参数字典, 全部参数组合的测量结果列表)；
+        没有任何组合达到目标召回率时，选召回率最高的一组
+    """
+    from pyspark.ml.linalg import Vectors
+
+    itemIds, vectors = loadEmbeddingMatrix(embPath)
+    vectors = vectors.astype(np.float64)
+    embDf = spark.createDataFrame([(row, Vectors.dense(vector.tolist())) for row, vector in enumerate(vectors)],
+                                  ['row', 'emb']).cache()
+    rng = np.random.default_rng(seed)
+    queryRows = rng.choice(len(vectors), min(numQueries, len(vectors)), replace=False)
+    squaredNorms = (vectors ** 2).sum(axis=1)
+    # 欧氏距离的平方 = |q|^2 - 2 q·x + |x|^2，取负数后按"越大越近"求 Top-K
+    exactRows, _ = topKRows(-(squaredNorms[queryRows, None] - 2 * vectors[queryRows] @ vectors.T + squaredNorms), k)
+
+    results = []
+    for bucketLength in bucketLengths:
+        for numHashTables in numHashTablesList:
+            result = evaluateLshConfig(spark, embDf, vectors, queryRows, exactRows, k, bucketLength, numHashTables,
+                                       numLatencyQueries, seed)
+            print(result)
+            results.append(result)
+    embDf.unpersist()
+
+    qualified = [r for r in results if r['recall'] >= targetRecall]
+    if qualified:
+        best = min(qualified, key=lambda r: (r['meanCandidates'], r['numHashTables'], r['queryMs'] or 0))
+    else:
+        best = max(results, key=lambda r: (r['recall'], -r['meanCandidates']))
+    chosen = {'bucketLength': best['bucketLength'], 'numHashTables': best['numHashTables'],
+              'seed': seed, 'k': k, 'targetRecall': targetRecall, 'metTarget': bool(qualified),
+              'embPath': embPath, 'numItems': len(itemIds), 'chosen': best, 'sweep': results}
+    if indexPath:
+        saveLshParams(indexPath, chosen)
+    return chosen, results
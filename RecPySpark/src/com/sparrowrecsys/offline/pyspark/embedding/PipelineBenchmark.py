@@ -0,0 +1,226 @@
+"""
+=====================================================================================
+PipelineBenchmark.py - Embedding.py 流水线的分阶段计时与扩展性测试
+
+Embedding.py 的主流程依次运行 processItemSequence、trainItem2vec、graphEmb、generateUserEmb，
+没有任何计时。本模块在不同的数据规模下逐个运行这些阶段，记录:
+    - wallSeconds:        阶段耗时
+    - pythonPeakRssBytes: Driver 端 Python 进程的峰值内存 (RSS)
+    - jvmPeakRssBytes:    Driver 端 JVM 进程 (Python 进程的子进程) 的峰值内存
+    - shuffleReadBytes / shuffleWriteBytes: 该阶段所有 Spark 作业的 Shuffle 读写量
+结果写入 JSON 报告，可以看出评分数据量增长时哪个阶段最先撑不住。
+
+数据放大方式 (scaleFactor):
+    把 ratings.csv 复制 scaleFactor 份，第 k 份的 userId 加上 k * (最大 userId + 1)，
+    相当于用户数放大 scaleFactor 倍，每个用户的行为分布不变，物品数不变
+
+测量方式:
+    - 峰值内存: 后台线程每 50ms 采样一次 RSS (psutil)，取阶段内的最大值
+    - Shuffle: 每个阶段设置独立的 job group，结束后从 Spark UI 的 REST 接口
+      (/api/v1/applications/<appId>/jobs 与 /stages) 汇总该 job group 下所有 stage 的 Shuffle 读写量；
+      UI 未开启时这两项为 None
+
+用法:
+    python PipelineBenchmark.py <ratings.csv> <输出目录> [scaleFactor ...]
+=====================================================================================
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from urllib.request import urlopen
+
+import psutil
+from pyspark import SparkConf
+from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
+
+from Embedding import generateUserEmb, graphEmb, processItemSequence, trainItem2vec
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'util'))
+from MovieLensLoader import loadRatings
+
+STAGES = ('processItemSequence', 'trainItem2vec', 'graphEmb', 'generateUserEmb')
+
+
+class PeakRssSampler:
+    """后台线程周期性采样 Python 进程与其子进程 (Driver JVM) 的 RSS，记录峰值"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.pythonPeak = 0
+        self.jvmPeak = 0
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        self.pythonPeak = max(self.pythonPeak, self.process.memory_info().rss)
+        childRss = 0
+        for child in self.process.children(recursive=True):
+            try:
+                childRss += child.memory_info().rss
+            except psutil.Error:
+                pass
+        self.jvmPeak = max(self.jvmPeak, childRss)
+
+    def run(self):
+        while not self.stopEvent.is_set():
+            self.sample()
+            self.stopEvent.wait(self.interval)
+
+    def __enter__(self):
+        self.sample()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopEvent.set()
+        self.thread.join()
+        self.sample()
+
+
+def fetchJson(url):
+    with urlopen(url, timeout=10) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def shuffleBytes(spark, jobGroup):
+    """
+    从 Spark UI 的 REST 接口汇总某个 job group 的 Shuffle 读写字节数
+
+    返回:
+        (shuffleReadBytes, shuffleWriteBytes)，UI 不可用时为 (None, None)
+    """
+    sc = spark.sparkContext
+    if not sc.uiWebUrl:
+        return None, None
+    baseUrl = '%s/api/v1/applications/%s' % (sc.uiWebUrl, sc.applicationId)
+    try:
+        stageIds = set()
+        for job in fetchJson(baseUrl + '/jobs'):
+            if job.get('jobGroup') == jobGroup:
+                stageIds.update(job['stageIds'])
+        readBytes = writeBytes = 0
+        for stage in fetchJson(baseUrl + '/stages'):
+            if stage['stageId'] in stageIds:
+                readBytes += stage.get('shuffleReadBytes', 0)
+                writeBytes += stage.get('shuffleWriteBytes', 0)
+        return readBytes, writeBytes
+    except (IOError, ValueError, KeyError):
+        return None, None
+
+
+def scaleRatings(spark, ratingsPath, scaleFactor, outputDir):
+    """
+    生成放大 scaleFactor 倍 (按用户复制) 的评分数据，写成带表头的单个 CSV 目录
+
+    返回:
+        可以直接传给 processItemSequence / generateUserEmb 的路径
+    """
+    if scaleFactor == 1:
+        return ratingsPath
+    ratings = loadRatings(spark, ratingsPath)
+    userIdSpan = ratings.agg(F.max('userId')).head()[0] + 1
+    copies = spark.range(scaleFactor).withColumnRenamed('id', 'copy')
+    scaled = ratings.crossJoin(copies) \
+        .withColumn('userId', (F.col('userId') + F.col('copy') * userIdSpan).cast('int')) \
+        .select('userId', 'movieId', 'rating', 'timestamp')
+    scaledPath = os.path.join(outputDir, 'ratings_x%d' % scaleFactor)
+    scaled.write.mode('overwrite').option('header', 'true').csv(scaledPath)
+    return scaledPath
+
+
+def runStage(spark, name, func):
+    """运行一个阶段并测量耗时、峰值内存和 Shuffle 字节数；阶段失败时记录异常而不是中断整个测试"""
+    sc = spark.sparkContext
+    jobGroup = 'benchmark-%s-%d' % (name, int(time.time() * 1000))
+    sc.setJobGroup(jobGroup, name)
+    result = None
+    error = None
+    startTime = time.time()
+    with PeakRssSampler() as sampler:
+        try:
+            result = func()
+        except Exception as e:
+            error = '%s: %s' % (type(e).__name__, e)
+    wallSeconds = time.time() - startTime
+    readBytes, writeBytes = shuffleBytes(spark, jobGroup)
+    metrics = {
+        'stage': name,
+        'wallSeconds': wallSeconds,
+        'pythonPeakRssBytes': sampler.pythonPeak,
+        'jvmPeakRssBytes': sampler.jvmPeak,
+        'shuffleReadBytes': readBytes,
+        'shuffleWriteBytes': writeBytes,
+        'error': error,
+    }
+    print(metrics)
+    return result, metrics
+
+
+def materialize(rdd):
+    """processItemSequence 返回惰性 RDD，缓存后用 count 触发计算，让这部分耗时计入本阶段"""
+    rdd.cache().count()
+    return rdd
+
+
+def benchmarkPipeline(spark, ratingsPath, outputDir, scaleFactors=(1, 2, 4), embLength=10):
+    """
+    在每个数据规模下依次运行 Embedding.py 的四个阶段
+
+    某个阶段失败时，同一规模下依赖它的后续阶段会被跳过 (记录 skipped)，
+    更大规模的测试照常进行，报告中可以直接看到从哪个规模开始哪个阶段失败
+
+    返回:
+        报告字典，同时写入 outputDir/pipelineBenchmark.json
+    """
+    if not os.path.exists(outputDir):
+        os.makedirs(outputDir)
+    report = {'ratingsPath': ratingsPath, 'embLength': embLength, 'runs': []}
+    for scaleFactor in scaleFactors:
+        scaledPath = scaleRatings(spark, ratingsPath, scaleFactor, outputDir)
+        embDir = os.path.join(outputDir, 'x%d' % scaleFactor)
+        # 同时建好 Parquet 缓存，CSV 转换的耗时不计入 processItemSequence
+        ratingCount = loadRatings(spark, scaledPath).count()
+        run = {'scaleFactor': scaleFactor, 'ratingCount': ratingCount, 'stages': []}
+
+        samples, metrics = runStage(spark, 'processItemSequence',
+                                    lambda: materialize(processItemSequence(spark, scaledPath)))
+        run['stages'].append(metrics)
+
+        model = None
+        if samples is not None:
+            model, metrics = runStage(spark, 'trainItem2vec', lambda: trainItem2vec(
+                spark, samples, embLength, os.path.join(embDir, 'item2vecEmb.csv'), False, 'i2vEmb'))
+            run['stages'].append(metrics)
+            _, metrics = runStage(spark, 'graphEmb', lambda: graphEmb(
+                samples, spark, embLength, os.path.join(embDir, 'itemGraphEmb.csv'), False, 'graphEmb'))
+            run['stages'].append(metrics)
+        if model is not None:
+            _, metrics = runStage(spark, 'generateUserEmb', lambda: generateUserEmb(
+                spark, scaledPath, model, embLength, os.path.join(embDir, 'userEmb.csv'), False, 'uEmb'))
+            run['stages'].append(metrics)
+        completed = {m['stage'] for m in run['stages']}
+        run['skipped'] = [stage for stage in STAGES if stage not in completed]
+        if samples is not None:
+            samples.unpersist()
+        report['runs'].append(run)
+
+        # 每个规模跑完就写一次报告，后面的规模即使把 Driver 撑爆也能保留已有结果
+        with open(os.path.join(outputDir, 'pipelineBenchmark.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("usage: python PipelineBenchmark.py <ratings.csv> <outputDir> [scaleFactor ...]")
+        sys.exit(1)
+    conf = SparkConf().setAppName('embeddingPipelineBenchmark').setMaster('local[*]')
+    spark = SparkSession.builder.config(conf=conf).getOrCreate()
+    factors = [int(arg) for arg in sys.argv[3:]] or [1, 2, 4]
+    benchmarkPipeline(spark, sys.argv[1], os.path.abspath(sys.argv[2]), factors)
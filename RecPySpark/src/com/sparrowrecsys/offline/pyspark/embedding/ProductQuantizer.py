@@ -0,0 +1,291 @@
+"""
+=====================================================================================
+ProductQuantizer.py - 乘积量化 (Product Quantization, PQ) 压缩 Embedding
+
+用户 Embedding 表是推荐服务器中常驻内存最大的对象: 每个用户 dim 个 float32，即 4 * dim 字节。
+乘积量化把每个向量压缩成 M 个 uint8 编码 (M 字节)，dim=10、M=5 时压缩 8 倍。
+
+PQ 原理:
+    1. 把 dim 维向量切成 M 段，每段 dim/M 维 (子空间)
+    2. 每个子空间独立做 k-means，得到 256 个质心 (码本 codebook)
+    3. 每段子向量用离它最近的质心编号 (0~255，正好 1 个 uint8) 表示
+    向量 ≈ 把 M 个质心拼接起来
+
+非对称距离计算 (Asymmetric Distance Computation, ADC):
+    用户 -> 物品召回时，查询向量 (用户) 保持原始精度，只有物品是压缩的:
+    1. 对每个子空间预先算出查询子向量与 256 个质心的内积，得到 M x 256 的查找表
+    2. 查询与任一物品的内积 = M 次查表再相加，完全不需要解压物品向量
+    查找表只需计算一次，之后每个物品的打分代价是 M 次查表，与 dim 无关
+
+用法:
+    pq = ProductQuantizer(numSubspaces=5).fit(itemMatrix)
+    store = PQEmbeddingStore(itemIds, pq, pq.encode(itemMatrix))
+    store.topK(userVectors, k=10)   # ADC 打分的 user -> item 召回
+    store.save('item2vecEmb.pq.npz')
+=====================================================================================
+"""
+
+import os
+
+import numpy as np
+
+from AnnIndex import recallAtK, topKRows
+
+PQ_SUFFIX = '.pq.npz'
+
+
+def defaultNumSubspaces(dim):
+    """默认每个子空间 2 维 (dim 为奇数时每个子空间 1 维)"""
+    return dim // 2 if dim % 2 == 0 else dim
+
+
+def euclideanKMeans(vectors, numClusters, numIterations=20, seed=0):
+    """
+    标准 k-means (欧氏距离)，返回质心矩阵 (numClusters x dim)
+
+    空簇用随机选取的样本重新初始化
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), numClusters, replace=False)].copy()
+    for _ in range(numIterations):
+        # |x - c|^2 = |x|^2 - 2 x·c + |c|^2，|x|^2 对所有质心相同，可以省略
+        assignment = np.argmin((centroids ** 2).sum(axis=1) - 2 * vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        sizes = np.bincount(assignment, minlength=numClusters)
+        empty = sizes == 0
+        newCentroids = sums / np.maximum(sizes, 1)[:, None]
+        newCentroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        if np.allclose(newCentroids, centroids):
+            break
+        centroids = newCentroids
+    return centroids.astype(np.float32)
+
+
+class ProductQuantizer:
+    """
+    乘积量化器
+
+    参数:
+        numSubspaces: 子空间个数 M，dim 必须能被 M 整除；默认每个子空间 2 维
+        numCentroids: 每个子空间的质心数，最多 256 (编码为 uint8)
+        kmeansIterations: k-means 迭代次数
+        seed: 随机种子
+    """
+
+    def __init__(self, numSubspaces=None, numCentroids=256, kmeansIterations=20, seed=0):
+        if numCentroids > 256:
+            raise ValueError("numCentroids must be <= 256 to fit uint8 codes, got %d" % numCentroids)
+        self.numSubspaces = numSubspaces
+        self.numCentroids = numCentroids
+        self.kmeansIterations = kmeansIterations
+        self.seed = seed
+        self.codebooks = None
+
+    @property
+    def dim(self):
+        return self.codebooks.shape[0] * self.codebooks.shape[2]
+
+    def fit(self, vectors):
+        """训练每个子空间的码本，codebooks 形状为 (M, numCentroids, dim / M)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dim = vectors.shape[1]
+        numSubspaces = self.numSubspaces or defaultNumSubspaces(dim)
+        if dim % numSubspaces != 0:
+            raise ValueError("dimension %d is not divisible by numSubspaces=%d" % (dim, numSubspaces))
+        numCentroids = min(self.numCentroids, len(vectors))
+        subDim = dim // numSubspaces
+        self.numSubspaces = numSubspaces
+        self.codebooks = np.stack([
+            euclideanKMeans(vectors[:, m * subDim:(m + 1) * subDim], numCentroids, self.kmeansIterations,
+                            seed=[self.seed, m])
+            for m in range(numSubspaces)])
+        return self
+
+    def subvectors(self, vectors):
+        """(N, dim) -> (N, M, dim / M)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors.reshape(len(vectors), self.numSubspaces, -1)
+
+    def encode(self, vectors):
+        """把向量编码为 uint8 矩阵 (N x M)"""
+        sub = self.subvectors(vectors)
+        codes = np.empty((len(sub), self.numSubspaces), dtype=np.uint8)
+        for m in range(self.numSubspaces):
+            codebook = self.codebooks[m]
+            codes[:, m] = np.argmin((codebook ** 2).sum(axis=1) - 2 * sub[:, m] @ codebook.T, axis=1)
+        return codes
+
+    def decode(self, codes):
+        """把编码还原为近似向量 (N x dim)"""
+        return self.codebooks[np.arange(self.numSubspaces), codes].reshape(len(codes), -1)
+
+    def innerProductTables(self, queries):
+        """ADC 查找表: tables[q, m, c] = 查询 q 的第 m 段与第 m 个码本第 c 个质心的内积"""
+        return np.einsum('qmd,mcd->qmc', self.subvectors(queries), self.codebooks)
+
+    def adcScores(self, queries, codes):
+        """
+        非对称内积打分: 查询为原始向量，物品为 PQ 编码
+
+        返回:
+            (Q x N) 的内积矩阵
+        """
+        tables = self.innerProductTables(queries)
+        scores = np.zeros((len(tables), len(codes)), dtype=np.float32)
+        for m in range(self.numSubspaces):
+            scores += tables[:, m, codes[:, m]]
+        return scores
+
+    def nbytes(self):
+        return self.codebooks.nbytes
+
+
+class PQEmbeddingStore:
+    """
+    PQ 压缩后的 Embedding 库: 物品ID + uint8 编码 + 码本
+
+    参数:
+        itemIds: 物品ID列表
+        quantizer: 训练好的 ProductQuantizer
+        codes: uint8 编码矩阵 (N x M)
+    """
+
+    def __init__(self, itemIds, quantizer, codes):
+        self.itemIds = [str(itemId) for itemId in itemIds]
+        self.itemIndex = {itemId: row for row, itemId in enumerate(self.itemIds)}
+        self.quantizer = quantizer
+        self.codes = codes
+
+    @classmethod
+    def build(cls, itemIds, vectors, numSubspaces=None, **kwargs):
+        quantizer = ProductQuantizer(numSubspaces, **kwargs).fit(vectors)
+        return cls(itemIds, quantizer, quantizer.encode(vectors))
+
+    def __getitem__(self, itemId):
+        """解压单个向量"""
+        return self.quantizer.decode(self.codes[[self.itemIndex[itemId]]])[0]
+
+    def topK(self, queries, k):
+        """用 ADC 内积打分召回每个查询的 Top-K 物品，返回 (行号矩阵, 内积矩阵)"""
+        return topKRows(self.quantizer.adcScores(np.atleast_2d(queries), self.codes), k)
+
+    def nbytes(self):
+        return self.codes.nbytes + self.quantizer.nbytes()
+
+    def save(self, path):
+        np.savez(path, itemIds=np.array(self.itemIds), codebooks=self.quantizer.codebooks, codes=self.codes,
+                 seed=np.int64(self.quantizer.seed))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            codebooks = data['codebooks']
+            quantizer = ProductQuantizer(codebooks.shape[0], codebooks.shape[1], seed=int(data['seed']))
+            quantizer.codebooks = codebooks
+            return cls(data['itemIds'].tolist(), quantizer, data['codes'])
+
+
+def evaluatePQ(itemVectors, queryVectors=None, k=10, numQueries=1000, numSubspaces=None, seed=0,
+               quantizer=None, codes=None):
+    """
+    评估 PQ 压缩的内存收益和召回损失
+
+    参数:
+        itemVectors: 被压缩的向量矩阵 (物品或用户 Embedding)
+        queryVectors: 召回时的查询向量 (如用户 Embedding)；不传时从 itemVectors 中抽样作为查询
+        k: recall@k 的 k
+        quantizer, codes: 已经训练好的量化器与 itemVectors 的编码 (如 PQEmbeddingStore 中保存的)，
+                          传入时直接评估它们，不再重新训练码本
+
+    返回:
+        字典:
+        - fullBytes / pqBytes / compressionRatio: 原始 float32 与 PQ (编码 + 码本) 的内存占用
+        - recall: ADC 内积 Top-K 与精确内积 Top-K 的重合率，1 - recall 即召回损失
+        - reconstructionMse: 解压向量与原始向量的均方误差
+    """
+    itemVectors = np.asarray(itemVectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    if queryVectors is None:
+        queryVectors = itemVectors
+    queryVectors = np.asarray(queryVectors, dtype=np.float32)
+    queries = queryVectors[rng.choice(len(queryVectors), min(numQueries, len(queryVectors)), replace=False)]
+
+    if quantizer is None:
+        quantizer = ProductQuantizer(numSubspaces, seed=seed).fit(itemVectors)
+    if codes is None:
+        codes = quantizer.encode(itemVectors)
+    exactRows, _ = topKRows(queries @ itemVectors.T, k)
+    approxRows, _ = topKRows(quantizer.adcScores(queries, codes), k)
+    pqBytes = codes.nbytes + quantizer.nbytes()
+    return {
+        'numVectors': len(itemVectors),
+        'dim': itemVectors.shape[1],
+        'numSubspaces': quantizer.numSubspaces,
+        'fullBytes': itemVectors.nbytes,
+        'pqBytes': pqBytes,
+        'compressionRatio': itemVectors.nbytes / pqBytes,
+        'codeCompressionRatio': itemVectors.nbytes / codes.nbytes,
+        'recall': recallAtK(approxRows, exactRows),
+        'reconstructionMse': float(np.mean((quantizer.decode(codes) - itemVectors) ** 2)),
+    }
+
+
+def evaluateUserTablePQ(userVectors, itemVectors, k=10, numQueries=1000, numSubspaces=None, seed=0,
+                        quantizer=None, codes=None):
+    """
+    评估压缩用户 Embedding 表对 user -> item 召回的影响
+
+    在线服务中用户表以 PQ 编码常驻内存，召回时先解压出用户向量，再与物品向量做内积。
+    这里比较 "解压后的用户向量" 与 "原始用户向量" 召回的 Top-K 物品的重合率；
+    quantizer 与 codes 的含义同 evaluatePQ
+
+    返回:
+        字典，包含用户表的内存占用、压缩比和 recall@k
+    """
+    userVectors = np.asarray(userVectors, dtype=np.float32)
+    itemVectors = np.asarray(itemVectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(userVectors), min(numQueries, len(userVectors)), replace=False)
+
+    if quantizer is None:
+        quantizer = ProductQuantizer(numSubspaces, seed=seed).fit(userVectors)
+    if codes is None:
+        codes = quantizer.encode(userVectors)
+    exactRows, _ = topKRows(userVectors[sample] @ itemVectors.T, k)
+    approxRows, _ = topKRows(quantizer.decode(codes[sample]) @ itemVectors.T, k)
+    pqBytes = codes.nbytes + quantizer.nbytes()
+    return {
+        'numUsers': len(userVectors),
+        'numSubspaces': quantizer.numSubspaces,
+        'fullBytes': userVectors.nbytes,
+        'pqBytes': pqBytes,
+        'compressionRatio': userVectors.nbytes / pqBytes,
+        'recall': recallAtK(approxRows, exactRows),
+    }
+
+
+def quantizeEmbeddings(embOutputPath, itemIds, vectors, numSubspaces=None, itemVectors=None):
+    """
+    trainItem2vec / generateUserEmb 之后的可选 PQ 阶段:
+    训练码本、编码，保存到与 embOutputPath 同名的 .pq.npz 文件，并打印内存与召回报告
+
+    参数:
+        embOutputPath: Embedding 文本文件路径，如 .../userEmb.csv -> .../userEmb.pq.npz
+        itemIds, vectors: 要压缩的 Embedding
+        itemVectors: 压缩的是用户表时传入物品 Embedding，额外报告 user -> item 召回的损失
+
+    返回:
+        报告字典
+    """
+    store = PQEmbeddingStore.build(itemIds, vectors, numSubspaces)
+    store.save(os.path.splitext(embOutputPath)[0] + PQ_SUFFIX)
+    # 评估的就是刚保存的码本和编码，不重新训练
+    report = evaluatePQ(vectors, quantizer=store.quantizer, codes=store.codes)
+    if itemVectors is not None:
+        report['userToItem'] = evaluateUserTablePQ(vectors, itemVectors, quantizer=store.quantizer, codes=store.codes)
+    print("product quantization of %s: %d -> %d bytes (%.1fx), recall@10 %.4f"
+          % (embOutputPath, report['fullBytes'], report['pqBytes'], report['compressionRatio'], report['recall']))
+    if itemVectors is not None:
+        print("user -> item recall@10 with the quantized user table: %.4f" % report['userToItem']['recall'])
+    return report
@@ -0,0 +1,605 @@
+"""
+=====================================================================================
+RandomWalk.py - Graph Embedding 随机游走引擎 (Alias Method)
+
+Embedding.py 中的 oneRandomWalk 使用轮盘赌 (Roulette Wheel) 采样:
+- 选择起点时，线性扫描整个 itemDistribution 字典: O(物品数)
+- 每走一步，再线性扫描当前节点的全部出边: O(出度)
+- 生成 20000 条游走的总代价约为 O(游走数 × 物品数)，物品库一大就成为 graphEmb 的瓶颈
+
+本模块用 Alias Method (别名采样法) 替换轮盘赌:
+- 预处理: 为起点分布和每个节点的出边分布各建一张 alias 表，总代价 O(物品数 + 边数)
+- 采样: 每次采样只需 1 个随机整数 + 1 个随机小数，O(1)
+- 批量游走: 所有游走同时前进一步，用 NumPy 向量化完成整批采样
+
+Alias Method 原理 (Vose 算法):
+    把 n 个离散概率都乘以 n，得到平均高度为 1 的 n 根"柱子"
+    高于 1 的柱子把多出的部分"切"给低于 1 的柱子，直到每根柱子恰好高 1
+    每根柱子最多由两部分组成: 自己 (概率 prob[k]) + 一个别名 (alias[k])
+
+    采样时: 随机选一根柱子 k，再抛一次硬币
+        硬币 < prob[k]  -> 返回 k
+        否则            -> 返回 alias[k]
+
+转移图在内存中的布局 (CSR，压缩稀疏行):
+    itemIds : 第 i 个节点对应的电影ID
+    indptr  : 节点 i 的出边位于 [indptr[i], indptr[i+1]) 区间
+    indices : 每条出边的目标节点编号
+    probs   : 每条出边的转移概率
+
+基准测试 (python RandomWalk.py，合成幂律图，平均出度 20，20000 条长度为 10 的游走):
+    1,000 个物品 (样例数据规模):   轮盘赌约 1.8 万 walks/s，alias 约 14.7 万 walks/s，约 8 倍
+    100,000 个物品 (100 倍规模):   轮盘赌约 200 walks/s，   alias 约 13.4 万 walks/s，约 670 倍
+    轮盘赌的速度随物品数线性下降，alias 引擎的速度与物品数基本无关
+=====================================================================================
+"""
+
+import os
+import time
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+
+def buildAliasTable(probs):
+    """
+    为一个离散概率分布构建 alias 表 (Vose 算法)
+
+    参数:
+        probs: 一维数组，概率分布 (不要求严格归一化，内部会重新归一化)
+
+    返回:
+        (aliasProb, aliasIdx): 两个等长数组
+        aliasProb[k] 是选中柱子 k 后"保留自己"的概率，aliasIdx[k] 是它的别名
+    """
+    probs = np.asarray(probs, dtype=np.float64)
+    n = len(probs)
+    aliasProb = np.zeros(n, dtype=np.float64)
+    aliasIdx = np.zeros(n, dtype=np.int64)
+    if n == 0:
+        return aliasProb, aliasIdx
+
+    scaled = probs * n / probs.sum()
+    small = [k for k in range(n) if scaled[k] < 1.0]
+    large = [k for k in range(n) if scaled[k] >= 1.0]
+
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        aliasProb[s] = scaled[s]
+        aliasIdx[s] = l
+        # 柱子 l 把 (1 - scaled[s]) 的高度切给了柱子 s
+        scaled[l] = scaled[l] + scaled[s] - 1.0
+        if scaled[l] < 1.0:
+            small.append(l)
+        else:
+            large.append(l)
+
+    # 剩下的柱子高度都是 1 (浮点误差导致可能留在 small 中)
+    for k in large + small:
+        aliasProb[k] = 1.0
+        aliasIdx[k] = k
+    return aliasProb, aliasIdx
+
+
+def csrFromTransitionMatrix(transitionMatrix, itemDistribution):
+    """
+    把 generateTransitionMatrix 输出的嵌套字典转换为 CSR 数组
+
+    参数:
+        transitionMatrix: transitionMatrix[i][j] = P(j|i)
+        itemDistribution: itemDistribution[i] = 物品 i 作为起点的概率
+
+    返回:
+        (itemIds, indptr, indices, probs, startProbs)
+    """
+    # 所有出现过的物品 (起点 + 终点) 统一编号为 0..n-1
+    itemIds = list(itemDistribution.keys())
+    itemIndex = {item: i for i, item in enumerate(itemIds)}
+    for transitionMap in transitionMatrix.values():
+        for item in transitionMap:
+            if item not in itemIndex:
+                itemIndex[item] = len(itemIds)
+                itemIds.append(item)
+
+    n = len(itemIds)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    for item, transitionMap in transitionMatrix.items():
+        indptr[itemIndex[item] + 1] = len(transitionMap)
+    np.cumsum(indptr, out=indptr)
+
+    indices = np.zeros(indptr[-1], dtype=np.int32)
+    probs = np.zeros(indptr[-1], dtype=np.float32)
+    for item, transitionMap in transitionMatrix.items():
+        start = indptr[itemIndex[item]]
+        for offset, (nextItem, prob) in enumerate(transitionMap.items()):
+            indices[start + offset] = itemIndex[nextItem]
+            probs[start + offset] = prob
+
+    # 行内按目标节点编号排序，与 TransitionGraph 的布局保持一致
+    order = np.lexsort((indices, np.repeat(np.arange(n), np.diff(indptr))))
+    indices, probs = indices[order], probs[order]
+
+    startProbs = np.zeros(n, dtype=np.float64)
+    for item, prob in itemDistribution.items():
+        startProbs[itemIndex[item]] = prob
+    return itemIds, indptr, indices, probs, startProbs
+
+
+class AliasWalkEngine:
+    """
+    基于 alias 表的一阶 (DeepWalk) 随机游走引擎
+
+    用法:
+        engine = AliasWalkEngine.fromTransitionMatrix(transitionMatrix, itemDistribution, seed=42)
+        walks = engine.walks(sampleCount=20000, sampleLength=10)
+
+    构建完成后，引擎只持有扁平的 NumPy 数组，不再引用原始嵌套字典
+    """
+
+    def __init__(self, itemIds, indptr, indices, probs, startProbs, seed=None):
+        self.itemIds = np.asarray(itemIds, dtype=object)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.degrees = np.diff(self.indptr)
+        self.rng = np.random.default_rng(seed)
+
+        # 起点分布的 alias 表
+        self.startAliasProb, self.startAliasIdx = buildAliasTable(startProbs)
+
+        # 每个节点出边的 alias 表，与 indices 对齐存储
+        # edgeAliasIdx 存的是节点内的局部偏移，取值范围 [0, 出度)
+        self.edgeAliasProb = np.ones(len(self.indices), dtype=np.float32)
+        self.edgeAliasIdx = np.zeros(len(self.indices), dtype=np.int32)
+        probs = np.asarray(probs)
+        for node in np.flatnonzero(self.degrees):
+            start, end = self.indptr[node], self.indptr[node + 1]
+            aliasProb, aliasIdx = buildAliasTable(probs[start:end])
+            self.edgeAliasProb[start:end] = aliasProb
+            self.edgeAliasIdx[start:end] = aliasIdx
+
+    @classmethod
+    def fromTransitionMatrix(cls, transitionMatrix, itemDistribution, seed=None, **kwargs):
+        return cls(*csrFromTransitionMatrix(transitionMatrix, itemDistribution), seed=seed, **kwargs)
+
+    @classmethod
+    def fromGraph(cls, graph, seed=None, **kwargs):
+        """由 TransitionGraph.buildTransitionGraph 构建的 CSR 图创建引擎"""
+        return cls(graph.itemIds, graph.indptr, graph.indices, graph.probs, graph.startProbs, seed=seed, **kwargs)
+
+    def getState(self):
+        """导出构建好的全部数组 (含 alias 表)，用于广播到 Executor"""
+        return {
+            'itemIds': self.itemIds,
+            'indptr': self.indptr,
+            'indices': self.indices,
+            'startAliasProb': self.startAliasProb,
+            'startAliasIdx': self.startAliasIdx,
+            'edgeAliasProb': self.edgeAliasProb,
+            'edgeAliasIdx': self.edgeAliasIdx,
+        }
+
+    @classmethod
+    def fromState(cls, state, seed=None):
+        """由 getState 导出的数组直接恢复引擎，跳过 alias 表的重新构建"""
+        engine = cls.__new__(cls)
+        for name, value in state.items():
+            setattr(engine, name, value)
+        engine.degrees = np.diff(engine.indptr)
+        engine.rng = np.random.default_rng(seed)
+        return engine
+
+    def nbytes(self):
+        """引擎持有的全部数值数组的字节数 (不含电影ID字符串)"""
+        return sum(value.nbytes for name, value in self.getState().items()
+                   if name != 'itemIds' and isinstance(value, np.ndarray))
+
+    def sampleStartNodes(self, count):
+        """按起点分布一次性采样 count 个起点，O(count)"""
+        k = self.rng.integers(0, len(self.startAliasProb), size=count)
+        keep = self.rng.random(count) < self.startAliasProb[k]
+        return np.where(keep, k, self.startAliasIdx[k])
+
+    def sampleNextNodes(self, nodes):
+        """
+        为一批当前节点各采样一个后继节点
+
+        参数:
+            nodes: 当前节点编号数组，调用方保证这些节点的出度 > 0
+
+        返回:
+            后继节点编号数组
+        """
+        degrees = self.degrees[nodes]
+        starts = self.indptr[nodes]
+        # 在 [0, 出度) 中均匀选一根柱子
+        k = (self.rng.random(len(nodes)) * degrees).astype(np.int64)
+        edge = starts + k
+        keep = self.rng.random(len(nodes)) < self.edgeAliasProb[edge]
+        edge = np.where(keep, edge, starts + self.edgeAliasIdx[edge])
+        return self.indices[edge]
+
+    def sampleStep(self, previousNodes, nodes):
+        """
+        游走前进一步: 一阶游走只依赖当前节点，previousNodes 不使用
+        子类 (如 Node2VecWalkEngine) 可以重写它来实现依赖上一个节点的二阶游走
+        """
+        return self.sampleNextNodes(nodes)
+
+    def walkIndices(self, sampleCount, sampleLength):
+        """
+        批量生成游走，返回节点编号形式的结果
+
+        返回:
+            (paths, lengths): paths 形状为 (sampleCount, sampleLength)，
+            第 w 条游走的有效部分为 paths[w, :lengths[w]]
+        """
+        paths = np.zeros((sampleCount, sampleLength), dtype=np.int32)
+        lengths = np.ones(sampleCount, dtype=np.int32)
+        if sampleCount == 0 or sampleLength == 0:
+            return paths, np.zeros(sampleCount, dtype=np.int32)
+
+        paths[:, 0] = self.sampleStartNodes(sampleCount)
+        active = np.arange(sampleCount)
+        for step in range(1, sampleLength):
+            # 与 oneRandomWalk 一致: 走到没有出边的节点就终止该条游走
+            current = paths[active, step - 1]
+            active = active[self.degrees[current] > 0]
+            if len(active) == 0:
+                break
+            previousNodes = paths[active, step - 2] if step >= 2 else None
+            paths[active, step] = self.sampleStep(previousNodes, paths[active, step - 1])
+            lengths[active] += 1
+        return paths, lengths
+
+    def walks(self, sampleCount, sampleLength):
+        """批量生成游走，返回与 randomWalk 相同格式的电影ID列表的列表"""
+        paths, lengths = self.walkIndices(sampleCount, sampleLength)
+        return [list(self.itemIds[paths[w, :lengths[w]]]) for w in range(sampleCount)]
+
+
+class Node2VecWalkEngine(AliasWalkEngine):
+    """
+    node2vec 风格的二阶有偏随机游走 (拒绝采样实现)
+
+    node2vec 原理:
+        游走从 t 走到 v 之后，下一步 x 的权重不仅取决于边 v->x，还取决于 t 与 x 的关系:
+            x == t          (返回上一个节点)     -> 权重乘以 1/p
+            t -> x 存在     (x 与 t 距离为 1)     -> 权重乘以 1
+            其他            (离 t 更远)           -> 权重乘以 1/q
+        p 越大越不愿意回头，q 越小越倾向于向远处探索 (类似 DFS)，q 越大越倾向于在附近徘徊 (类似 BFS)
+
+    为什么不用二阶 alias 表？
+        二阶 alias 表要为每条边 (t, v) 都准备一张 v 的出边表，
+        总大小为 O(Σ 出度²)，热门电影的出度一大就放不进内存
+
+    拒绝采样:
+        1. 用 v 的一阶 alias 表提议一个候选 x (O(1))
+        2. 以 alpha(t, x) / max(alpha) 的概率接受，否则重新提议
+        接受后 x 的分布恰好正比于 w(v, x) * alpha(t, x)，与二阶 alias 表完全一致
+        "t -> x 是否存在" 通过在有序的边键 (起点 * n + 终点) 上二分查找判断，
+        额外内存只有每条边 8 字节，仍是 O(边数)
+    """
+
+    def __init__(self, itemIds, indptr, indices, probs, startProbs, seed=None, p=1.0, q=1.0):
+        super().__init__(itemIds, indptr, indices, probs, startProbs, seed=seed)
+        self.p = p
+        self.q = q
+        numNodes = len(self.indptr) - 1
+        rowOfEdge = np.repeat(np.arange(numNodes, dtype=np.int64), self.degrees)
+        # 行内 indices 有序，因此边键全局有序，可以直接二分查找
+        self.edgeKeys = rowOfEdge * numNodes + self.indices
+
+    def getState(self):
+        state = super().getState()
+        state.update(p=self.p, q=self.q, edgeKeys=self.edgeKeys)
+        return state
+
+    def hasEdges(self, srcNodes, dstNodes):
+        """批量判断边 src -> dst 是否存在"""
+        if len(self.edgeKeys) == 0:
+            return np.zeros(len(srcNodes), dtype=bool)
+        keys = srcNodes.astype(np.int64) * (len(self.indptr) - 1) + dstNodes
+        pos = np.minimum(np.searchsorted(self.edgeKeys, keys), len(self.edgeKeys) - 1)
+        return self.edgeKeys[pos] == keys
+
+    def sampleStep(self, previousNodes, nodes):
+        if previousNodes is None:
+            return self.sampleNextNodes(nodes)
+
+        alphaMax = max(1.0 / self.p, 1.0, 1.0 / self.q)
+        nextNodes = np.empty(len(nodes), dtype=np.int32)
+        pending = np.arange(len(nodes))
+        # 每一轮只对尚未被接受的游走重新提议，期望轮数为 alphaMax / E[alpha]
+        while len(pending) > 0:
+            candidates = self.sampleNextNodes(nodes[pending])
+            previous = previousNodes[pending]
+            alpha = np.where(candidates == previous, 1.0 / self.p,
+                             np.where(self.hasEdges(previous, candidates), 1.0, 1.0 / self.q))
+            accept = self.rng.random(len(pending)) * alphaMax < alpha
+            nextNodes[pending[accept]] = candidates[accept]
+            pending = pending[~accept]
+        return nextNodes
+
+
+def distributedRandomWalk(spark, engine, sampleCount=None, sampleLength=10, numPartitions=None,
+                          walksPerPartition=None, seed=0, batchSize=10000):
+    """
+    在 Spark Executor 上分布式生成随机游走
+
+    与 randomWalk 的区别:
+    - randomWalk 在 Driver 上单线程生成全部游走，再 parallelize 成 RDD，
+      Driver 必须在内存中持有整个游走语料
+    - 这里只把紧凑的 CSR + alias 数组广播 (broadcast) 到各个 Executor，
+      每个分区在 mapPartitionsWithIndex 中独立生成自己的那一份游走
+
+    可复现性:
+        分区 p 使用种子 (seed, p) 初始化随机数生成器，
+        相同的 seed 和分区数总是生成相同的游走语料
+
+    参数:
+        spark: SparkSession 实例
+        engine: 已构建好的 AliasWalkEngine
+        sampleCount: 游走总条数，均匀分配到各分区
+        sampleLength: 每条游走的最大长度
+        numPartitions: 分区数，默认为集群的 defaultParallelism
+        walksPerPartition: 每个分区生成的游走条数，设置后忽略 sampleCount，
+                           游走总数随集群规模 (分区数) 线性增长
+        seed: 基础随机种子
+        batchSize: 每个分区内每批生成的游走条数，限制 Executor 内存占用
+
+    返回:
+        RDD，每个元素是一条游走 (电影ID列表)，可以直接交给 trainItem2vec
+    """
+    sc = spark.sparkContext
+    numPartitions = numPartitions or sc.defaultParallelism
+    if walksPerPartition is not None:
+        partitionCounts = [walksPerPartition] * numPartitions
+    else:
+        partitionCounts = [sampleCount // numPartitions + (1 if p < sampleCount % numPartitions else 0)
+                           for p in range(numPartitions)]
+
+    # 把本模块分发到 Executor，使其能够反序列化 AliasWalkEngine
+    sc.addPyFile(os.path.abspath(__file__))
+    graphBroadcast = sc.broadcast(engine.getState())
+    engineClass = type(engine)
+
+    def walkPartition(partitionIndex, _):
+        walker = engineClass.fromState(graphBroadcast.value, seed=[seed, partitionIndex])
+        remaining = partitionCounts[partitionIndex]
+        while remaining > 0:
+            count = min(batchSize, remaining)
+            paths, lengths = walker.walkIndices(count, sampleLength)
+            for w in range(count):
+                yield list(walker.itemIds[paths[w, :lengths[w]]])
+            remaining -= count
+
+    return sc.parallelize(range(numPartitions), numPartitions).mapPartitionsWithIndex(walkPartition)
+
+
+# 子进程中的全局状态，由 _attachSharedMemory 在进程启动时初始化
+_workerState = {}
+
+
+def _createSharedArray(array):
+    """创建一块共享内存并把数组拷贝进去，返回 (SharedMemory, 共享数组视图)"""
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    sharedArray = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    sharedArray[...] = array
+    return shm, sharedArray
+
+
+def _attachSharedMemory(specs, scalars, engineClass):
+    """
+    子进程初始化函数: 按名字挂载主进程创建的共享内存块
+
+    子进程直接在共享内存上构造 NumPy 数组视图，不需要拷贝，
+    也不需要把转移图 pickle 给每个子进程
+    """
+    blocks = {}
+    arrays = {}
+    for name, (shmName, shape, dtype) in specs.items():
+        blocks[name] = shared_memory.SharedMemory(name=shmName)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=blocks[name].buf)
+    _workerState['blocks'] = blocks
+    _workerState['arrays'] = arrays
+    _workerState['scalars'] = scalars
+    _workerState['engineClass'] = engineClass
+
+
+def _walkChunk(task):
+    """子进程任务: 生成一块游走并直接写入共享的输出数组"""
+    chunkIndex, start, count, sampleLength, seed = task
+    arrays = _workerState['arrays']
+    state = {name: value for name, value in arrays.items() if name not in ('outPaths', 'outLengths')}
+    state.update(_workerState['scalars'])
+    state['itemIds'] = None
+    walker = _workerState['engineClass'].fromState(state, seed=[seed, chunkIndex])
+    paths, lengths = walker.walkIndices(count, sampleLength)
+    arrays['outPaths'][start:start + count] = paths
+    arrays['outLengths'][start:start + count] = lengths
+    return count
+
+
+def parallelRandomWalkIndices(engine, sampleCount, sampleLength, numWorkers=None, seed=0, chunkSize=10000):
+    """
+    单机多进程随机游走，适用于 setMaster('local') 这类单机运行场景
+
+    实现:
+    - 主进程把引擎的 CSR + alias 数组拷贝到 multiprocessing.shared_memory 中
+    - 进程池的每个子进程启动时按名字挂载这些共享内存块 (零拷贝)
+    - 游走被切成固定大小的块 (chunk)，子进程把结果直接写入共享的输出数组
+
+    可复现性:
+        第 c 块使用种子 (seed, c)，块的划分只取决于 chunkSize，
+        因此无论用多少个进程，相同的 seed 都生成完全相同的游走
+
+    参数:
+        engine: 已构建好的 AliasWalkEngine
+        sampleCount: 游走总条数
+        sampleLength: 每条游走的最大长度
+        numWorkers: 进程数，默认使用全部 CPU 核心
+        seed: 基础随机种子
+        chunkSize: 每个任务生成的游走条数
+
+    返回:
+        (paths, lengths)，格式与 AliasWalkEngine.walkIndices 相同
+    """
+    numWorkers = numWorkers or os.cpu_count()
+    # 数值数组放入共享内存，标量参数 (如 node2vec 的 p、q) 直接传给子进程，
+    # itemIds 只在主进程中使用
+    state = engine.getState()
+    scalars = {name: value for name, value in state.items()
+               if name != 'itemIds' and not isinstance(value, np.ndarray)}
+    blocks = []
+    specs = {}
+    try:
+        for name, value in state.items():
+            if name == 'itemIds' or name in scalars:
+                continue
+            shm, _ = _createSharedArray(np.ascontiguousarray(value))
+            blocks.append(shm)
+            specs[name] = (shm.name, value.shape, value.dtype.str)
+
+        outPathsShm, outPaths = _createSharedArray(np.zeros((sampleCount, sampleLength), dtype=np.int32))
+        outLengthsShm, outLengths = _createSharedArray(np.zeros(sampleCount, dtype=np.int32))
+        blocks.extend([outPathsShm, outLengthsShm])
+        specs['outPaths'] = (outPathsShm.name, outPaths.shape, outPaths.dtype.str)
+        specs['outLengths'] = (outLengthsShm.name, outLengths.shape, outLengths.dtype.str)
+
+        tasks = [(chunkIndex, start, min(chunkSize, sampleCount - start), sampleLength, seed)
+                 for chunkIndex, start in enumerate(range(0, sampleCount, chunkSize))]
+        with Pool(processes=numWorkers, initializer=_attachSharedMemory,
+                  initargs=(specs, scalars, type(engine))) as pool:
+            for _ in pool.imap_unordered(_walkChunk, tasks):
+                pass
+        return outPaths.copy(), outLengths.copy()
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+
+def parallelRandomWalk(engine, sampleCount, sampleLength, numWorkers=None, seed=0, chunkSize=10000):
+    """与 parallelRandomWalkIndices 相同，但返回与 randomWalk 相同格式的电影ID列表的列表"""
+    paths, lengths = parallelRandomWalkIndices(engine, sampleCount, sampleLength, numWorkers, seed, chunkSize)
+    return [list(engine.itemIds[paths[w, :lengths[w]]]) for w in range(sampleCount)]
+
+
+def syntheticTransitionMatrix(numItems, avgOutDegree, seed=0):
+    """
+    生成一个合成的物品转移图，用于基准测试
+
+    物品热度服从幂律分布 (少数热门电影占据大部分转移)，
+    出边目标按热度采样，模拟真实观影序列构建出的转移图
+
+    返回:
+        与 generateTransitionMatrix 相同格式的 (transitionMatrix, itemDistribution)
+    """
+    rng = np.random.default_rng(seed)
+    popularity = 1.0 / np.arange(1, numItems + 1) ** 0.8
+    popularity /= popularity.sum()
+    itemIds = [str(i) for i in range(numItems)]
+
+    transitionMatrix = {}
+    itemDistribution = {}
+    for i in range(numItems):
+        degree = max(1, int(rng.poisson(avgOutDegree)))
+        targets, counts = np.unique(rng.choice(numItems, size=degree, p=popularity), return_counts=True)
+        transitionMatrix[itemIds[i]] = {itemIds[t]: c / degree for t, c in zip(targets, counts)}
+        itemDistribution[itemIds[i]] = popularity[i]
+    return transitionMatrix, itemDistribution
+
+
+def benchmarkWalkEngine(numItems, avgOutDegree, sampleCount, sampleLength, baselineSampleCount=None):
+    """
+    对比轮盘赌 (oneRandomWalk) 与 alias 引擎的游走吞吐量
+
+    轮盘赌在大图上极慢，可以通过 baselineSampleCount 只跑一部分游走，
+    再按 walks/sec 比较
+
+    返回:
+        包含两种实现 walks/sec 和加速比的字典
+    """
+    from Embedding import oneRandomWalk
+
+    transitionMatrix, itemDistribution = syntheticTransitionMatrix(numItems, avgOutDegree)
+    baselineSampleCount = baselineSampleCount or sampleCount
+
+    startTime = time.time()
+    for _ in range(baselineSampleCount):
+        oneRandomWalk(transitionMatrix, itemDistribution, sampleLength)
+    rouletteSeconds = time.time() - startTime
+
+    startTime = time.time()
+    engine = AliasWalkEngine.fromTransitionMatrix(transitionMatrix, itemDistribution, seed=0)
+    buildSeconds = time.time() - startTime
+    startTime = time.time()
+    engine.walks(sampleCount, sampleLength)
+    aliasSeconds = time.time() - startTime
+
+    rouletteRate = baselineSampleCount / rouletteSeconds
+    aliasRate = sampleCount / aliasSeconds
+    return {
+        'numItems': numItems,
+        'numEdges': int(engine.indptr[-1]),
+        'rouletteWalksPerSec': rouletteRate,
+        'aliasBuildSeconds': buildSeconds,
+        'aliasWalksPerSec': aliasRate,
+        'speedup': aliasRate / rouletteRate,
+    }
+
+
+def benchmarkParallelWalk(numItems, avgOutDegree, sampleCount, sampleLength, workerCounts=None):
+    """
+    测量多进程游走的吞吐量随进程数的变化
+
+    返回:
+        列表，每个元素为 {'numWorkers', 'walksPerSec', 'scaling'}，
+        scaling 为相对单进程的加速比，理想情况下约等于进程数
+    """
+    transitionMatrix, itemDistribution = syntheticTransitionMatrix(numItems, avgOutDegree)
+    engine = AliasWalkEngine.fromTransitionMatrix(transitionMatrix, itemDistribution)
+    cpuCount = os.cpu_count()
+    workerCounts = workerCounts or sorted({n for n in (1, 2, 4, 8, 16, 32) if n <= cpuCount} | {cpuCount})
+
+    results = []
+    for numWorkers in workerCounts:
+        startTime = time.time()
+        parallelRandomWalkIndices(engine, sampleCount, sampleLength, numWorkers=numWorkers)
+        walksPerSec = sampleCount / (time.time() - startTime)
+        results.append({'numWorkers': numWorkers, 'walksPerSec': walksPerSec,
+                        'scaling': walksPerSec / results[0]['walksPerSec'] if results else 1.0})
+    return results
+
+
+def benchmarkNode2Vec(numItems, avgOutDegree, sampleCount, sampleLength, p=0.5, q=2.0):
+    """
+    对比一阶游走与 node2vec 拒绝采样游走的内存和 walks/sec
+
+    naiveSecondOrderBytes 是朴素二阶 alias 表的估算大小:
+    每条边 (t, v) 都要为 v 的全部出边各存一个 float32 概率 + int32 别名
+    """
+    transitionMatrix, itemDistribution = syntheticTransitionMatrix(numItems, avgOutDegree)
+    firstOrder = AliasWalkEngine.fromTransitionMatrix(transitionMatrix, itemDistribution, seed=0)
+    secondOrder = Node2VecWalkEngine.fromTransitionMatrix(transitionMatrix, itemDistribution, seed=0, p=p, q=q)
+
+    results = {'numItems': numItems, 'numEdges': int(firstOrder.indptr[-1])}
+    for name, engine in [('firstOrder', firstOrder), ('node2vec', secondOrder)]:
+        startTime = time.time()
+        engine.walkIndices(sampleCount, sampleLength)
+        results[name + 'WalksPerSec'] = sampleCount / (time.time() - startTime)
+        results[name + 'Bytes'] = engine.nbytes()
+    results['naiveSecondOrderBytes'] = int(firstOrder.degrees[firstOrder.indices].sum()) * 8
+    return results
+
+
+if __name__ == '__main__':
+    # 样例数据规模 (约 1000 部电影) 与 100 倍规模的合成图
+    for numItems, baselineSampleCount in [(1000, 20000), (100000, 200)]:
+        result = benchmarkWalkEngine(numItems, avgOutDegree=20, sampleCount=20000, sampleLength=10,
+                                     baselineSampleCount=baselineSampleCount)
+        print(result)
+    for result in benchmarkParallelWalk(100000, avgOutDegree=20, sampleCount=2000000, sampleLength=10):
+        print(result)
+    print(benchmarkNode2Vec(100000, avgOutDegree=20, sampleCount=20000, sampleLength=10))
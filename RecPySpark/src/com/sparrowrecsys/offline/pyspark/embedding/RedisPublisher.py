@@ -0,0 +1,319 @@
+"""
+=====================================================================================
+RedisPublisher.py - 批量发布 Embedding 和特征到 Redis
+
+trainItem2vec / graphEmb / generateUserEmb 都有 saveToRedis 参数，但 Python 版本一直没有实现。
+Scala 版本逐个 key 调用 set，每个 key 一次网络往返 (RTT)，几十万个 key 就要几十万次往返。
+
+本模块的做法:
+1. 管道 (pipeline): 每 batchSize 个命令打包发送一次，往返次数降低到 N / batchSize
+2. 两种 key 布局:
+   - 兼容布局 (versioned=False，默认): <prefix>:<id>，与 Scala 版本和 Java DataManager 读取的 key 完全相同
+   - 版本化布局 (versioned=True): 数据写到 <prefix>@<version>:<id>，全部写完后再把
+     指针 key "version:<prefix>" 指向新版本 (一条 SET 命令，原子切换)。
+     读取方先 GET 指针拿到版本号，再读对应命名空间的 key，永远不会读到新旧混杂的数据；
+     切换后只保留最近 keepVersions 个版本，更早的版本分批删除
+3. 可选 TTL: 每个 key 设置过期时间，与 Scala 版本一样默认 24 小时
+
+值的格式与 Scala 版本一致:
+    Embedding: 字符串 "v1 v2 v3 ..."
+    特征:      Hash (HSET key field value ...)
+
+测试与本地运行:
+    RedisPublisher(client=InMemoryRedis()) 使用进程内的替身，不需要 redis-server；
+    默认连接 localhost:6379 (需要安装 redis-py: pip install redis)
+=====================================================================================
+"""
+
+import fnmatch
+import time
+
+from EmbeddingStore import formatEmbedding
+
+REDIS_END_POINT = 'localhost'
+REDIS_PORT = 6379
+DEFAULT_TTL_SECONDS = 60 * 60 * 24
+POINTER_KEY_PREFIX = 'version:'
+VERSIONS_KEY_PREFIX = 'versions:'
+
+
+class InMemoryRedis:
+    """
+    进程内的 Redis 替身，只实现本模块用到的命令，用于测试和没有 redis-server 的环境
+
+    与 redis-py 一致: 字符串值以 bytes 返回，过期时间按调用时的时钟判断
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.expireAt = {}
+        self.roundTrips = 0
+
+    def _alive(self, key):
+        if key in self.expireAt and self.expireAt[key] <= time.time():
+            self.data.pop(key, None)
+            self.expireAt.pop(key, None)
+        return key in self.data
+
+    @staticmethod
+    def _encode(value):
+        return value if isinstance(value, bytes) else str(value).encode('utf-8')
+
+    def set(self, key, value, ex=None):
+        self.data[key] = self._encode(value)
+        self.expireAt.pop(key, None)
+        if ex:
+            self.expireAt[key] = time.time() + ex
+        return True
+
+    def get(self, key):
+        return self.data[key] if self._alive(key) and isinstance(self.data[key], bytes) else None
+
+    def hset(self, key, mapping=None):
+        current = self.data.get(key) if self._alive(key) else None
+        current = current if isinstance(current, dict) else {}
+        current.update({self._encode(field): self._encode(value) for field, value in mapping.items()})
+        self.data[key] = current
+        return len(mapping)
+
+    def hgetall(self, key):
+        value = self.data.get(key) if self._alive(key) else None
+        return dict(value) if isinstance(value, dict) else {}
+
+    def expire(self, key, seconds):
+        if not self._alive(key):
+            return False
+        self.expireAt[key] = time.time() + seconds
+        return True
+
+    def ttl(self, key):
+        if not self._alive(key):
+            return -2
+        return int(self.expireAt[key] - time.time()) if key in self.expireAt else -1
+
+    def delete(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._alive(key):
+                del self.data[key]
+                self.expireAt.pop(key, None)
+                removed += 1
+        return removed
+
+    def rpush(self, key, *values):
+        current = self.data.get(key) if self._alive(key) else None
+        current = current if isinstance(current, list) else []
+        current.extend(self._encode(value) for value in values)
+        self.data[key] = current
+        return len(current)
+
+    def lrange(self, key, start, end):
+        value = self.data.get(key) if self._alive(key) else None
+        if not isinstance(value, list):
+            return []
+        return value[start:] if end == -1 else value[start:end + 1]
+
+    def ltrim(self, key, start, end):
+        value = self.lrange(key, start, end)
+        self.data[key] = value
+        return True
+
+    def scan_iter(self, match='*', count=None):
+        for key in list(self.data):
+            if self._alive(key) and fnmatch.fnmatchcase(key, match):
+                yield key
+
+    def keys(self, pattern='*'):
+        return list(self.scan_iter(pattern))
+
+    def pipeline(self, transaction=False):
+        return InMemoryPipeline(self)
+
+
+class InMemoryPipeline:
+    """InMemoryRedis 的管道: 命令先缓存，execute 时一次执行，记一次网络往返"""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        self.client.roundTrips += 1
+        results = [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
+def connectRedis(host=REDIS_END_POINT, port=REDIS_PORT):
+    """连接真实的 Redis (需要 redis-py)"""
+    import redis
+    return redis.Redis(host=host, port=port)
+
+
+def decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class RedisPublisher:
+    """
+    管道化的批量发布器
+
+    参数:
+        client: redis-py 客户端或 InMemoryRedis；不传时连接 localhost:6379
+        batchSize: 每个管道包含的 key 数
+        ttlSeconds: key 的过期时间 (秒)，None 或 0 表示不过期
+    """
+
+    def __init__(self, client=None, batchSize=1000, ttlSeconds=DEFAULT_TTL_SECONDS):
+        self.client = client if client is not None else connectRedis()
+        self.batchSize = batchSize
+        self.ttlSeconds = ttlSeconds
+
+    @staticmethod
+    def namespace(prefix, version=None):
+        """数据 key 的前缀: 兼容布局为 prefix，版本化布局为 prefix@version"""
+        return prefix if version is None else '%s@%s' % (prefix, version)
+
+    def currentVersion(self, prefix):
+        """读取指针，返回 prefix 当前生效的版本号 (没有版本化发布过时返回 None)"""
+        return decode(self.client.get(POINTER_KEY_PREFIX + prefix))
+
+    def resolveKey(self, prefix, itemId):
+        """读取方使用: 按当前版本拼出某个物品的 key"""
+        return self.namespace(prefix, self.currentVersion(prefix)) + ':' + str(itemId)
+
+    def _writeBatches(self, commands):
+        """
+        commands: 可迭代的 (命令名, key, 值)，按 batchSize 打包成管道执行
+
+        返回:
+            (写入的 key 数, 管道批次数)
+        """
+        count = 0
+        batches = 0
+        pipe = self.client.pipeline(transaction=False)
+        pending = 0
+        for command, key, value in commands:
+            if command == 'set':
+                pipe.set(key, value, ex=self.ttlSeconds or None)
+            else:
+                pipe.hset(key, mapping=value)
+                if self.ttlSeconds:
+                    pipe.expire(key, self.ttlSeconds)
+            pending += 1
+            if pending == self.batchSize:
+                pipe.execute()
+                batches += 1
+                count += pending
+                pending = 0
+        if pending:
+            pipe.execute()
+            batches += 1
+            count += pending
+        return count, batches
+
+    def _publish(self, prefix, commands, versioned, version, keepVersions):
+        startTime = time.time()
+        if versioned:
+            version = str(version or time.strftime('%Y%m%d%H%M%S'))
+        else:
+            version = None
+        namespace = self.namespace(prefix, version)
+        count, batches = self._writeBatches((command, namespace + ':' + str(itemId), value)
+                                            for command, itemId, value in commands)
+        writeSeconds = time.time() - startTime
+
+        removedVersions = []
+        if versioned:
+            # 数据全部写完后再切换指针，读取方看到的要么是完整的旧版本，要么是完整的新版本
+            self.client.set(POINTER_KEY_PREFIX + prefix, version)
+            removedVersions = self._retireVersions(prefix, version, keepVersions)
+
+        seconds = time.time() - startTime
+        report = {
+            'prefix': prefix,
+            'version': version,
+            'keys': count,
+            'batches': batches,
+            'seconds': seconds,
+            'keysPerSec': count / writeSeconds if writeSeconds > 0 else float('inf'),
+            'retiredVersions': removedVersions,
+        }
+        print("published %d keys under %s in %d batches, %.0f keys/sec"
+              % (count, namespace, batches, report['keysPerSec']))
+        return report
+
+    def _retireVersions(self, prefix, version, keepVersions):
+        """记录新版本，只保留最近 keepVersions 个版本，删除更早版本的所有 key"""
+        versionsKey = VERSIONS_KEY_PREFIX + prefix
+        self.client.rpush(versionsKey, version)
+        versions = [decode(v) for v in self.client.lrange(versionsKey, 0, -1)]
+        retired = [v for v in versions[:-keepVersions] if v != version] if keepVersions > 0 else []
+        for oldVersion in retired:
+            pattern = self.namespace(prefix, oldVersion) + ':*'
+            pipe = self.client.pipeline(transaction=False)
+            pending = 0
+            for key in self.client.scan_iter(match=pattern, count=self.batchSize):
+                pipe.delete(key)
+                pending += 1
+                if pending == self.batchSize:
+                    pipe.execute()
+                    pending = 0
+            if pending:
+                pipe.execute()
+        if retired:
+            self.client.ltrim(versionsKey, len(versions) - keepVersions, -1)
+        return retired
+
+    def publishEmbeddings(self, prefix, itemIds, matrix, versioned=False, version=None, keepVersions=1):
+        """
+        发布 Embedding: 每个物品一个字符串 key，值为 "v1 v2 ..."
+
+        参数:
+            prefix: key 前缀，如 'i2vEmb' / 'graphEmb' / 'uEmb'
+            itemIds, matrix: 物品ID列表和 Embedding 矩阵
+            versioned: 是否使用版本化命名空间 + 指针切换
+            version: 版本号，默认使用当前时间
+            keepVersions: 版本化发布时保留的版本数 (包含新版本)
+
+        返回:
+            报告字典: key 数、批次数、耗时、吞吐 (keys/sec)
+        """
+        commands = (('set', itemId, formatEmbedding(row)) for itemId, row in zip(itemIds, matrix))
+        return self._publish(prefix, commands, versioned, version, keepVersions)
+
+    def publishFeatures(self, prefix, features, versioned=False, version=None, keepVersions=1):
+        """
+        发布特征: 每个物品一个 Hash，与 Scala 版本的 mf:<movieId> / uf:<userId> 格式相同
+
+        参数:
+            prefix: key 前缀，如 'mf' / 'uf'
+            features: 可迭代的 (物品ID, {特征名: 特征值})
+        """
+        commands = (('hset', itemId, {field: '' if value is None else str(value) for field, value in fields.items()})
+                    for itemId, fields in features)
+        return self._publish(prefix, commands, versioned, version, keepVersions)
+
+
+def benchmarkPublisher(client, numItems=100000, dim=10, batchSizes=(1, 100, 1000, 10000)):
+    """
+    测量不同管道批次大小下的发布吞吐
+
+    batchSize=1 相当于 Scala 版本逐个 key 写入的方式。对 InMemoryRedis 没有网络开销，
+    要看到管道的效果需要连接真实的 redis-server
+
+    返回:
+        列表，每个 batchSize 对应一份 publishEmbeddings 的报告
+    """
+    import numpy as np
+    matrix = np.random.default_rng(0).normal(size=(numItems, dim)).astype(np.float32)
+    itemIds = [str(i) for i in range(numItems)]
+    return [dict(RedisPublisher(client, batchSize=batchSize).publishEmbeddings('benchEmb', itemIds, matrix),
+                 batchSize=batchSize)
+            for batchSize in batchSizes]
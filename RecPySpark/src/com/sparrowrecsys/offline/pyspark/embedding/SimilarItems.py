@@ -0,0 +1,205 @@
+"""
+=====================================================================================
+SimilarItems.py - 离线批量计算所有电影的 Top-K 相似电影
+
+在线服务每次请求都对全部电影做一遍余弦相似度 (O(N) 暴力搜索)，
+而电影 Embedding 在两次训练之间是不变的，相似电影列表完全可以离线一次算好。
+本模块一次性为每部电影计算 Top-K 近邻，输出一张紧凑的近邻表，在线服务直接查表即可。
+
+两条计算路径:
+    1. 精确路径 (exactTopK): 物品数不大时 (默认 <= 200000)
+       - 向量 L2 归一化后，余弦相似度 = 内积，整张相似度矩阵就是 V @ V.T
+       - 按行分块 (blocked) 计算，每块只占用 blockSize x N 的内存，不会生成 N x N 的大矩阵
+       - 多个线程并行处理不同的块，NumPy 矩阵乘法在内部会释放 GIL
+    2. LSH 路径 (lshTopK): 物品数很大时
+       - 使用 Spark 的 BucketedRandomProjectionLSH.approxSimilarityJoin 做自连接，
+         只比较落在同一个哈希桶中的物品对，计算在集群上完成
+       - 对归一化向量，欧氏距离 d 与余弦相似度 s 的关系为 s = 1 - d^2 / 2
+
+近邻表 (NeighborTable) 的格式:
+    itemIds:   物品ID列表 (行号 -> 物品ID)
+    neighbors: int32 矩阵 (N x K)，第 i 行是第 i 个物品的近邻行号，按相似度降序，不足 K 个补 -1
+    scores:    float32 矩阵 (N x K)，对应的余弦相似度，不足 K 个补 -inf
+    保存为 .npz 文件；也可以导出为文本 "movieId:neighbor1 neighbor2 ..."，
+    与 Embedding 文件的行格式相同，便于 Java 服务端读取
+=====================================================================================
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from AnnIndex import loadEmbeddingMatrix, normalizeRows, topKRows
+
+
+class NeighborTable:
+    """
+    所有物品的 Top-K 近邻表
+
+    用法:
+        table = NeighborTable.load('item2vecNeighbors.npz')
+        table.neighborsOf('158')   # [(物品ID, 相似度), ...]
+    """
+
+    def __init__(self, itemIds, neighbors, scores):
+        self.itemIds = [str(itemId) for itemId in itemIds]
+        self.itemIndex = {itemId: row for row, itemId in enumerate(self.itemIds)}
+        self.neighbors = np.asarray(neighbors, dtype=np.int32)
+        self.scores = np.asarray(scores, dtype=np.float32)
+
+    @property
+    def k(self):
+        return self.neighbors.shape[1]
+
+    def neighborsOf(self, itemId, num=None):
+        """返回物品的近邻列表 [(物品ID, 相似度), ...]，格式与 findSynonyms 相同"""
+        row = self.itemIndex[itemId]
+        return [(self.itemIds[neighbor], float(score))
+                for neighbor, score in zip(self.neighbors[row, :num], self.scores[row, :num]) if neighbor >= 0]
+
+    def nbytes(self):
+        return self.neighbors.nbytes + self.scores.nbytes
+
+    def save(self, path):
+        np.savez_compressed(path, itemIds=np.array(self.itemIds), neighbors=self.neighbors, scores=self.scores)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['itemIds'].tolist(), data['neighbors'], data['scores'])
+
+    def saveText(self, path):
+        """导出为文本，每行 "movieId:neighbor1 neighbor2 ..."，近邻按相似度降序"""
+        ids = np.array(self.itemIds + [''], dtype=object)
+        with open(path, 'w') as f:
+            for row, itemId in enumerate(self.itemIds):
+                neighbors = self.neighbors[row]
+                f.write(itemId + ":" + " ".join(ids[neighbors[neighbors >= 0]]) + "\n")
+
+
+def exactTopK(vectors, k, blockSize=None, numWorkers=4):
+    """
+    分块、多线程的精确 Top-K 余弦近邻 (不包含物品自身)
+
+    参数:
+        vectors: Embedding 矩阵 (N x dim)
+        k: 每个物品的近邻数
+        blockSize: 每块的行数，默认让每块的相似度矩阵约占 64MB
+        numWorkers: 线程数
+
+    返回:
+        (neighbors, scores)，形状均为 (N, k)
+    """
+    normalized = normalizeRows(vectors)
+    numItems = len(normalized)
+    blockSize = blockSize or int(np.clip((64 << 20) // max(1, numItems * 4), 16, 4096))
+    k = min(k, max(0, numItems - 1))
+    neighbors = np.full((numItems, k), -1, dtype=np.int32)
+    scores = np.full((numItems, k), -np.inf, dtype=np.float32)
+
+    def computeBlock(start):
+        end = min(start + blockSize, numItems)
+        similarity = normalized[start:end] @ normalized.T
+        # 排除物品自身
+        similarity[np.arange(end - start), np.arange(start, end)] = -np.inf
+        top, topScores = topKRows(similarity, k)
+        neighbors[start:end] = top
+        scores[start:end] = topScores
+
+    with ThreadPoolExecutor(max_workers=numWorkers) as pool:
+        list(pool.map(computeBlock, range(0, numItems, blockSize)))
+    return neighbors, scores
+
+
+def lshTopK(spark, itemIds, vectors, k, bucketLength=0.1, numHashTables=3, minSimilarity=0.0):
+    """
+    用 approxSimilarityJoin 在集群上计算近似 Top-K 近邻，适合物品数很大、无法在单机做全量矩阵乘法的场景
+
+    参数:
+        bucketLength, numHashTables: BucketedRandomProjectionLSH 的参数，含义见 embeddingLSH
+        minSimilarity: 只保留余弦相似度不低于该值的物品对，换算为欧氏距离阈值 sqrt(2 * (1 - s))
+
+    返回:
+        (neighbors, scores)，形状均为 (N, k)；LSH 没有找到足够候选的物品，剩余位置补 -1 / -inf
+    """
+    from pyspark.ml.feature import BucketedRandomProjectionLSH
+    from pyspark.ml.linalg import Vectors
+    from pyspark.sql import Window
+    from pyspark.sql import functions as F
+
+    normalized = normalizeRows(vectors)
+    embDf = spark.createDataFrame([(row, Vectors.dense(vector.tolist())) for row, vector in enumerate(normalized)],
+                                  ['row', 'emb'])
+    lshModel = BucketedRandomProjectionLSH(inputCol='emb', outputCol='bucketId', bucketLength=bucketLength,
+                                           numHashTables=numHashTables).fit(embDf)
+    hashed = lshModel.transform(embDf).cache()
+    threshold = float(np.sqrt(2.0 * (1.0 - minSimilarity)))
+    pairs = lshModel.approxSimilarityJoin(hashed, hashed, threshold, distCol='distance') \
+        .select(F.col('datasetA.row').alias('row'), F.col('datasetB.row').alias('neighbor'), 'distance') \
+        .where(F.col('row') != F.col('neighbor'))
+    # 每个物品按距离升序只保留前 k 个，再按物品聚合成一行
+    ranked = pairs.withColumn('rank', F.row_number().over(Window.partitionBy('row').orderBy('distance', 'neighbor'))) \
+        .where(F.col('rank') <= k) \
+        .groupBy('row') \
+        .agg(F.sort_array(F.collect_list(F.struct('rank', 'neighbor', 'distance'))).alias('top'))
+
+    neighbors = np.full((len(itemIds), k), -1, dtype=np.int32)
+    scores = np.full((len(itemIds), k), -np.inf, dtype=np.float32)
+    # toLocalIterator 逐个分区取回，Driver 只需要容纳最终的 N x k 近邻表
+    for record in ranked.toLocalIterator():
+        top = record['top']
+        neighbors[record['row'], :len(top)] = [item['neighbor'] for item in top]
+        scores[record['row'], :len(top)] = [1.0 - item['distance'] ** 2 / 2.0 for item in top]
+    hashed.unpersist()
+    return neighbors, scores
+
+
+def getSparkSession():
+    """LSH 路径使用的 SparkSession: 已有会话时直接复用，否则创建一个本地会话"""
+    from pyspark import SparkConf
+    from pyspark.sql import SparkSession
+    conf = SparkConf().setAppName('similarItems').setIfMissing('spark.master', 'local[*]')
+    return SparkSession.builder.config(conf=conf).getOrCreate()
+
+
+def computeSimilarItems(embPath, k=20, spark=None, exactMaxItems=200000, numWorkers=4, **lshParams):
+    """
+    为 Embedding 文件中的每部电影计算 Top-K 相似电影
+
+    物品数不超过 exactMaxItems 时走精确的分块矩阵乘法；否则走 LSH 自连接，
+    没有传入 spark 时通过 getSparkSession 获取 (或创建) 会话，精确路径不会启动 Spark
+
+    返回:
+        NeighborTable
+    """
+    itemIds, vectors = loadEmbeddingMatrix(embPath)
+    if len(itemIds) <= exactMaxItems:
+        neighbors, scores = exactTopK(vectors, k, numWorkers=numWorkers)
+    else:
+        if spark is None:
+            print("%d items exceed exactMaxItems=%d, using the LSH path on spark" % (len(itemIds), exactMaxItems))
+            spark = getSparkSession()
+        neighbors, scores = lshTopK(spark, itemIds, vectors, k, **lshParams)
+    return NeighborTable(itemIds, neighbors, scores)
+
+
+if __name__ == '__main__':
+    # 用法: python SimilarItems.py [Embedding 文件路径] [K] [exactMaxItems]
+    # 物品数超过 exactMaxItems (默认 200000) 时自动启动本地 SparkSession 走 LSH 路径
+    # 默认为 modeldata2/item2vecEmb.csv 计算 Top-20，输出到同目录的 item2vecNeighbors.npz / .csv
+    repoRoot = os.path.abspath(os.path.join(os.path.dirname(__file__), *([os.pardir] * 7)))
+    embPath = sys.argv[1] if len(sys.argv) > 1 else \
+        os.path.join(repoRoot, 'src', 'main', 'resources', 'webroot', 'modeldata2', 'item2vecEmb.csv')
+    topK = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    exactMaxItems = int(sys.argv[3]) if len(sys.argv) > 3 else 200000
+    startTime = time.time()
+    table = computeSimilarItems(embPath, topK, exactMaxItems=exactMaxItems)
+    print("computed top-%d neighbors for %d items in %.3fs, table size %d bytes"
+          % (table.k, len(table.itemIds), time.time() - startTime, table.nbytes()))
+    outputBase = os.path.join(os.path.dirname(embPath),
+                              os.path.basename(embPath).split('Emb')[0] + 'Neighbors')
+    table.save(outputBase + '.npz')
+    table.saveText(outputBase + '.csv')
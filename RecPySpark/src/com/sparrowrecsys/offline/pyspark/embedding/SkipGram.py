@@ -0,0 +1,278 @@
+"""
+=====================================================================================
+SkipGram.py - 纯 NumPy 实现的 Skip-gram 负采样 (SGNS) Item2Vec 训练器
+
+trainItem2vec 默认使用 pyspark.mllib.feature.Word2Vec:
+- 需要启动 JVM，序列在 Python 和 JVM 之间来回序列化
+- 训练好的向量还要通过 getVectors() 收集回 Driver
+对于单机内存放得下的物品库，这些开销远大于训练本身。本模块提供一个本地后端:
+
+Skip-gram 负采样 (Skip-Gram with Negative Sampling) 原理:
+    对序列中的每个中心物品 c 和窗口内的上下文物品 o:
+    - 正样本: 希望 sigmoid(in[c] · out[o]) 接近 1
+    - 负样本: 从噪声分布中抽 K 个物品 n，希望 sigmoid(in[c] · out[n]) 接近 0
+    训练完成后 in 矩阵的每一行就是物品的 Embedding
+
+两个经典技巧 (与 word2vec 原始实现一致):
+    1. 负采样表: 按 词频^0.75 构建，既偏向热门物品，又不至于被热门物品完全主导
+    2. 高频降采样: 频率为 f 的物品以 (sqrt(f/t) + 1) * t/f 的概率保留，
+       热门电影在序列中出现太多次，降采样后训练更快，冷门电影的向量也更准
+
+并行方式:
+    每轮把序列切成若干块，由多个线程以 Hogwild (无锁) 方式同时更新共享的权重矩阵
+    批量的矩阵运算在 NumPy 内部会释放 GIL
+
+用法:
+    model = SkipGramTrainer(vectorSize=10).fit(sequences)
+    model.getVectors()           # {movieId: [float, ...]}，与 mllib Word2VecModel 用法相同
+    model.findSynonyms('158', 20)
+=====================================================================================
+"""
+
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class SkipGramModel:
+    """
+    训练结果，接口与 pyspark.mllib.feature.Word2VecModel 保持一致，
+    trainItem2vec 的后续流程 (写文件、LSH、用户 Embedding) 无需区分后端
+    """
+
+    def __init__(self, itemIds, vectors):
+        self.itemIds = list(itemIds)
+        self.vectors = vectors
+        self.itemIndex = {item: i for i, item in enumerate(self.itemIds)}
+
+    def getVectors(self):
+        """与 mllib 相同，返回 {物品ID: float 列表}，可以直接用于 Spark createDataFrame"""
+        return {item: self.vectors[i].tolist() for i, item in enumerate(self.itemIds)}
+
+    def findSynonyms(self, word, num):
+        """返回与 word 余弦相似度最高的 num 个物品 [(物品, 相似度), ...]，不含 word 本身"""
+        if word not in self.itemIndex:
+            raise ValueError("%s not in vocabulary" % word)
+        norms = np.linalg.norm(self.vectors, axis=1)
+        norms[norms == 0] = 1.0
+        query = self.vectors[self.itemIndex[word]]
+        similarity = self.vectors @ query / (norms * norms[self.itemIndex[word]])
+        similarity[self.itemIndex[word]] = -np.inf
+        top = np.argsort(-similarity)[:num]
+        return [(self.itemIds[i], float(similarity[i])) for i in top]
+
+
+class SkipGramTrainer:
+    """
+    Skip-gram 负采样训练器
+
+    参数 (与 mllib Word2Vec 对应的参数取相同默认值):
+        vectorSize: Embedding 维度
+        windowSize: 上下文窗口大小，每个中心物品的实际窗口在 [1, windowSize] 中随机选取
+        numIterations: 训练轮数
+        minCount: 出现次数少于 minCount 的物品不参与训练
+        learningRate: 初始学习率，随训练进度线性衰减到 learningRate * 1e-4
+        negative: 每个正样本配的负样本数
+        subsample: 高频降采样阈值 t，0 表示不降采样
+        batchSize: 每次梯度更新包含的 (中心, 上下文) 样本对数
+        numWorkers: 训练线程数
+        seed: 随机种子
+    """
+
+    def __init__(self, vectorSize=100, windowSize=5, numIterations=1, minCount=5, learningRate=0.025,
+                 negative=5, subsample=1e-3, batchSize=1024, numWorkers=4, seed=42, negativeTableSize=1000000):
+        self.vectorSize = vectorSize
+        self.windowSize = windowSize
+        self.numIterations = numIterations
+        self.minCount = minCount
+        self.learningRate = learningRate
+        self.negative = negative
+        self.subsample = subsample
+        self.batchSize = batchSize
+        self.numWorkers = numWorkers
+        self.seed = seed
+        self.negativeTableSize = negativeTableSize
+
+    def buildVocabulary(self, sequences):
+        """统计词频，过滤低频物品，返回 (物品列表, 计数数组, 编码后的序列列表)"""
+        counts = Counter()
+        for seq in sequences:
+            counts.update(seq)
+        itemIds = sorted((item for item, cnt in counts.items() if cnt >= self.minCount),
+                         key=lambda item: -counts[item])
+        itemIndex = {item: i for i, item in enumerate(itemIds)}
+        encoded = []
+        for seq in sequences:
+            ids = np.fromiter((itemIndex[item] for item in seq if item in itemIndex), dtype=np.int32)
+            if len(ids) > 1:
+                encoded.append(ids)
+        return itemIds, np.array([counts[item] for item in itemIds], dtype=np.float64), encoded
+
+    def buildNegativeTable(self, itemCounts):
+        """按 词频^0.75 的分布构建负采样表，采样时只需随机取一个下标"""
+        weights = itemCounts ** 0.75
+        weights /= weights.sum()
+        return np.repeat(np.arange(len(itemCounts), dtype=np.int32),
+                         np.round(weights * self.negativeTableSize).astype(np.int64))
+
+    def keepProbabilities(self, itemCounts):
+        """高频降采样中每个物品的保留概率"""
+        if not self.subsample:
+            return np.ones(len(itemCounts))
+        freq = itemCounts / itemCounts.sum()
+        threshold = self.subsample
+        return np.minimum(1.0, (np.sqrt(freq / threshold) + 1) * threshold / freq)
+
+    def generatePairs(self, block, keepProb, rng):
+        """
+        为一块序列批量生成 (中心, 上下文) 样本对
+
+        先对每条序列做高频降采样，再把这块序列拼接成一个长数组，
+        用 sentenceIds 标记每个位置属于哪条序列，避免跨序列组成样本对
+        """
+        kept = [seq[rng.random(len(seq)) < keepProb[seq]] for seq in block]
+        ids = np.concatenate(kept)
+        sentenceIds = np.repeat(np.arange(len(kept)), [len(seq) for seq in kept])
+        # 动态窗口: 每个中心位置的实际窗口大小在 [1, windowSize] 中随机
+        spans = rng.integers(1, self.windowSize + 1, size=len(ids))
+
+        centers, contexts = [], []
+        for offset in range(1, self.windowSize + 1):
+            if offset >= len(ids):
+                break
+            sameSentence = sentenceIds[:-offset] == sentenceIds[offset:]
+            # 左边的物品作为中心，右边 offset 处为上下文
+            forward = sameSentence & (spans[:-offset] >= offset)
+            centers.append(ids[:-offset][forward])
+            contexts.append(ids[offset:][forward])
+            # 右边的物品作为中心，左边 offset 处为上下文
+            backward = sameSentence & (spans[offset:] >= offset)
+            centers.append(ids[offset:][backward])
+            contexts.append(ids[:-offset][backward])
+        if not centers:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        centers, contexts = np.concatenate(centers), np.concatenate(contexts)
+        order = rng.permutation(len(centers))
+        return centers[order], contexts[order]
+
+    def trainBatch(self, inVectors, outVectors, centers, contexts, negativeTable, learningRate, rng):
+        """对一批样本对做一次 SGD 更新 (Hogwild，直接写共享矩阵)"""
+        negatives = negativeTable[rng.integers(0, len(negativeTable), size=(len(centers), self.negative))]
+        targets = np.concatenate([contexts[:, None], negatives], axis=1)
+        labels = np.zeros(targets.shape, dtype=np.float32)
+        labels[:, 0] = 1.0
+
+        hidden = inVectors[centers]
+        targetVectors = outVectors[targets]
+        scores = np.einsum('bd,bkd->bk', hidden, targetVectors)
+        # gradient = (label - sigmoid(score)) * learningRate
+        gradient = (labels - 1.0 / (1.0 + np.exp(-np.clip(scores, -6, 6)))) * learningRate
+
+        np.add.at(inVectors, centers, np.einsum('bk,bkd->bd', gradient, targetVectors))
+        np.add.at(outVectors, targets, gradient[:, :, None] * hidden[:, None, :])
+
+    def fit(self, sequences):
+        """
+        训练模型
+
+        参数:
+            sequences: 物品序列的可迭代对象，如 [['858', '50', '593'], ...]
+                       Spark RDD 需要先 collect() 成本地列表
+
+        返回:
+            SkipGramModel
+        """
+        sequences = [list(seq) for seq in sequences]
+        itemIds, itemCounts, encoded = self.buildVocabulary(sequences)
+        rng = np.random.default_rng(self.seed)
+        numItems = len(itemIds)
+        # 与 word2vec 原始实现相同: 输入向量小随机初始化，输出向量初始化为 0
+        inVectors = ((rng.random((numItems, self.vectorSize)) - 0.5) / self.vectorSize).astype(np.float32)
+        outVectors = np.zeros((numItems, self.vectorSize), dtype=np.float32)
+        if numItems == 0:
+            return SkipGramModel(itemIds, inVectors)
+
+        negativeTable = self.buildNegativeTable(itemCounts)
+        keepProb = self.keepProbabilities(itemCounts)
+        numBlocks = max(1, min(len(encoded), self.numWorkers * 4))
+        totalSteps = self.numIterations * numBlocks
+        minLearningRate = self.learningRate * 1e-4
+
+        def trainBlock(task):
+            iteration, blockIndex, block = task
+            blockRng = np.random.default_rng([self.seed, iteration, blockIndex])
+            centers, contexts = self.generatePairs(block, keepProb, blockRng)
+            progress = (iteration * numBlocks + blockIndex) / totalSteps
+            learningRate = max(minLearningRate, self.learningRate * (1 - progress))
+            for start in range(0, len(centers), self.batchSize):
+                end = start + self.batchSize
+                self.trainBatch(inVectors, outVectors, centers[start:end], contexts[start:end],
+                                negativeTable, learningRate, blockRng)
+
+        with ThreadPoolExecutor(max_workers=self.numWorkers) as pool:
+            for iteration in range(self.numIterations):
+                order = rng.permutation(len(encoded))
+                blocks = [[encoded[i] for i in chunk] for chunk in np.array_split(order, numBlocks)]
+                list(pool.map(trainBlock, [(iteration, b, block) for b, block in enumerate(blocks) if block]))
+
+        return SkipGramModel(itemIds, inVectors)
+
+
+def neighborOverlap(modelA, modelB, queryItems, k=10):
+    """
+    两个模型近邻结果的平均重合率: |topK_A ∩ topK_B| / k
+
+    Embedding 本身在不同训练之间没有可比性 (任意旋转都等价)，
+    但同一物品的近邻集合是可以比较的
+    """
+    overlaps = []
+    for item in queryItems:
+        neighborsA = {neighbor for neighbor, _ in modelA.findSynonyms(item, k)}
+        neighborsB = {neighbor for neighbor, _ in modelB.findSynonyms(item, k)}
+        overlaps.append(len(neighborsA & neighborsB) / k)
+    return float(np.mean(overlaps)) if overlaps else 0.0
+
+
+def benchmarkAgainstMllib(samples, embLength, numQueries=100, k=10, numWorkers=4):
+    """
+    对比 mllib Word2Vec 与本地 SGNS 训练器的耗时和近邻重合率
+
+    参数:
+        samples: 序列 RDD (如 processItemSequence 的输出)
+        embLength: Embedding 维度
+
+    返回:
+        字典，包含两种后端的耗时，以及:
+        - mllibVsNumpyOverlap: 两种后端近邻集合的重合率
+        - mllibSelfOverlap: mllib 换一个随机种子重新训练后与自身的重合率，
+          作为"训练随机性本身带来的差异"的参照
+    """
+    from pyspark.mllib.feature import Word2Vec
+
+    def trainMllib(seed):
+        startTime = time.time()
+        model = Word2Vec().setVectorSize(embLength).setWindowSize(5).setNumIterations(10).setSeed(seed).fit(samples)
+        # 收集向量是 mllib 路径的固有开销，一并计时
+        vectors = {item: np.asarray(vector) for item, vector in model.getVectors().items()}
+        return SkipGramModel(list(vectors.keys()), np.array(list(vectors.values()))), time.time() - startTime
+
+    mllibModel, mllibSeconds = trainMllib(42)
+    mllibModel2, _ = trainMllib(7)
+
+    startTime = time.time()
+    localSamples = samples.collect()
+    numpyModel = SkipGramTrainer(vectorSize=embLength, windowSize=5, numIterations=10,
+                                 numWorkers=numWorkers).fit(localSamples)
+    numpySeconds = time.time() - startTime
+
+    common = [item for item in mllibModel.itemIds if item in numpyModel.itemIndex]
+    queries = common[:numQueries]
+    return {
+        'mllibSeconds': mllibSeconds,
+        'numpySeconds': numpySeconds,
+        'vocabularySize': len(common),
+        'mllibVsNumpyOverlap': neighborOverlap(mllibModel, numpyModel, queries, k),
+        'mllibSelfOverlap': neighborOverlap(mllibModel, mllibModel2, queries, k),
+    }
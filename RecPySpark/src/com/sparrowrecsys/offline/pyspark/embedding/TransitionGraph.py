@@ -0,0 +1,422 @@
+"""
+=====================================================================================
+TransitionGraph.py - 紧凑的物品转移图 (CSR 格式)
+
+Embedding.py 中的 generateTransitionMatrix 存在两个内存问题:
+1. countByValue() 把所有相邻物品对的计数直方图一次性拉回 Driver
+2. 用三层以字符串电影ID为键的 defaultdict 存储转移矩阵，
+   每条边都要付出 Python 字典 + 字符串对象的开销，物品数到几十万时 Driver 内存爆炸
+
+本模块的做法:
+1. 相邻物品对的计数用 reduceByKey 在集群上分布式聚合
+2. 把电影ID映射为连续整数 0..n-1，Driver 只接收 (起点, 终点, 次数) 三元组的 NumPy 数组
+3. 用 CSR (Compressed Sparse Row，压缩稀疏行) 格式存储转移图:
+
+    itemIds    : 节点编号 -> 电影ID
+    indptr     : 节点 i 的出边位于 [indptr[i], indptr[i+1]) 区间，长度 n+1
+    indices    : 每条出边的目标节点编号 (int32)
+    counts     : 每条出边被观察到的次数 (float32)
+    probs      : 每条出边的转移概率 P(j|i) (float32)
+    startProbs : 每个节点作为游走起点的概率 (float64)
+
+    示例: A->B 2次, B->C 2次, B->D 1次
+        itemIds = [A, B, C, D]
+        indptr  = [0, 1, 3, 3, 3]
+        indices = [1, 2, 3]
+        probs   = [1.0, 0.67, 0.33]
+
+每条边只占 12 字节 (int32 + 2 × float32)，而嵌套字典通常每条边要几百字节
+=====================================================================================
+"""
+
+import json
+import os
+from operator import add
+
+import numpy as np
+
+
+class TransitionGraph:
+    """
+    CSR 格式的物品转移图
+
+    随机游走 (RandomWalk.AliasWalkEngine.fromGraph) 和持久化 (save / load)
+    都直接使用这个结构
+    """
+
+    def __init__(self, itemIds, indptr, indices, counts):
+        self.itemIds = np.asarray(itemIds, dtype=str)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.counts = np.asarray(counts, dtype=np.float32)
+        self.normalize()
+
+    def normalize(self):
+        """由边计数重新计算转移概率和起点分布"""
+        rowOfEdge = np.repeat(np.arange(self.numNodes()), self.degrees())
+        self.rowSums = np.bincount(rowOfEdge, weights=self.counts, minlength=self.numNodes())
+        self.probs = (self.counts / self.rowSums[rowOfEdge]).astype(np.float32)
+        self.updateStartProbs()
+
+    def updateStartProbs(self):
+        """起点分布 = 每个节点的出边总次数 / 全部边的总次数"""
+        total = self.rowSums.sum()
+        self.startProbs = self.rowSums / total if total > 0 else self.rowSums.copy()
+
+    def normalizeRows(self, rows):
+        """只重新计算指定行的转移概率，代价与这些行的出边数成正比"""
+        for row in rows:
+            start, end = self.indptr[row], self.indptr[row + 1]
+            self.rowSums[row] = self.counts[start:end].sum()
+            if self.rowSums[row] > 0:
+                self.probs[start:end] = self.counts[start:end] / self.rowSums[row]
+        self.updateStartProbs()
+
+    def addEdgeCounts(self, srcItems, dstItems, counts):
+        """
+        把一批增量边计数合并进图中，只重新归一化受影响的行
+
+        - 已存在的边: 在该行内二分查找 (每行的 indices 有序)，原地累加计数
+        - 新出现的边: 一次性用 np.insert 插入到各自行的有序位置
+        - 新出现的物品: 追加为新节点
+
+        参数:
+            srcItems, dstItems: 起点、终点的电影ID列表 (int 或 str 均可，统一按字符串匹配已有节点)
+            counts: 每条边新增的次数
+
+        返回:
+            受影响的节点编号集合
+        """
+        # itemIds 以字符串存储，typed loader 读出的 movieId 是 int，先统一成字符串再查找
+        srcItems = [str(item) for item in srcItems]
+        dstItems = [str(item) for item in dstItems]
+        itemIndex = {item: i for i, item in enumerate(self.itemIds)}
+        newItems = []
+        for item in list(srcItems) + list(dstItems):
+            if item not in itemIndex:
+                itemIndex[item] = len(self.itemIds) + len(newItems)
+                newItems.append(item)
+        if newItems:
+            self.itemIds = np.concatenate([self.itemIds, np.asarray(newItems, dtype=str)])
+            self.indptr = np.concatenate([self.indptr, np.full(len(newItems), self.indptr[-1])])
+            self.rowSums = np.concatenate([self.rowSums, np.zeros(len(newItems))])
+
+        affectedRows = set()
+        insertRows, insertPositions, insertIndices, insertCounts = [], [], [], []
+        for srcItem, dstItem, cnt in zip(srcItems, dstItems, counts):
+            row, col = itemIndex[srcItem], itemIndex[dstItem]
+            start, end = self.indptr[row], self.indptr[row + 1]
+            pos = start + np.searchsorted(self.indices[start:end], col)
+            if pos < end and self.indices[pos] == col:
+                self.counts[pos] += cnt
+            else:
+                insertRows.append(row)
+                insertPositions.append(pos)
+                insertIndices.append(col)
+                insertCounts.append(cnt)
+            affectedRows.add(row)
+
+        if insertPositions:
+            # 同一位置可能插入多条边 (连续的空行共享同一个位置)，
+            # 按 (位置, 行, 目标节点) 排序，保证插入后各行连续且行内有序
+            order = np.lexsort((insertIndices, insertRows, insertPositions))
+            positions = np.asarray(insertPositions)[order]
+            self.indices = np.insert(self.indices, positions, np.asarray(insertIndices, dtype=np.int32)[order])
+            self.counts = np.insert(self.counts, positions, np.asarray(insertCounts, dtype=np.float32)[order])
+            self.probs = np.insert(self.probs, positions, np.float32(0))
+            # 每行新增的边数累加到该行之后的 indptr 上
+            self.indptr[1:] += np.cumsum(np.bincount(insertRows, minlength=self.numNodes()))
+
+        self.normalizeRows(sorted(affectedRows))
+        return affectedRows
+
+    def numNodes(self):
+        return len(self.itemIds)
+
+    def numEdges(self):
+        return len(self.indices)
+
+    def degrees(self):
+        return np.diff(self.indptr)
+
+    def nbytes(self):
+        """图结构占用的字节数 (NumPy 数组的实际大小)"""
+        return sum(array.nbytes for array in
+                   (self.itemIds, self.indptr, self.indices, self.counts, self.probs, self.startProbs))
+
+    def summary(self):
+        maxDegree = int(self.degrees().max()) if self.numNodes() else 0
+        return "nodes: %d, edges: %d, max out-degree: %d, bytes: %d" % (
+            self.numNodes(), self.numEdges(), maxDegree, self.nbytes())
+
+    def prune(self, topK=None, minCount=None, popularityDamping=None):
+        """
+        剪枝并重新加权，返回一个新的 TransitionGraph (原图不变)
+
+        为什么要剪枝？
+        - 只出现过一两次的转移多半是噪声，却和真实关联占用同样的内存
+        - 热门电影 (hub) 的出度极大，内存和游走时的 alias 表都随出度膨胀
+        - 热门电影作为终点时的转移概率很高，游走会反复被吸引到少数几个 hub 上
+
+        参数:
+            topK: 每个节点只保留权重最高的 K 条出边
+            minCount: 丢弃观察次数小于 minCount 的边
+            popularityDamping: 热度衰减指数 alpha，边权重变为
+                               count(i->j) / inCount(j) ^ alpha，
+                               inCount(j) 为终点 j 的总入边次数，alpha=0 等价于不加权
+
+        注意:
+            剪枝后的 counts 存的是权重而不是原始次数，
+            不要再把剪枝后的图交给 IncrementalGraphStore 做增量更新
+        """
+        rowOfEdge = np.repeat(np.arange(self.numNodes()), self.degrees())
+        weights = self.counts.astype(np.float64)
+        if popularityDamping:
+            inCounts = np.bincount(self.indices, weights=self.counts, minlength=self.numNodes())
+            weights = weights / inCounts[self.indices] ** popularityDamping
+
+        keep = np.ones(self.numEdges(), dtype=bool)
+        if minCount is not None:
+            keep &= self.counts >= minCount
+        if topK is not None:
+            # 行内按权重降序排列，行内名次 < topK 的边保留
+            order = np.lexsort((-weights, rowOfEdge))
+            rowStart = np.searchsorted(rowOfEdge[order], rowOfEdge[order], side='left')
+            rank = np.empty(self.numEdges(), dtype=np.int64)
+            rank[order] = np.arange(self.numEdges()) - rowStart
+            keep &= rank < topK
+
+        return TransitionGraph.fromEdges(self.itemIds, rowOfEdge[keep], self.indices[keep], weights[keep])
+
+    def toTransitionMatrix(self):
+        """转换回 generateTransitionMatrix 的嵌套字典格式，便于与旧代码对照"""
+        transitionMatrix = {}
+        itemDistribution = {}
+        for node in np.flatnonzero(self.degrees()):
+            start, end = self.indptr[node], self.indptr[node + 1]
+            transitionMatrix[str(self.itemIds[node])] = {
+                str(self.itemIds[j]): float(p) for j, p in zip(self.indices[start:end], self.probs[start:end])}
+            itemDistribution[str(self.itemIds[node])] = float(self.startProbs[node])
+        return transitionMatrix, itemDistribution
+
+    def save(self, path):
+        """保存为 .npz 文件 (不使用 pickle，可跨 Python 版本加载)"""
+        np.savez(path, itemIds=self.itemIds, indptr=self.indptr, indices=self.indices, counts=self.counts)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['itemIds'], data['indptr'], data['indices'], data['counts'])
+
+    @classmethod
+    def fromEdges(cls, itemIds, src, dst, counts):
+        """
+        由 (起点, 终点, 次数) 三元组数组构建 CSR 图
+
+        参数:
+            itemIds: 节点编号 -> 电影ID
+            src, dst: 起点、终点的节点编号数组
+            counts: 每条边的次数
+        """
+        order = np.lexsort((dst, src))
+        src, dst, counts = src[order], dst[order], counts[order]
+        indptr = np.zeros(len(itemIds) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=len(itemIds)), out=indptr[1:])
+        return cls(itemIds, indptr, dst, counts)
+
+
+def buildTransitionGraph(samples):
+    """
+    从用户行为序列分布式地构建 CSR 转移图，替代 generateTransitionMatrix
+
+    参数:
+        samples: RDD，每个元素是一个物品序列，如 ['858', '50', '593']
+
+    返回:
+        TransitionGraph 实例
+
+    执行流程:
+        序列 RDD --flatMap--> 相邻物品对 --reduceByKey--> (物品对, 次数)
+                                                            |
+        物品ID 去重后编号 0..n-1 (只有物品表回到 Driver)    |
+                                                            v
+        每个分区把三元组编码成 NumPy 数组 --collect--> 拼接成 CSR
+    """
+    # Step 1: 分布式统计相邻物品对的次数
+    pairCounts = samples \
+        .flatMap(lambda seq: zip(seq[:-1], seq[1:])) \
+        .map(lambda pair: (pair, 1)) \
+        .reduceByKey(add)
+    pairCounts.cache()
+
+    # Step 2: 物品ID -> 连续整数，物品表大小只与电影数量有关
+    itemIds = sorted(pairCounts.flatMap(lambda kv: kv[0]).distinct().collect())
+    itemIndex = pairCounts.context.broadcast({item: i for i, item in enumerate(itemIds)})
+
+    # Step 3: 每个分区把边编码为紧凑的 NumPy 数组再回传 Driver
+    def encodePartition(rows):
+        index = itemIndex.value
+        src, dst, counts = [], [], []
+        for (item1, item2), cnt in rows:
+            src.append(index[item1])
+            dst.append(index[item2])
+            counts.append(cnt)
+        yield (np.array(src, dtype=np.int32), np.array(dst, dtype=np.int32), np.array(counts, dtype=np.float32))
+
+    parts = pairCounts.mapPartitions(encodePartition).collect()
+    pairCounts.unpersist()
+    itemIndex.unpersist()
+
+    src = np.concatenate([p[0] for p in parts]) if parts else np.zeros(0, dtype=np.int32)
+    dst = np.concatenate([p[1] for p in parts]) if parts else np.zeros(0, dtype=np.int32)
+    counts = np.concatenate([p[2] for p in parts]) if parts else np.zeros(0, dtype=np.float32)
+    return TransitionGraph.fromEdges(itemIds, src, dst, counts)
+
+
+class IncrementalGraphStore:
+    """
+    持久化的边计数存储，每次只摄入上次运行之后的新增评分
+
+    全量重建: processItemSequence -> buildTransitionGraph，代价 O(全部历史评分)
+    增量更新: 只读取新评分 + 这些用户上一次看过的物品，代价 O(新增评分)
+
+    为什么需要记录每个用户最后看过的物品？
+        用户历史序列: A -> B -> C  (已摄入，图中有 A->B, B->C)
+        新增评分:     D -> E
+        完整序列应为 A -> B -> C -> D -> E，需要补上"边界边" C->D，
+        而 C 就是该用户上次最后看过的物品
+
+    目录结构:
+        storeDir/
+            state.json          {"version": 3, "watermark": 1260759205, "graph": "graph-00003.npz"}
+            graph-00003.npz     TransitionGraph (边计数)
+            userState-00003/    Parquet: 每个用户最后看过的物品 (userId, movieId, timestamp)
+
+    提交的原子性:
+        图和用户状态都按版本号写成新文件，不覆盖当前版本；state.json 是指向当前版本的唯一指针，
+        最后用 os.replace 原子替换。任何一步中断，state.json 仍指向旧版本的图、watermark 和用户状态，
+        下次运行重新摄入同一批增量，不会重复计数
+
+    graph / state.json 是 Driver 本地文件；userState 由 Spark 读写，路径按 Spark 默认文件系统解析
+
+    用法:
+        store = IncrementalGraphStore(storeDir)
+        store.ingestRatings(spark, ratingSamples)   # 首次运行即全量构建
+        graphEmb(..., transitionGraph=store.graph)
+    """
+
+    def __init__(self, storeDir, minRating=3.5):
+        self.storeDir = storeDir
+        self.minRating = minRating
+        self.version = 0
+        self.watermark = None
+        statePath = os.path.join(storeDir, 'state.json')
+        if os.path.exists(statePath):
+            with open(statePath) as f:
+                state = json.load(f)
+            self.version = state['version']
+            self.watermark = state['watermark']
+            self.graph = TransitionGraph.load(os.path.join(storeDir, state.get('graph', 'graph.npz')))
+        else:
+            self.graph = TransitionGraph.fromEdges(np.zeros(0, dtype=str), np.zeros(0, dtype=np.int32),
+                                                   np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+
+    def userStatePath(self, version):
+        return os.path.join(self.storeDir, 'userState-%05d' % version)
+
+    @staticmethod
+    def graphFileName(version):
+        return 'graph-%05d.npz' % version
+
+    def ingestRatings(self, spark, ratingSamples):
+        """
+        摄入评分数据中时间戳晚于 watermark 的部分，更新边计数并持久化
+
+        参数:
+            spark: SparkSession 实例
+            ratingSamples: 评分 DataFrame (userId, movieId, rating, timestamp)，
+                           可以是全量 ratings.csv，早于 watermark 的评分会被跳过
+
+        返回:
+            受影响 (重新归一化) 的节点编号集合
+        """
+        from pyspark.sql import functions as F
+
+        # 与 processItemSequence 一致，只保留高分评分
+        newRatings = ratingSamples \
+            .where(F.col('rating') >= self.minRating) \
+            .select('userId', F.col('movieId').cast('string').alias('movieId'),
+                    F.col('timestamp').cast('long').alias('timestamp'))
+        if self.watermark is not None:
+            newRatings = newRatings.where(F.col('timestamp') > self.watermark)
+        newRatings.cache()
+        newWatermark = newRatings.agg(F.max('timestamp')).head()[0]
+        if newWatermark is None:
+            newRatings.unpersist()
+            return set()
+
+        # 有新评分的用户，补上他们上一次最后看过的物品
+        events = newRatings
+        lastItems = None
+        if self.version > 0:
+            lastItems = spark.read.parquet(self.userStatePath(self.version))
+            events = lastItems \
+                .join(newRatings.select('userId').distinct(), on='userId', how='left_semi') \
+                .unionByName(newRatings)
+
+        # 按时间排序形成每个用户的增量序列，struct 先按 timestamp 比较
+        userEvents = events.groupBy('userId') \
+            .agg(F.sort_array(F.collect_list(F.struct('timestamp', 'movieId'))).alias('events'))
+        userEvents.cache()
+
+        pairCounts = userEvents.rdd \
+            .map(lambda row: [event['movieId'] for event in row['events']]) \
+            .flatMap(lambda seq: zip(seq[:-1], seq[1:])) \
+            .map(lambda pair: (pair, 1)) \
+            .reduceByKey(add) \
+            .collect()
+        affectedRows = self.graph.addEdgeCounts([pair[0] for pair, _ in pairCounts],
+                                                [pair[1] for pair, _ in pairCounts],
+                                                [cnt for _, cnt in pairCounts])
+
+        # 更新用户状态: 本批有新评分的用户替换为新的最后物品，其余用户保持不变
+        updatedUsers = userEvents \
+            .select('userId', F.element_at('events', -1).alias('last')) \
+            .select('userId', 'last.timestamp', 'last.movieId')
+        if lastItems is not None:
+            updatedUsers = lastItems.join(updatedUsers.select('userId'), on='userId', how='left_anti') \
+                .unionByName(updatedUsers)
+        updatedUsers.write.mode('overwrite').parquet(self.userStatePath(self.version + 1))
+        userEvents.unpersist()
+        newRatings.unpersist()
+
+        self.commit(newWatermark)
+        # 旧版本的用户状态已不再被 state.json 引用，通过 Spark 的文件系统删除 (本地或 HDFS 都适用)
+        if self.version > 1:
+            statePath = spark._jvm.org.apache.hadoop.fs.Path(self.userStatePath(self.version - 1))
+            statePath.getFileSystem(spark._jsc.hadoopConfiguration()).delete(statePath, True)
+        return affectedRows
+
+    def commit(self, watermark):
+        """
+        把图写成新版本的文件，再原子替换 state.json 指向它 (唯一的提交点)，最后删除旧版本的图
+
+        用户状态 userState-<version+1> 由 ingestRatings 在调用前写好
+        """
+        if not os.path.exists(self.storeDir):
+            os.makedirs(self.storeDir)
+        previousVersion = self.version
+        version = previousVersion + 1
+        graphFile = self.graphFileName(version)
+        self.graph.save(os.path.join(self.storeDir, graphFile))
+
+        stateTmpPath = os.path.join(self.storeDir, 'state.json.tmp')
+        with open(stateTmpPath, 'w') as f:
+            json.dump({'version': version, 'watermark': int(watermark), 'graph': graphFile}, f)
+        os.replace(stateTmpPath, os.path.join(self.storeDir, 'state.json'))
+        self.version = version
+        self.watermark = int(watermark)
+
+        for oldGraph in (self.graphFileName(previousVersion), 'graph.npz'):
+            if os.path.exists(os.path.join(self.storeDir, oldGraph)):
+                os.remove(os.path.join(self.storeDir, oldGraph))
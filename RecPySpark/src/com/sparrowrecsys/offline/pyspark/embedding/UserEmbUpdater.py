@@ -0,0 +1,354 @@
+"""
+=====================================================================================
+UserEmbUpdater.py - 基于评分事件流的用户 Embedding 增量更新
+
+generateUserEmb 每晚在全量历史上重新计算一遍用户 Embedding，用户的新行为要等到第二天才能生效。
+用户 Embedding 是物品 Embedding 的 (加权) 和，天然可以增量维护:
+    新的评分事件 (user, movie, rating, t) 到来时，只需把 movie 的向量累加到 user 的状态上，
+    代价为 O(dim)，与用户的历史长度无关。
+
+每个用户维护的状态:
+    sums[u]:     Σ w_i * e_i       (dim 维，float64)
+    weights[u]:  Σ w_i
+    refTimes[u]: 该用户最近一次事件的时间 (仅 timeDecay 使用)
+
+池化方式与 Embedding.aggregateUserEmb 一致:
+    'sum':            w_i = 1，输出 sums
+    'mean':           w_i = 1，输出 sums / weights
+    'ratingWeighted': w_i = r_i，输出 sums / weights
+    'timeDecay':      w_i = 0.5 ^ ((T - t_i) / 半衰期)，输出 sums / weights
+                      每来一个更新的事件，先把旧状态整体乘以衰减系数，再加上新向量，
+                      sums 与 weights 同比例缩放，比值与批量计算时选取的参考时间 T 无关
+
+事件源 (RatingLogSource):
+    一个 ratings.csv 格式的文件 (userId,movieId,rating,timestamp)，或者包含多个这类文件的目录。
+    记录每个文件已读到的字节偏移，每次 poll 只读取新追加的完整行
+
+初始状态:
+    generateUserEmb(saveUserState=True) 在输出旁边写出每个用户的 sums / weights / refTimes 和
+    watermark (批量数据中最晚的事件时间)，更新器以它为起点，只消费晚于 watermark 的事件，
+    新评分在全量历史向量上累加，而不是替换它。没有检查点也没有批量状态时，要求输出库不存在。
+
+输出:
+    更新过的用户写入与 generateUserEmb 相同的 Embedding 库 (UserEmbSink，只打开一次):
+    - 二进制库 (EmbeddingStore 格式): id -> 行号的索引常驻内存，原地覆盖已有用户的行，新用户追加到末尾
+    - 文本库 (userEmb.csv): 更新过的用户追加到文件末尾，同一用户以最后一行为准 (与线上加载顺序一致)；
+      行数超过用户数的两倍时整体压缩一次，均摊代价与更新的用户数成正比
+=====================================================================================
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+from AnnIndex import loadEmbeddingMatrix
+from EmbeddingStore import EMB_SUFFIX, EmbeddingStoreWriter, TextEmbeddingAppender
+
+POOLING_MODES = ('sum', 'mean', 'ratingWeighted', 'timeDecay')
+# generateUserEmb(saveUserState=True) 在 userEmb.csv 旁边写出的批量状态: userEmb.state.npz
+USER_STATE_SUFFIX = '.state.npz'
+
+
+def userStatePath(embOutputPath):
+    """与 Embedding 输出路径对应的批量状态文件，如 .../userEmb.csv -> .../userEmb.state.npz"""
+    return os.path.splitext(embOutputPath)[0] + USER_STATE_SUFFIX
+
+
+def saveUserState(path, userIds, sums, weights, refTimes, poolingMode, halfLifeSeconds, offsets=None,
+                  watermark=None):
+    """
+    保存用户的增量状态 (检查点与批量状态共用这一种格式)
+
+    参数:
+        userIds, sums, weights, refTimes: 每个用户的状态，含义见模块说明
+        offsets: 事件源的读取偏移 {文件名: 字节数}，批量状态为空
+        watermark: 状态已经包含的最晚事件时间，时间戳不晚于它的事件在恢复后被跳过
+    """
+    tmpPath = path + '.tmp.npz'
+    np.savez(tmpPath, userIds=np.array(userIds, dtype=str), sums=np.asarray(sums, dtype=np.float64),
+             weights=np.asarray(weights, dtype=np.float64), refTimes=np.asarray(refTimes, dtype=np.int64),
+             meta=np.array(json.dumps({'poolingMode': poolingMode, 'halfLifeSeconds': halfLifeSeconds,
+                                       'offsets': offsets or {}, 'watermark': watermark})))
+    os.replace(tmpPath, path)
+
+
+class RatingLogSource:
+    """
+    追加写入的评分日志 (单个文件或目录)
+
+    参数:
+        path: ratings.csv 格式的文件，或者存放这类文件的目录 (按文件名顺序读取，新文件会被自动发现)
+        offsets: {文件名: 已读取的字节数}，从检查点恢复时传入
+    """
+
+    def __init__(self, path, offsets=None):
+        self.path = path
+        self.offsets = dict(offsets or {})
+
+    def files(self):
+        if os.path.isdir(self.path):
+            return [os.path.join(self.path, name) for name in sorted(os.listdir(self.path))
+                    if not name.startswith('.') and not name.startswith('_')]
+        return [self.path] if os.path.exists(self.path) else []
+
+    def poll(self):
+        """
+        读取上次 poll 之后新追加的评分事件
+
+        只消费以换行符结尾的完整行，写了一半的最后一行留到下次读取
+
+        返回:
+            列表 [(userId, movieId, rating, timestamp), ...]
+        """
+        events = []
+        for filePath in self.files():
+            offset = self.offsets.get(filePath, 0)
+            if os.path.getsize(filePath) <= offset:
+                continue
+            with open(filePath, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+            complete = data[:data.rfind(b'\n') + 1]
+            self.offsets[filePath] = offset + len(complete)
+            for line in complete.decode('utf-8').splitlines():
+                fields = line.strip().split(',')
+                if len(fields) < 4 or not fields[0].isdigit():
+                    # 表头或空行
+                    continue
+                events.append((fields[0], fields[1], float(fields[2]), int(fields[3])))
+        return events
+
+
+class UserEmbUpdater:
+    """
+    用户 Embedding 的增量状态
+
+    参数:
+        itemIds, itemVectors: 物品 Embedding (如 item2vecEmb.csv 的内容)
+        poolingMode: 'sum' / 'mean' / 'ratingWeighted' / 'timeDecay'
+        decayHalfLifeDays: timeDecay 的半衰期 (天)
+    """
+
+    def __init__(self, itemIds, itemVectors, poolingMode='sum', decayHalfLifeDays=30.0):
+        if poolingMode not in POOLING_MODES:
+            raise ValueError("poolingMode must be one of %s, got %r" % (POOLING_MODES, poolingMode))
+        self.itemIndex = {str(itemId): row for row, itemId in enumerate(itemIds)}
+        self.itemVectors = np.asarray(itemVectors, dtype=np.float64)
+        self.poolingMode = poolingMode
+        self.halfLifeSeconds = decayHalfLifeDays * 24 * 3600
+        self.userIds = []
+        self.userIndex = {}
+        self.watermark = None
+        dim = self.itemVectors.shape[1]
+        self.sums = np.zeros((0, dim))
+        self.weights = np.zeros(0)
+        self.refTimes = np.zeros(0, dtype=np.int64)
+
+    @property
+    def dim(self):
+        return self.itemVectors.shape[1]
+
+    def userRow(self, userId):
+        """返回用户的状态行号，新用户时追加一行 (容量按 2 倍扩展，均摊 O(1))"""
+        row = self.userIndex.get(userId)
+        if row is not None:
+            return row
+        row = len(self.userIds)
+        if row == len(self.weights):
+            capacity = max(1024, 2 * row)
+            self.sums = np.resize(self.sums, (capacity, self.dim))
+            self.weights = np.resize(self.weights, capacity)
+            self.refTimes = np.resize(self.refTimes, capacity)
+        self.sums[row] = 0.0
+        self.weights[row] = 0.0
+        self.refTimes[row] = 0
+        self.userIds.append(userId)
+        self.userIndex[userId] = row
+        return row
+
+    def applyEvent(self, userId, movieId, rating, timestamp):
+        """
+        把一条评分事件累加到用户状态上，O(dim)
+
+        没有 Embedding 的电影直接跳过 (与批量计算中的 inner join 一致)
+
+        返回:
+            更新的用户行号，事件被跳过时返回 None
+        """
+        # 物品 / 用户ID统一按字符串处理，与 Embedding 文件和 Redis key 一致 (调用方可能传入 int)
+        itemRow = self.itemIndex.get(str(movieId))
+        if itemRow is None:
+            return None
+        row = self.userRow(str(userId))
+        vector = self.itemVectors[itemRow]
+        if self.poolingMode == 'timeDecay':
+            if self.weights[row] == 0.0 or timestamp >= self.refTimes[row]:
+                # 新事件更晚: 旧状态整体衰减到新的参考时间，新事件权重为 1
+                factor = 0.5 ** ((timestamp - self.refTimes[row]) / self.halfLifeSeconds) if self.weights[row] else 0.0
+                self.sums[row] *= factor
+                self.weights[row] = self.weights[row] * factor + 1.0
+                self.sums[row] += vector
+                self.refTimes[row] = timestamp
+            else:
+                # 迟到的事件: 按与参考时间的差值衰减后再累加
+                weight = 0.5 ** ((self.refTimes[row] - timestamp) / self.halfLifeSeconds)
+                self.sums[row] += weight * vector
+                self.weights[row] += weight
+        else:
+            weight = rating if self.poolingMode == 'ratingWeighted' else 1.0
+            self.sums[row] += weight * vector
+            self.weights[row] += weight
+        return row
+
+    def applyEvents(self, events):
+        """
+        批量应用事件，返回被更新的用户行号集合
+
+        从批量状态启动时，时间戳不晚于 watermark 的事件已经包含在状态中，直接跳过
+        """
+        updated = set()
+        for userId, movieId, rating, timestamp in events:
+            if self.watermark is not None and timestamp <= self.watermark:
+                continue
+            row = self.applyEvent(userId, movieId, rating, timestamp)
+            if row is not None:
+                updated.add(row)
+        return updated
+
+    def vectors(self, rows=None):
+        """返回指定用户 (默认全部) 当前的 Embedding 矩阵"""
+        rows = np.arange(len(self.userIds)) if rows is None else np.asarray(sorted(rows), dtype=np.int64)
+        if self.poolingMode == 'sum':
+            return self.sums[rows]
+        return self.sums[rows] / np.maximum(self.weights[rows], 1e-12)[:, None]
+
+    def userVector(self, userId):
+        return self.vectors([self.userIndex[str(userId)]])[0]
+
+    def saveCheckpoint(self, path, sourceOffsets):
+        """保存增量状态和事件源的读取偏移，重启后从断点继续，不需要重放历史"""
+        count = len(self.userIds)
+        saveUserState(path, self.userIds, self.sums[:count], self.weights[:count], self.refTimes[:count],
+                      self.poolingMode, self.halfLifeSeconds, sourceOffsets, self.watermark)
+
+    def loadCheckpoint(self, path):
+        """恢复状态 (检查点或 generateUserEmb 写出的批量状态)，返回事件源的读取偏移"""
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            if meta['poolingMode'] != self.poolingMode:
+                raise ValueError("state %s was written with poolingMode=%r, not %r"
+                                 % (path, meta['poolingMode'], self.poolingMode))
+            if self.poolingMode == 'timeDecay' and meta['halfLifeSeconds'] != self.halfLifeSeconds:
+                raise ValueError("state %s was written with a half-life of %ss, not %ss"
+                                 % (path, meta['halfLifeSeconds'], self.halfLifeSeconds))
+            self.userIds = data['userIds'].tolist()
+            self.userIndex = {userId: row for row, userId in enumerate(self.userIds)}
+            self.sums = data['sums'].copy()
+            self.weights = data['weights'].copy()
+            self.refTimes = data['refTimes'].copy()
+            self.watermark = meta.get('watermark')
+        return meta['offsets']
+
+
+class UserEmbSink(object):
+    """
+    把更新过的用户写入 Embedding 库，在整个运行期间只打开一次
+
+    参数:
+        embOutputPath: 与 generateUserEmb 相同的输出路径，如 .../userEmb.csv
+        exportFormat: 'binary' 更新二进制库 (EmbeddingStoreWriter，索引常驻内存，按行覆盖 / 追加)；
+                      'text' 把更新过的行追加到文本文件 (TextEmbeddingAppender，同一用户以最后一行为准)；
+                      'both' 两者都做
+
+    每次 write 的代价只与更新的用户数有关，与用户总数无关
+    """
+
+    def __init__(self, embOutputPath, exportFormat='binary'):
+        if exportFormat not in ('text', 'binary', 'both'):
+            raise ValueError("exportFormat must be 'text', 'binary' or 'both', got %r" % exportFormat)
+        outputDir = os.path.dirname(os.path.abspath(embOutputPath))
+        if not os.path.exists(outputDir):
+            os.makedirs(outputDir)
+        self.storeWriter = EmbeddingStoreWriter(os.path.splitext(embOutputPath)[0]) \
+            if exportFormat in ('binary', 'both') else None
+        self.textAppender = TextEmbeddingAppender(embOutputPath) if exportFormat in ('text', 'both') else None
+
+    def write(self, updater, rows):
+        if not rows:
+            return
+        rows = sorted(rows)
+        userIds = [updater.userIds[row] for row in rows]
+        # 与 generateUserEmb 一样以 float32 输出，文本中的字符串与批量结果格式相同
+        vectors = updater.vectors(rows).astype(np.float32)
+        if self.storeWriter is not None:
+            self.storeWriter.upsert(userIds, vectors)
+        if self.textAppender is not None:
+            self.textAppender.append(userIds, vectors)
+
+
+def runUserEmbUpdater(ratingLogPath, itemEmbPath, embOutputPath, checkpointPath=None, poolingMode='sum',
+                      decayHalfLifeDays=30.0, exportFormat='binary', pollInterval=1.0, maxPolls=None,
+                      batchStatePath=None, checkpointInterval=60.0):
+    """
+    持续消费评分日志并更新用户 Embedding
+
+    启动时的状态 (按优先级):
+        1. checkpointPath 存在: 从断点恢复
+        2. 批量状态 batchStatePath (默认 userStatePath(embOutputPath)，由 generateUserEmb(saveUserState=True)
+           写出) 存在: 以批量计算的全量历史为起点，只消费晚于其 watermark 的事件
+        3. 都不存在: 从空状态开始，要求输出库也不存在 (即日志从头包含全部历史)；
+           否则第一条新评分就会用只含一条事件的向量覆盖该用户的全量历史向量，因此直接报错
+
+    参数:
+        ratingLogPath: 评分日志文件或目录
+        itemEmbPath: 物品 Embedding 文件 (item2vecEmb.csv 或 .emb)
+        embOutputPath: 用户 Embedding 输出路径 (与 generateUserEmb 相同)
+        checkpointPath: 检查点文件 (.npz)
+        pollInterval: 两次 poll 之间的间隔 (秒)，决定了新行为生效的延迟
+        maxPolls: poll 次数上限，None 表示一直运行
+        batchStatePath: 批量状态文件，见上
+        checkpointInterval: 两次写检查点的最小间隔 (秒)。检查点要写出全部用户的状态，不在每次 poll 时写；
+                            崩溃后从上一个检查点重放日志，重新算出的向量与崩溃前写出的相同
+
+    返回:
+        UserEmbUpdater
+    """
+    itemIds, itemVectors = loadEmbeddingMatrix(itemEmbPath)
+    updater = UserEmbUpdater(itemIds, itemVectors, poolingMode, decayHalfLifeDays)
+    batchStatePath = batchStatePath or userStatePath(embOutputPath)
+    offsets = None
+    if checkpointPath and os.path.exists(checkpointPath):
+        offsets = updater.loadCheckpoint(checkpointPath)
+    elif os.path.exists(batchStatePath):
+        offsets = updater.loadCheckpoint(batchStatePath)
+        print("seeded %d users from %s, watermark %s" % (len(updater.userIds), batchStatePath, updater.watermark))
+    elif os.path.exists(embOutputPath) or os.path.exists(os.path.splitext(embOutputPath)[0] + EMB_SUFFIX):
+        raise ValueError("%s already holds user embeddings but neither a checkpoint nor the batch state %s exists; "
+                         "rerun generateUserEmb with saveUserState=True, or remove the output to rebuild it "
+                         "from the full rating log" % (embOutputPath, batchStatePath))
+    source = RatingLogSource(ratingLogPath, offsets)
+    sink = UserEmbSink(embOutputPath, exportFormat)
+
+    polls = 0
+    lastCheckpoint = time.time()
+    pendingCheckpoint = False
+    while maxPolls is None or polls < maxPolls:
+        startTime = time.time()
+        events = source.poll()
+        if events:
+            updated = updater.applyEvents(events)
+            sink.write(updater, updated)
+            pendingCheckpoint = True
+            print("applied %d events, updated %d users in %.3fs"
+                  % (len(events), len(updated), time.time() - startTime))
+        polls += 1
+        lastPoll = maxPolls is not None and polls >= maxPolls
+        if checkpointPath and pendingCheckpoint and (lastPoll or time.time() - lastCheckpoint >= checkpointInterval):
+            updater.saveCheckpoint(checkpointPath, source.offsets)
+            lastCheckpoint = time.time()
+            pendingCheckpoint = False
+        if not lastPoll:
+            time.sleep(pollInterval)
+    return updater
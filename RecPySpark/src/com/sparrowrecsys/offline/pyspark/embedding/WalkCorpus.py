@@ -0,0 +1,159 @@
+"""
+=====================================================================================
+WalkCorpus.py - 流式随机游走语料的写入与惰性读取
+
+randomWalk 会把全部游走先放进一个 Python 列表，sampleCount 的上限就是 Driver 的内存
+本模块改为"边生成边写盘":
+- iterWalkBatches 是一个生成器，每次只生成一批游走
+- writeWalkCorpus 把每批游走追加到分片 (shard) 文件中，两种格式任意时刻内存中都只有一批数据
+- readWalkCorpus 返回一个惰性的 RDD，trainItem2vec 训练时才由 Executor 逐个分片读取
+
+两种分片格式:
+    'text' : walks-00000.txt.gz，每行一条游走，电影ID以空格分隔 (gzip 压缩)
+             与 processItemSequence 产出的序列格式一致，Spark 可以直接读取
+    'int32': walks-00000.npz，保存节点编号矩阵 paths 和每条游走的长度 lengths (压缩)
+             节点编号到电影ID的映射只在 itemIds.txt 中保存一次，体积比文本小得多
+
+目录结构:
+    corpusDir/
+        manifest.json        格式、分片列表、游走条数等元信息
+        itemIds.txt          (仅 int32 格式) 节点编号 -> 电影ID，每行一个
+        walks-00000.txt.gz / walks-00000.npz
+        walks-00001.txt.gz / walks-00001.npz
+        ...
+=====================================================================================
+"""
+
+import gzip
+import json
+import os
+import zipfile
+
+import numpy as np
+
+MANIFEST_FILE = 'manifest.json'
+ITEM_IDS_FILE = 'itemIds.txt'
+
+
+def iterWalkBatches(engine, sampleCount, sampleLength, batchSize=100000):
+    """
+    生成器: 分批生成游走，每次产出一批 (paths, lengths)
+
+    参数:
+        engine: RandomWalk.AliasWalkEngine
+        sampleCount: 游走总条数
+        sampleLength: 每条游走的最大长度
+        batchSize: 每批的游走条数，决定了峰值内存
+    """
+    remaining = sampleCount
+    while remaining > 0:
+        count = min(batchSize, remaining)
+        yield engine.walkIndices(count, sampleLength)
+        remaining -= count
+
+
+def writeInt32Shard(shardPath, batches, shardCount, sampleLength):
+    """
+    把一个分片的游走逐批写入 .npz，内存中只保留当前这一批
+
+    np.savez_compressed 需要先拿到整个数组；这里直接在 zip 中流式写出 paths.npy:
+    先写 .npy 头 (形状已知为 shardCount x sampleLength)，再逐批追加数据。
+    lengths 每条游走只占 4 字节，收集完后最后写入。产出的文件与 savez_compressed 相同，可以直接 np.load
+    """
+    lengths = []
+    with zipfile.ZipFile(shardPath, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        with zf.open('paths.npy', 'w', force_zip64=True) as f:
+            np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(np.dtype(np.int32)),
+                                                     'fortran_order': False,
+                                                     'shape': (shardCount, sampleLength)})
+            for paths, batchLengths in batches:
+                f.write(np.ascontiguousarray(paths, dtype=np.int32).tobytes())
+                lengths.append(np.asarray(batchLengths, dtype=np.int32))
+        with zf.open('lengths.npy', 'w', force_zip64=True) as f:
+            np.lib.format.write_array(f, np.concatenate(lengths))
+
+
+def writeWalkCorpus(engine, corpusDir, sampleCount, sampleLength, corpusFormat='text',
+                    walksPerShard=1000000, batchSize=100000):
+    """
+    把随机游走流式写入分片的压缩文件
+
+    参数:
+        engine: RandomWalk.AliasWalkEngine
+        corpusDir: 输出目录 (本地文件系统路径)
+        sampleCount: 游走总条数，可以远大于 Driver 内存能容纳的数量
+        sampleLength: 每条游走的最大长度
+        corpusFormat: 'text' 或 'int32'
+        walksPerShard: 每个分片文件包含的游走条数
+        batchSize: 每批生成的游走条数
+
+    返回:
+        manifest 字典 (同时写入 corpusDir/manifest.json)
+    """
+    if corpusFormat not in ('text', 'int32'):
+        raise ValueError("corpusFormat must be 'text' or 'int32', got %r" % corpusFormat)
+    if not os.path.exists(corpusDir):
+        os.makedirs(corpusDir)
+
+    shards = []
+    for shardIndex, shardStart in enumerate(range(0, sampleCount, walksPerShard)):
+        shardCount = min(walksPerShard, sampleCount - shardStart)
+        if corpusFormat == 'text':
+            shardName = 'walks-%05d.txt.gz' % shardIndex
+            with gzip.open(os.path.join(corpusDir, shardName), 'wt') as f:
+                for paths, lengths in iterWalkBatches(engine, shardCount, sampleLength, batchSize):
+                    for w in range(len(lengths)):
+                        f.write(" ".join(engine.itemIds[paths[w, :lengths[w]]]) + "\n")
+        else:
+            shardName = 'walks-%05d.npz' % shardIndex
+            writeInt32Shard(os.path.join(corpusDir, shardName),
+                            iterWalkBatches(engine, shardCount, sampleLength, batchSize), shardCount, sampleLength)
+        shards.append(shardName)
+
+    if corpusFormat == 'int32':
+        with open(os.path.join(corpusDir, ITEM_IDS_FILE), 'w') as f:
+            for itemId in engine.itemIds:
+                f.write(str(itemId) + "\n")
+
+    manifest = {
+        'format': corpusFormat,
+        'sampleCount': sampleCount,
+        'sampleLength': sampleLength,
+        'shards': shards,
+    }
+    with open(os.path.join(corpusDir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def readWalkCorpus(spark, corpusDir):
+    """
+    把 writeWalkCorpus 写出的语料读取为惰性 RDD
+
+    RDD 在 Action (如 Word2Vec.fit) 触发时才由 Executor 逐个分片读取，
+    Driver 只读取 manifest。多机运行时 corpusDir 需位于所有节点可访问的共享存储上
+
+    返回:
+        RDD，每个元素是一条游走 (电影ID列表)，可以直接交给 trainItem2vec
+    """
+    corpusDir = os.path.abspath(corpusDir)
+    with open(os.path.join(corpusDir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    sc = spark.sparkContext
+
+    if manifest['format'] == 'text':
+        shardPaths = ",".join('file://' + os.path.join(corpusDir, shard) for shard in manifest['shards'])
+        return sc.textFile(shardPaths).map(lambda line: line.split(' '))
+
+    with open(os.path.join(corpusDir, ITEM_IDS_FILE)) as f:
+        itemIds = sc.broadcast(np.array([line.rstrip("\n") for line in f], dtype=object))
+
+    def decodeShard(shardPath):
+        ids = itemIds.value
+        with np.load(shardPath) as data:
+            paths, lengths = data['paths'], data['lengths']
+            for w in range(len(lengths)):
+                yield list(ids[paths[w, :lengths[w]]])
+
+    shardPaths = [os.path.join(corpusDir, shard) for shard in manifest['shards']]
+    return sc.parallelize(shardPaths, max(1, len(shardPaths))).flatMap(decodeShard)
@@ -3,10 +3,37 @@ from pyspark.sql import SparkSession
 import pyspark.sql as sql
 from pyspark.sql.functions import *
 from pyspark.sql.types import *
-from collections import defaultdict
+from collections import defaultdict, deque
+import json
+import os
+import sys
+from decimal import Decimal, ROUND_HALF_EVEN
+import re
+import time
 from pyspark.sql import functions as F
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'util'))
+from MovieLensLoader import loadMovies, loadRatings
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'embedding'))
+from RedisPublisher import RedisPublisher
+
 NUMBER_PRECISION = 2
+# shuffles addUserFeatures may add to its input plan
+USER_FEATURE_SHUFFLES = 1
+# sharded sample output
+DEFAULT_SAMPLE_SHARDS = 16
+FEATURE_SPEC_FILE = 'featureSpec.json'
+# set to 1 to publish the online features (mf:<movieId> / uf:<userId> hashes) to redis at localhost:6379
+SAVE_TO_REDIS_ENV = 'SPARROW_SAVE_TO_REDIS'
+MOVIE_FEATURE_PREFIX = 'mf'
+USER_FEATURE_PREFIX = 'uf'
+MOVIE_REDIS_FEATURES = ['releaseYear', 'movieGenre1', 'movieGenre2', 'movieGenre3', 'movieRatingCount',
+                        'movieAvgRating', 'movieRatingStddev']
+USER_REDIS_FEATURES = ['userRatedMovie1', 'userRatedMovie2', 'userRatedMovie3', 'userRatedMovie4', 'userRatedMovie5',
+                       'userRatingCount', 'userAvgReleaseYear', 'userReleaseYearStddev', 'userAvgRating',
+                       'userRatingStddev', 'userGenre1', 'userGenre2', 'userGenre3', 'userGenre4', 'userGenre5']
+FORMATTED_NUMBER_COLUMNS = ('movieAvgRating', 'movieRatingStddev', 'userAvgRating', 'userRatingStddev',
+                            'userReleaseYearStddev')
 
 
 def addSampleLabel(ratingSamples):
@@ -28,28 +55,48 @@ def extractReleaseYearUdf(title):
     return int(yearStr)
 
 
-def addMovieFeatures(movieSamples, ratingSamplesWithLabel):
-    # add movie basic features
-    samplesWithMovies1 = ratingSamplesWithLabel.join(movieSamples, on=['movieId'], how='left')
-    # add releaseYear,title
-    samplesWithMovies2 = samplesWithMovies1.withColumn('releaseYear',
-                                                       udf(extractReleaseYearUdf, IntegerType())('title')) \
-        .withColumn('title', udf(lambda x: x.strip()[:-6].strip(), StringType())('title')) \
-        .drop('title')
-    # split genres
-    samplesWithMovies3 = samplesWithMovies2.withColumn('movieGenre1', split(F.col('genres'), "\\|")[0]) \
-        .withColumn('movieGenre2', split(F.col('genres'), "\\|")[1]) \
-        .withColumn('movieGenre3', split(F.col('genres'), "\\|")[2])
-    # add rating features
-    movieRatingFeatures = samplesWithMovies3.groupBy('movieId').agg(F.count(F.lit(1)).alias('movieRatingCount'),
-                                                                    format_number(F.avg(F.col('rating')),
-                                                                                  NUMBER_PRECISION).alias(
-                                                                        'movieAvgRating'),
-                                                                    F.stddev(F.col('rating')).alias(
-                                                                        'movieRatingStddev')).fillna(0) \
+def extractReleaseYear(titleCol):
+    # native equivalent of extractReleaseYearUdf: "Toy Story (1995)" -> 1995
+    trimmed = F.trim(titleCol)
+    return when(titleCol.isNull() | (F.length(trimmed) < 6), F.lit(1990)) \
+        .otherwise(F.substring(trimmed, -5, 4).cast(IntegerType()))
+
+
+def movieFeatureTable(movieSamples, ratingSamplesWithLabel):
+    # one row per rated movie: rating stats from the narrow (movieId, rating) columns plus parsed metadata.
+    # both inputs of the join are movie-sized, so the wide samples table is never shuffled for it
+    movieRatingFeatures = ratingSamplesWithLabel.groupBy('movieId').agg(
+        F.count(F.lit(1)).alias('movieRatingCount'),
+        format_number(F.avg(F.col('rating')), NUMBER_PRECISION).alias('movieAvgRating'),
+        F.stddev(F.col('rating')).alias('movieRatingStddev')).fillna(0) \
         .withColumn('movieRatingStddev', format_number(F.col('movieRatingStddev'), NUMBER_PRECISION))
-    # join movie rating features
-    samplesWithMovies4 = samplesWithMovies3.join(movieRatingFeatures, on=['movieId'], how='left')
+    movieColumns = [c for c in movieSamples.columns if c not in ('movieId', 'title')]
+    # releaseYear / genres are parsed after the join so unknown movies get the same defaults as before
+    return movieRatingFeatures.join(F.broadcast(movieSamples), on=['movieId'], how='left') \
+        .select('movieId', *movieColumns,
+                extractReleaseYear(F.col('title')).alias('releaseYear'),
+                split(F.col('genres'), "\\|")[0].alias('movieGenre1'),
+                split(F.col('genres'), "\\|")[1].alias('movieGenre2'),
+                split(F.col('genres'), "\\|")[2].alias('movieGenre3'),
+                'movieRatingCount', 'movieAvgRating', 'movieRatingStddev')
+
+
+def checkBroadcastEnrichment(samples, ratingSamplesWithLabel):
+    # the samples may only be joined by broadcast, and every shuffle must belong to the movie table:
+    # outside the broadcast side, the enriched plan has exactly the shuffles of its input
+    plan = samples._jdf.queryExecution().executedPlan().toString()
+    if 'SortMergeJoin' in plan or 'ShuffledHashJoin' in plan:
+        raise RuntimeError('addMovieFeatures joins the samples with a shuffle join:\n' + plan)
+    bigSideShuffles = countShuffles(samples, skipBroadcastSides=True) - countShuffles(ratingSamplesWithLabel)
+    if bigSideShuffles != 0:
+        raise RuntimeError('addMovieFeatures shuffles the samples %d times:\n%s' % (bigSideShuffles, plan))
+
+
+def addMovieFeatures(movieSamples, ratingSamplesWithLabel):
+    # add movie basic features, release year, genres and rating features with a single broadcast join
+    movieFeatures = movieFeatureTable(movieSamples, ratingSamplesWithLabel)
+    samplesWithMovies4 = ratingSamplesWithLabel.join(F.broadcast(movieFeatures), on=['movieId'], how='left')
+    checkBroadcastEnrichment(samplesWithMovies4, ratingSamplesWithLabel)
     samplesWithMovies4.printSchema()
     samplesWithMovies4.show(5, truncate=False)
     return samplesWithMovies4
@@ -71,8 +118,21 @@ def extractGenres(genres_list):
     return [x[0] for x in sortedGenres]
 
 
-def addUserFeatures(samplesWithMovieFeatures):
-    extractGenresUdf = udf(extractGenres, ArrayType(StringType()))
+def extractGenresNative(genresListCol):
+    '''
+    native equivalent of extractGenres built from higher-order functions.
+    genres are ordered by count desc, ties keep first-appearance order like python's stable sort
+    '''
+    allGenres = F.flatten(F.transform(genresListCol, lambda genres: split(genres, "\\|")))
+    genreStats = F.transform(F.array_distinct(allGenres), lambda genre, pos: F.struct(
+        (-F.size(F.filter(allGenres, lambda g: g == genre))).alias('negCount'),
+        pos.alias('pos'),
+        genre.alias('genre')))
+    return F.transform(F.array_sort(genreStats), lambda stat: stat['genre'])
+
+
+def userFeaturesPerColumnWindows(samplesWithMovieFeatures):
+    # previous implementation, one window expression per feature; kept as the benchmark reference
     samplesWithUserFeatures = samplesWithMovieFeatures \
         .withColumn('userPositiveHistory',
                     F.collect_list(when(F.col('label') == 1, F.col('movieId')).otherwise(F.lit(None))).over(
@@ -94,7 +154,7 @@ def addUserFeatures(samplesWithMovieFeatures):
         NUMBER_PRECISION)) \
         .withColumn("userRatingStddev", F.stddev(F.col("rating")).over(
         sql.Window.partitionBy('userId').orderBy('timestamp').rowsBetween(-100, -1))) \
-        .withColumn("userGenres", extractGenresUdf(
+        .withColumn("userGenres", extractGenresNative(
         F.collect_list(when(F.col('label') == 1, F.col('genres')).otherwise(F.lit(None))).over(
             sql.Window.partitionBy('userId').orderBy('timestamp').rowsBetween(-100, -1)))) \
         .withColumn("userRatingStddev", format_number(F.col("userRatingStddev"), NUMBER_PRECISION)) \
@@ -106,6 +166,231 @@ def addUserFeatures(samplesWithMovieFeatures):
         .withColumn("userGenre5", F.col("userGenres")[4]) \
         .drop("genres", "userGenres", "userPositiveHistory") \
         .filter(F.col("userRatingCount") > 1)
+    return samplesWithUserFeatures
+
+
+def userFeatures(samplesWithMovieFeatures):
+    # every history feature shares one window spec and is computed in a single select, so the plan
+    # has one Window operator over one hash-partition + sort by (userId, timestamp)
+    userHistory = sql.Window.partitionBy('userId').orderBy('timestamp').rowsBetween(-100, -1)
+    withHistory = samplesWithMovieFeatures.select(
+        '*',
+        F.collect_list(when(F.col('label') == 1, F.col('movieId')).otherwise(F.lit(None))).over(userHistory)
+        .alias('userPositiveHistory'),
+        F.count(F.lit(1)).over(userHistory).alias('userRatingCount'),
+        F.avg(F.col('releaseYear')).over(userHistory).alias('historyAvgReleaseYear'),
+        F.stddev(F.col('releaseYear')).over(userHistory).alias('historyReleaseYearStddev'),
+        F.avg(F.col('rating')).over(userHistory).alias('historyAvgRating'),
+        F.stddev(F.col('rating')).over(userHistory).alias('historyRatingStddev'),
+        F.collect_list(when(F.col('label') == 1, F.col('genres')).otherwise(F.lit(None))).over(userHistory)
+        .alias('historyGenres')) \
+        .withColumn('userPositiveHistory', reverse(F.col('userPositiveHistory'))) \
+        .withColumn('userGenres', extractGenresNative(F.col('historyGenres')))
+    baseColumns = [c for c in samplesWithMovieFeatures.columns if c != 'genres']
+    return withHistory.select(
+        *baseColumns,
+        *[F.col('userPositiveHistory')[i].alias('userRatedMovie%d' % (i + 1)) for i in range(5)],
+        'userRatingCount',
+        F.col('historyAvgReleaseYear').cast(IntegerType()).alias('userAvgReleaseYear'),
+        format_number(F.col('historyReleaseYearStddev'), NUMBER_PRECISION).alias('userReleaseYearStddev'),
+        format_number(F.col('historyAvgRating'), NUMBER_PRECISION).alias('userAvgRating'),
+        format_number(F.col('historyRatingStddev'), NUMBER_PRECISION).alias('userRatingStddev'),
+        *[F.col('userGenres')[i].alias('userGenre%d' % (i + 1)) for i in range(5)]) \
+        .filter(F.col('userRatingCount') > 1)
+
+
+class SlidingStats:
+    # Welford mean / M2 over a sliding frame; values enter on the right and leave on the left.
+    # the mean itself comes from an exact running sum so it matches spark's avg bit for bit
+    def __init__(self):
+        self.n = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        self.total += x
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def remove(self, x):
+        if self.n <= 1:
+            self.__init__()
+            return
+        self.n -= 1
+        self.total -= x
+        delta = x - self.mean
+        self.mean -= delta / self.n
+        self.m2 = max(self.m2 - delta * (x - self.mean), 0.0)
+
+    def rebuild(self, values):
+        # bounds the rounding drift of repeated removals; called once per frame length, so amortized O(1)
+        self.__init__()
+        for x in values:
+            self.add(x)
+
+    def avg(self):
+        return self.total / self.n if self.n else None
+
+    def stddev(self):
+        # sample stddev, null below two values like spark's stddev
+        return (self.m2 / (self.n - 1)) ** 0.5 if self.n > 1 else None
+
+
+class SlidingGenreCounter:
+    # genre -> positions of its occurrences inside the frame; count desc, then first appearance,
+    # which is the order extractGenres / extractGenresNative produce
+    def __init__(self):
+        self.positions = {}
+        self.nextPosition = 0
+
+    def add(self, genres):
+        for genre in genres:
+            self.positions.setdefault(genre, deque()).append(self.nextPosition)
+            self.nextPosition += 1
+
+    def remove(self, genres):
+        for genre in genres:
+            occurrences = self.positions[genre]
+            occurrences.popleft()
+            if not occurrences:
+                del self.positions[genre]
+
+    def top(self, k):
+        ranked = sorted(self.positions.items(), key=lambda item: (-len(item[1]), item[1][0]))
+        return [genre for genre, _ in ranked[:k]]
+
+
+def formatNumber(value, precision=NUMBER_PRECISION):
+    # python side of format_number: half-even rounding of the exact double, comma grouping
+    if value is None:
+        return None
+    return '{:,.{}f}'.format(Decimal(value).quantize(Decimal(1).scaleb(-precision), rounding=ROUND_HALF_EVEN),
+                             precision)
+
+
+def walkUserHistories(rows, baseColumns, historySize=100, topK=5):
+    # rows arrive sorted by (userId, timestamp); each user's history is walked once with a ring buffer
+    # of the previous historySize rows, so every row costs O(1) instead of re-reading its whole frame
+    userId = None
+    for row in rows:
+        if row['userId'] != userId:
+            userId = row['userId']
+            frame = deque()
+            positives = deque()
+            ratingStats = SlidingStats()
+            yearStats = SlidingStats()
+            genreCounter = SlidingGenreCounter()
+            addedSinceRebuild = 0
+
+        if len(frame) > 1:
+            recentPositives = [positives[-i] if i <= len(positives) else None for i in range(1, topK + 1)]
+            topGenres = genreCounter.top(topK)
+            avgYear = yearStats.avg()
+            yield tuple(row[c] for c in baseColumns) + tuple(recentPositives) + (
+                len(frame),
+                int(avgYear) if avgYear is not None else None,
+                formatNumber(yearStats.stddev()),
+                formatNumber(ratingStats.avg()),
+                formatNumber(ratingStats.stddev()),
+            ) + tuple(topGenres + [None] * (topK - len(topGenres)))
+
+        positive = row['label'] == 1
+        entry = (float(row['rating']) if row['rating'] is not None else None, row['releaseYear'],
+                 row['movieId'] if positive else None,
+                 row['genres'].split('|') if positive and row['genres'] is not None else None)
+        if len(frame) == historySize:
+            rating, year, movieId, genres = frame.popleft()
+            if rating is not None:
+                ratingStats.remove(rating)
+            if year is not None:
+                yearStats.remove(year)
+            if movieId is not None:
+                positives.popleft()
+            if genres is not None:
+                genreCounter.remove(genres)
+        frame.append(entry)
+        rating, year, movieId, genres = entry
+        if rating is not None:
+            ratingStats.add(rating)
+        if year is not None:
+            yearStats.add(year)
+        if movieId is not None:
+            positives.append(movieId)
+        if genres is not None:
+            genreCounter.add(genres)
+        addedSinceRebuild += 1
+        if addedSinceRebuild == historySize:
+            ratingStats.rebuild(e[0] for e in frame if e[0] is not None)
+            yearStats.rebuild(e[1] for e in frame if e[1] is not None)
+            addedSinceRebuild = 0
+
+
+def userSortedSamples(samplesWithMovieFeatures):
+    # the only DataFrame stage of slidingUserFeatures: each user's rows in one partition, in time order
+    return samplesWithMovieFeatures.repartition('userId').sortWithinPartitions('userId', 'timestamp')
+
+
+def slidingUserFeatures(samplesWithMovieFeatures, historySize=100):
+    # linear-time alternative to userFeatures: one shuffle by userId, one sort, one pass per user.
+    # produces the same columns; rows with equal (userId, timestamp) may be ordered differently
+    # than in the window version, exactly as two runs of the window version may differ
+    baseColumns = [c for c in samplesWithMovieFeatures.columns if c != 'genres']
+    fields = {f.name: f for f in samplesWithMovieFeatures.schema.fields}
+    schema = StructType([fields[c] for c in baseColumns]
+                        + [StructField('userRatedMovie%d' % (i + 1), fields['movieId'].dataType) for i in range(5)]
+                        + [StructField('userRatingCount', LongType(), False),
+                           StructField('userAvgReleaseYear', IntegerType()),
+                           StructField('userReleaseYearStddev', StringType()),
+                           StructField('userAvgRating', StringType()),
+                           StructField('userRatingStddev', StringType())]
+                        + [StructField('userGenre%d' % (i + 1), StringType()) for i in range(5)])
+    rows = userSortedSamples(samplesWithMovieFeatures).rdd \
+        .mapPartitions(lambda partition: walkUserHistories(partition, baseColumns, historySize))
+    return samplesWithMovieFeatures.sparkSession.createDataFrame(rows, schema)
+
+
+def countShuffles(df, skipBroadcastSides=False):
+    # number of shuffle Exchange operators in the physical plan; planning only, nothing is executed.
+    # skipBroadcastSides leaves out the subtrees under a BroadcastExchange, i.e. the small join sides
+    plan = df._jdf.queryExecution().executedPlan().toString()
+    if '== Final Plan ==' in plan:
+        plan = plan.split('== Final Plan ==')[1].split('== Initial Plan ==')[0]
+    shuffles = 0
+    broadcastDepth = None
+    for line in plan.split('\n'):
+        node = line.lstrip(' :+-|')
+        depth = len(line) - len(node)
+        if broadcastDepth is not None and depth > broadcastDepth:
+            continue
+        broadcastDepth = None
+        if skipBroadcastSides and re.match(r'(\*\(\d+\) )?BroadcastExchange ', node):
+            broadcastDepth = depth
+        shuffles += len(re.findall(r'(?<![A-Za-z])Exchange ', node))
+    return shuffles
+
+
+def checkUserFeatureShuffles(samplesWithMovieFeatures, samplesWithUserFeatures):
+    # the user features must add exactly one shuffle (by userId) on top of their input
+    added = countShuffles(samplesWithUserFeatures) - countShuffles(samplesWithMovieFeatures)
+    if added > USER_FEATURE_SHUFFLES:
+        raise RuntimeError('addUserFeatures added %d shuffles, expected %d; check the window specs'
+                           % (added, USER_FEATURE_SHUFFLES))
+    return added
+
+
+def addUserFeatures(samplesWithMovieFeatures, engine='window'):
+    # engine: 'window' (shared window spec) or 'sliding' (single pass per user, linear in the ratings)
+    if engine == 'sliding':
+        samplesWithUserFeatures = slidingUserFeatures(samplesWithMovieFeatures)
+        # the result is created from an RDD, so its plan is just a Scan ExistingRDD with no exchanges;
+        # check the DataFrame plan that feeds the per-user pass instead
+        checkUserFeatureShuffles(samplesWithMovieFeatures, userSortedSamples(samplesWithMovieFeatures))
+    else:
+        samplesWithUserFeatures = userFeatures(samplesWithMovieFeatures)
+        checkUserFeatureShuffles(samplesWithMovieFeatures, samplesWithUserFeatures)
     samplesWithUserFeatures.printSchema()
     samplesWithUserFeatures.show(10)
     samplesWithUserFeatures.filter(samplesWithMovieFeatures['userId'] == 1).orderBy(F.col('timestamp').asc()).show(
@@ -113,18 +398,210 @@ def addUserFeatures(samplesWithMovieFeatures):
     return samplesWithUserFeatures
 
 
-def splitAndSaveTrainingTestSamples(samplesWithUserFeatures, file_path):
+def timeAction(df):
+    # noop sink evaluates every column, so unused udf columns can't be pruned away
+    startTime = time.time()
+    df.write.format('noop').mode('overwrite').save()
+    return time.time() - startTime
+
+
+def benchmarkNativeUdfs(movieSamples, ratingSamplesWithLabel):
+    # compare python udfs with their native replacements on the full ratings set
+    samples = ratingSamplesWithLabel.join(movieSamples, on=['movieId'], how='left').cache()
+    samples.count()
+    results = {}
+
+    yearUdf = samples.select('movieId', 'userId', udf(extractReleaseYearUdf, IntegerType())('title').alias('year'))
+    yearNative = samples.select('movieId', 'userId', extractReleaseYear(F.col('title')).alias('year'))
+    results['releaseYear'] = {'udfSeconds': timeAction(yearUdf), 'nativeSeconds': timeAction(yearNative),
+                              'mismatchRows': yearNative.exceptAll(yearUdf).count()}
+
+    genresWindow = sql.Window.partitionBy('userId').orderBy('timestamp').rowsBetween(-100, -1)
+    genresList = F.collect_list(when(F.col('label') == 1, F.col('genres')).otherwise(F.lit(None))).over(genresWindow)
+    genresUdf = samples.select('userId', 'timestamp', 'movieId',
+                               udf(extractGenres, ArrayType(StringType()))(genresList).alias('userGenres'))
+    genresNative = samples.select('userId', 'timestamp', 'movieId', extractGenresNative(genresList).alias('userGenres'))
+    results['userGenres'] = {'udfSeconds': timeAction(genresUdf), 'nativeSeconds': timeAction(genresNative),
+                             'mismatchRows': genresNative.exceptAll(genresUdf).count()}
+
+    for name, result in results.items():
+        result['speedup'] = result['udfSeconds'] / result['nativeSeconds']
+        print(name, result)
+    samples.unpersist()
+    return results
+
+
+def scaleUsers(samples, scaleFactor):
+    # synthetic larger dataset: copy every user's history scaleFactor times under offset userIds
+    userIdType = samples.schema['userId'].dataType
+    userIdSpan = int(samples.agg(F.max(F.col('userId').cast(LongType()))).head()[0]) + 1
+    copies = samples.sparkSession.range(scaleFactor).withColumnRenamed('id', 'copy')
+    return samples.crossJoin(copies) \
+        .withColumn('userId', (F.col('userId').cast(LongType()) + F.col('copy') * userIdSpan).cast(userIdType)) \
+        .drop('copy')
+
+
+def benchmarkUserFeatures(samplesWithMovieFeatures, scaleFactor=10, checkResults=True):
+    # shared-window userFeatures and the sliding engine vs the per-column window reference
+    # on a scaled-up ratings set
+    samples = scaleUsers(samplesWithMovieFeatures, scaleFactor).cache()
+    samples.count()
+    legacy = userFeaturesPerColumnWindows(samples)
+    engines = {'shared': userFeatures(samples), 'sliding': slidingUserFeatures(samples)}
+    result = {'scaleFactor': scaleFactor, 'rows': samples.count(),
+              'legacyShuffles': countShuffles(legacy) - countShuffles(samples),
+              'sharedShuffles': countShuffles(engines['shared']) - countShuffles(samples),
+              'slidingShuffles': countShuffles(userSortedSamples(samples)) - countShuffles(samples),
+              'legacySeconds': timeAction(legacy)}
+    for name, df in engines.items():
+        result[name + 'Seconds'] = timeAction(df)
+        result[name + 'Speedup'] = result['legacySeconds'] / result[name + 'Seconds']
+        if checkResults:
+            result[name + 'MismatchRows'] = df.exceptAll(legacy).count() + legacy.exceptAll(df).count()
+    print('addUserFeatures', result)
+    samples.unpersist()
+    return result
+
+
+def latestFeatures(samples, keyColumn, featureColumns):
+    # the features of each key's most recent sample, i.e. its state after all of its ratings
+    latest = sql.Window.partitionBy(keyColumn).orderBy(F.col('timestamp').desc())
+    return samples.withColumn('rowNum', F.row_number().over(latest)) \
+        .where(F.col('rowNum') == 1) \
+        .select(keyColumn, *featureColumns)
+
+
+def publishLatestFeatures(samples, keyColumn, featureColumns, prefix, redisClient=None):
+    # rows are streamed to the driver partition by partition and written through pipelined HSETs
+    features = latestFeatures(samples, keyColumn, featureColumns)
+    rows = ((str(row[keyColumn]), {c: row[c] for c in featureColumns}) for row in features.toLocalIterator())
+    report = RedisPublisher(redisClient).publishFeatures(prefix, rows)
+    print('published %s features to redis: %s' % (prefix, report))
+    return report
+
+
+def extractAndSaveMovieFeaturesToRedis(samples, redisClient=None):
+    # same mf:<movieId> hashes as the scala job; redisClient defaults to localhost:6379
+    return publishLatestFeatures(samples, 'movieId', MOVIE_REDIS_FEATURES, MOVIE_FEATURE_PREFIX, redisClient)
+
+
+def extractAndSaveUserFeaturesToRedis(samples, redisClient=None):
+    # same uf:<userId> hashes as the scala job; redisClient defaults to localhost:6379
+    return publishLatestFeatures(samples, 'userId', USER_REDIS_FEATURES, USER_FEATURE_PREFIX, redisClient)
+
+
+def featureSpec(samples):
+    # column name -> tf dtype and default; the default also fills nulls at write time, like na_value="0" did
+    spec = []
+    for field in samples.schema.fields:
+        if isinstance(field.dataType, (IntegerType, LongType, ShortType, ByteType)):
+            spec.append({'name': field.name, 'dtype': 'int64', 'default': 0})
+        elif isinstance(field.dataType, (DoubleType, FloatType, DecimalType)):
+            spec.append({'name': field.name, 'dtype': 'float32', 'default': 0.0})
+        else:
+            spec.append({'name': field.name, 'dtype': 'string', 'default': ''})
+    return spec
+
+
+def typedSamples(samples):
+    # format_number columns become floats again and nulls get the spec default, so shards are fully typed
+    for c in FORMATTED_NUMBER_COLUMNS:
+        if c in samples.columns:
+            samples = samples.withColumn(c, F.regexp_replace(F.col(c), ',', '').cast(FloatType()))
+    # physical types must match the spec: int columns would land as INT32 and doubles as DOUBLE in parquet
+    for field in samples.schema.fields:
+        if isinstance(field.dataType, (IntegerType, ShortType, ByteType)):
+            samples = samples.withColumn(field.name, F.col(field.name).cast(LongType()))
+        elif isinstance(field.dataType, (DoubleType, DecimalType)):
+            samples = samples.withColumn(field.name, F.col(field.name).cast(FloatType()))
+    spec = featureSpec(samples)
+    samples = samples.fillna({f['name']: f['default'] for f in spec})
+    return samples, spec
+
+
+def writeTextFile(spark, path, text):
+    # small driver-side file through the hadoop filesystem, so it lands next to the shards on any fs
+    hadoopPath = spark._jvm.org.apache.hadoop.fs.Path(path)
+    out = hadoopPath.getFileSystem(spark._jsc.hadoopConfiguration()).create(hadoopPath, True)
+    out.write(bytearray(text.encode('utf-8')))
+    out.close()
+
+
+def deletePath(spark, path):
+    hadoopPath = spark._jvm.org.apache.hadoop.fs.Path(path)
+    hadoopPath.getFileSystem(spark._jsc.hadoopConfiguration()).delete(hadoopPath, True)
+
+
+def writeTfRecordShard(index, rows, savePath, spec, compression):
+    # runs on the executors; tensorflow is only needed there, and only for the tfrecord format
+    import tensorflow as tf
+    suffix = '.tfrecord.gz' if compression == 'GZIP' else '.tfrecord'
+    shardPath = '%s/part-%05d%s' % (savePath, index, suffix)
+    count = 0
+    with tf.io.TFRecordWriter(shardPath, options=tf.io.TFRecordOptions(compression_type=compression)) as writer:
+        for row in rows:
+            feature = {}
+            for f in spec:
+                value = row[f['name']]
+                if f['dtype'] == 'int64':
+                    feature[f['name']] = tf.train.Feature(int64_list=tf.train.Int64List(value=[int(value)]))
+                elif f['dtype'] == 'float32':
+                    feature[f['name']] = tf.train.Feature(float_list=tf.train.FloatList(value=[float(value)]))
+                else:
+                    feature[f['name']] = tf.train.Feature(
+                        bytes_list=tf.train.BytesList(value=[str(value).encode('utf-8')]))
+            writer.write(tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString())
+            count += 1
+    return [count]
+
+
+def saveSamples(samples, savePath, outputFormat='csv', numShards=None, compression=None):
+    """
+    outputFormat:
+        'csv'      single uncompressed csv file through one task, the layout make_csv_dataset reads
+        'parquet'  numShards snappy (default) parquet files
+        'tfrecord' numShards gzip (default) tfrecord files of tf.train.Example
+    the sharded formats also write featureSpec.json (format, file pattern, column dtypes and defaults),
+    which TFRecModel's ShardedSamples.get_sharded_dataset reads
+    """
+    if outputFormat == 'csv':
+        samples.repartition(1).write.option("header", "true").mode('overwrite').csv(savePath)
+        return
+    if outputFormat not in ('parquet', 'tfrecord'):
+        raise ValueError("outputFormat must be 'csv', 'parquet' or 'tfrecord', got %r" % (outputFormat,))
+    spark = samples.sparkSession
+    samples, spec = typedSamples(samples)
+    samples = samples.repartition(numShards or DEFAULT_SAMPLE_SHARDS)
+    if outputFormat == 'parquet':
+        compression = compression or 'snappy'
+        samples.write.option('compression', compression).mode('overwrite').parquet(savePath)
+        filePattern = 'part-*.parquet'
+    else:
+        compression = compression or 'GZIP'
+        deletePath(spark, savePath)
+        localSavePath = savePath[len('file://'):] if savePath.startswith('file://') else savePath
+        if '://' not in localSavePath:
+            os.makedirs(localSavePath)
+        counts = samples.rdd.mapPartitionsWithIndex(
+            lambda index, rows: writeTfRecordShard(index, rows, savePath, spec, compression)).collect()
+        print('wrote %d samples to %d tfrecord shards in %s' % (sum(counts), len(counts), savePath))
+        filePattern = 'part-*.tfrecord*'
+    writeTextFile(spark, savePath + '/' + FEATURE_SPEC_FILE, json.dumps(
+        {'format': outputFormat, 'compression': compression, 'filePattern': filePattern, 'features': spec},
+        indent=2))
+
+
+def splitAndSaveTrainingTestSamples(samplesWithUserFeatures, file_path, outputFormat='csv', numShards=None):
     smallSamples = samplesWithUserFeatures.sample(0.1)
     training, test = smallSamples.randomSplit((0.8, 0.2))
     trainingSavePath = file_path + '/trainingSamples'
     testSavePath = file_path + '/testSamples'
-    training.repartition(1).write.option("header", "true").mode('overwrite') \
-        .csv(trainingSavePath)
-    test.repartition(1).write.option("header", "true").mode('overwrite') \
-        .csv(testSavePath)
+    saveSamples(training, trainingSavePath, outputFormat, numShards)
+    saveSamples(test, testSavePath, outputFormat, numShards)
 
 
-def splitAndSaveTrainingTestSamplesByTimeStamp(samplesWithUserFeatures, file_path):
+def splitAndSaveTrainingTestSamplesByTimeStamp(samplesWithUserFeatures, file_path, outputFormat='csv',
+                                               numShards=None):
     smallSamples = samplesWithUserFeatures.sample(0.1).withColumn("timestampLong", F.col("timestamp").cast(LongType()))
     quantile = smallSamples.stat.approxQuantile("timestampLong", [0.8], 0.05)
     splitTimestamp = quantile[0]
@@ -132,10 +609,8 @@ def splitAndSaveTrainingTestSamplesByTimeStamp(samplesWithUserFeatures, file_pat
     test = smallSamples.where(F.col("timestampLong") > splitTimestamp).drop("timestampLong")
     trainingSavePath = file_path + '/trainingSamples'
     testSavePath = file_path + '/testSamples'
-    training.repartition(1).write.option("header", "true").mode('overwrite') \
-        .csv(trainingSavePath)
-    test.repartition(1).write.option("header", "true").mode('overwrite') \
-        .csv(testSavePath)
+    saveSamples(training, trainingSavePath, outputFormat, numShards)
+    saveSamples(test, testSavePath, outputFormat, numShards)
 
 
 if __name__ == '__main__':
@@ -144,12 +619,17 @@ if __name__ == '__main__':
     file_path = 'file:///home/hadoop/SparrowRecSys/src/main/resources'
     movieResourcesPath = file_path + "/webroot/sampledata/movies.csv"
     ratingsResourcesPath = file_path + "/webroot/sampledata/ratings.csv"
-    movieSamples = spark.read.format('csv').option('header', 'true').load(movieResourcesPath)
-    ratingSamples = spark.read.format('csv').option('header', 'true').load(ratingsResourcesPath)
+    # typed columns, served from the parquet cache after the first run
+    movieSamples = loadMovies(spark, movieResourcesPath)
+    ratingSamples = loadRatings(spark, ratingsResourcesPath)
     ratingSamplesWithLabel = addSampleLabel(ratingSamples)
     ratingSamplesWithLabel.show(10, truncate=False)
     samplesWithMovieFeatures = addMovieFeatures(movieSamples, ratingSamplesWithLabel)
     samplesWithUserFeatures = addUserFeatures(samplesWithMovieFeatures)
     # save samples as csv format
     splitAndSaveTrainingTestSamples(samplesWithUserFeatures, file_path + "/webroot/sampledata")
+    # save user features and item features to redis for online inference
+    if os.environ.get(SAVE_TO_REDIS_ENV) == '1':
+        extractAndSaveUserFeaturesToRedis(samplesWithUserFeatures)
+        extractAndSaveMovieFeaturesToRedis(samplesWithUserFeatures)
     # splitAndSaveTrainingTestSamplesByTimeStamp(samplesWithUserFeatures, file_path + "/webroot/sampledata")
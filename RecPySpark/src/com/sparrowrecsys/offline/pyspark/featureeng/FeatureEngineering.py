@@ -22,6 +22,7 @@
 
 import os
 import sys
+import time
 
 # ==============================================================================
 # 环境配置
@@ -43,12 +44,17 @@ from pyspark.ml.feature import (
     QuantileDiscretizer,     # 分位数离散化器，用于分桶
     MinMaxScaler             # 最大最小值归一化器
 )
+from pyspark.ml.functions import array_to_vector, vector_to_array  # 数组列 <-> 向量列 (JVM 内完成，无需 UDF)
 from pyspark.ml.linalg import VectorUDT, Vectors  # 向量类型，用于机器学习
 from pyspark.sql import SparkSession              # Spark SQL 会话入口
 from pyspark.sql.functions import *               # SQL 函数（如 col, explode, split 等）
 from pyspark.sql.types import *                   # 数据类型（如 IntegerType, StringType 等）
 from pyspark.sql import functions as F            # 为 SQL 函数设置别名，避免命名冲突
 
+# 原始数据加载器 (显式 Schema + Parquet 缓存)，位于同级的 util 目录
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'util'))
+from MovieLensLoader import loadMovies, loadRatings
+
 
 # ==============================================================================
 # One-Hot 编码示例
@@ -142,6 +148,34 @@ def array2vec(genreIndexes, indexSize):
     return Vectors.sparse(indexSize, genreIndexes, fill_list)
 
 
+def multiHotVector(genreIndexesCol, indexSizeCol):
+    """
+    array2vec 的 Spark 原生实现，整个过程都在 JVM 内完成，不需要启动 Python 进程
+
+    做法:
+    1. sequence(0, indexSize - 1) 生成 [0, 1, ..., indexSize-1]
+    2. transform 对每个位置判断是否出现在 genreIndexes 中，得到 [0.0, 1.0, 0.0, ...]
+    3. array_to_vector 把 double 数组转换为 Spark ML 的向量
+
+    注意: 结果是密集向量 (DenseVector)，数值与 array2vec 的稀疏向量完全一致，但 vector 列的类型变了:
+    依赖 SparseVector 的 indices / values 属性的下游代码需要改用 toArray() 或 vector_to_array。
+    Spark 没有把数组转成稀疏向量的内置函数，保持稀疏只能回到 Python UDF；
+    类型只有十几种，密集存储的开销可以忽略，换来的是省掉 Python UDF 的序列化开销
+
+    参数:
+        genreIndexesCol: 类型索引数组列
+        indexSizeCol: 向量维度列
+
+    返回:
+        向量列 (VectorUDT)
+    """
+    multiHot = F.transform(
+        F.sequence(F.lit(0), indexSizeCol - 1),
+        lambda i: F.when(F.array_contains(genreIndexesCol, i), F.lit(1.0)).otherwise(F.lit(0.0))
+    )
+    return array_to_vector(multiHot)
+
+
 # ==============================================================================
 # Multi-Hot 编码示例
 # ==============================================================================
@@ -212,12 +246,11 @@ def multiHotEncoderExample(movieSamples):
         F.collect_list('genreIndexInt').alias('genreIndexes')
     ).withColumn("indexSize", F.lit(indexSize))  # lit() 创建常量列
     
-    # Step 5: 使用自定义函数 (UDF) 将索引列表转换为稀疏向量
-    # udf(): User Defined Function，用户自定义函数
-    # VectorUDT(): 返回值类型是向量
+    # Step 5: 将索引列表转换为 Multi-Hot 向量
+    # multiHotVector(): 用 Spark 内置函数实现 array2vec，避免 Python UDF 的序列化开销
     finalSample = processedSamples.withColumn(
         "vector",
-        udf(array2vec, VectorUDT())(F.col("genreIndexes"), F.col("indexSize"))
+        multiHotVector(F.col("genreIndexes"), F.col("indexSize"))
     )
     
     # 打印结果
@@ -264,9 +297,9 @@ def ratingFeatures(ratingSamples):
         F.variance('rating').alias('ratingVar')       # 评分方差
     ).withColumn(
         # 将平均评分转换为向量格式（MinMaxScaler 需要向量输入）
-        # Vectors.dense(x): 创建密集向量
+        # array_to_vector(array(x)): 把单个数值包成数组再转为密集向量，等价于 Vectors.dense(x)
         'avgRatingVec', 
-        udf(lambda x: Vectors.dense(x), VectorUDT())('avgRating')
+        array_to_vector(F.array(F.col('avgRating')))
     )
     
     movieFeatures.show(10)
@@ -326,6 +359,60 @@ def ratingFeatures(ratingSamples):
     movieProcessedFeatures.show(10)
 
 
+# ==============================================================================
+# UDF 与原生实现的对比
+# ==============================================================================
+def benchmarkNativeVectors(movieSamples, ratingSamples):
+    """
+    对比 Python UDF 与原生实现的结果和耗时:
+    - array2vec                     vs multiHotVector
+    - udf(lambda x: Vectors.dense(x)) vs array_to_vector(array(x))
+
+    比较结果时先用 vector_to_array 把向量转回数组，
+    这样稀疏向量和密集向量只要数值相同就视为一致
+
+    返回:
+        字典，每种转换的 UDF 耗时、原生耗时、加速比和不一致的行数
+    """
+    def timeAction(df):
+        # noop 输出会计算所有列，避免优化器把没有用到的 UDF 列裁剪掉
+        startTime = time.time()
+        df.write.format('noop').mode('overwrite').save()
+        return time.time() - startTime
+
+    samplesWithGenre = movieSamples.select("movieId", "title", explode(
+        split(F.col("genres"), "\\|").cast(ArrayType(StringType()))).alias('genre'))
+    genreIndexSamples = StringIndexer(inputCol="genre", outputCol="genreIndex").fit(samplesWithGenre) \
+        .transform(samplesWithGenre).withColumn("genreIndexInt", F.col("genreIndex").cast(IntegerType()))
+    indexSize = genreIndexSamples.agg(max(F.col("genreIndexInt"))).head()[0] + 1
+    genreSamples = genreIndexSamples.groupBy('movieId').agg(
+        F.collect_list('genreIndexInt').alias('genreIndexes')).withColumn("indexSize", F.lit(indexSize)).cache()
+    ratingStats = ratingSamples.groupBy('movieId').agg(F.avg("rating").alias("avgRating")).cache()
+    genreSamples.count()
+    ratingStats.count()
+
+    cases = {
+        'multiHot': (genreSamples,
+                     udf(array2vec, VectorUDT())(F.col("genreIndexes"), F.col("indexSize")),
+                     multiHotVector(F.col("genreIndexes"), F.col("indexSize"))),
+        'avgRatingVec': (ratingStats,
+                         udf(lambda x: Vectors.dense(x), VectorUDT())('avgRating'),
+                         array_to_vector(F.array(F.col('avgRating')))),
+    }
+    results = {}
+    for name, (df, udfCol, nativeCol) in cases.items():
+        udfDf = df.select('movieId', vector_to_array(udfCol).alias('vector'))
+        nativeDf = df.select('movieId', vector_to_array(nativeCol).alias('vector'))
+        udfSeconds, nativeSeconds = timeAction(udfDf), timeAction(nativeDf)
+        results[name] = {'udfSeconds': udfSeconds, 'nativeSeconds': nativeSeconds,
+                         'speedup': udfSeconds / nativeSeconds,
+                         'mismatchRows': nativeDf.exceptAll(udfDf).count() + udfDf.exceptAll(nativeDf).count()}
+        print(name, results[name])
+    genreSamples.unpersist()
+    ratingStats.unpersist()
+    return results
+
+
 # ==============================================================================
 # 主程序入口
 # ==============================================================================
@@ -364,11 +451,10 @@ if __name__ == '__main__':
     file_path = 'file:///Users/spike/Projects/SparrowRecSys/src/main/resources'
     movieResourcesPath = file_path + "/webroot/sampledata/movies.csv"
     
-    # 使用 Spark 读取 CSV 文件
-    # format('csv'): 指定文件格式
-    # option('header', 'true'): 第一行是表头
-    # load(): 加载数据，返回 DataFrame
-    movieSamples = spark.read.format('csv').option('header', 'true').load(movieResourcesPath)
+    # 使用共享的加载器读取 CSV 文件
+    # - 按显式 Schema 读取: movieId 为 int，title / genres 为 string，不再全部是字符串
+    # - 第一次读取时转换为 Parquet 缓存 (按文件内容哈希命名)，之后的运行直接读缓存，跳过 CSV 解析
+    movieSamples = loadMovies(spark, movieResourcesPath)
     
     # 查看原始数据
     print("Raw Movie Samples:")
@@ -393,5 +479,5 @@ if __name__ == '__main__':
     # 演示分桶和归一化
     print("Numerical features Example:")
     ratingsResourcesPath = file_path + "/webroot/sampledata/ratings.csv"
-    ratingSamples = spark.read.format('csv').option('header', 'true').load(ratingsResourcesPath)
+    ratingSamples = loadRatings(spark, ratingsResourcesPath)
     ratingFeatures(ratingSamples)
@@ -1,3 +1,6 @@
+import os
+import sys
+
 from pyspark import SparkConf
 from pyspark.ml.evaluation import RegressionEvaluator
 from pyspark.ml.recommendation import ALS
@@ -6,15 +9,19 @@ from pyspark.sql import SparkSession
 from pyspark.sql.types import *
 from pyspark.sql import functions as F
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'util'))
+from MovieLensLoader import loadRatings
+
 if __name__ == '__main__':
     conf = SparkConf().setAppName('collaborativeFiltering').setMaster('local')
     spark = SparkSession.builder.config(conf=conf).getOrCreate()
     #/Users/zhewang/Workspace/SparrowRecSys/src/main/resources/webroot/modeldata
     file_path = 'file:///Users/zhewang/Workspace/SparrowRecSys/src/main/resources'
     ratingResourcesPath = file_path + '/webroot/sampledata/ratings.csv'
-    ratingSamples = spark.read.format('csv').option('header', 'true').load(ratingResourcesPath) \
-        .withColumn("userIdInt", F.col("userId").cast(IntegerType())) \
-        .withColumn("movieIdInt", F.col("movieId").cast(IntegerType())) \
+    # userId / movieId are already ints in the loader schema
+    ratingSamples = loadRatings(spark, ratingResourcesPath) \
+        .withColumn("userIdInt", F.col("userId")) \
+        .withColumn("movieIdInt", F.col("movieId")) \
         .withColumn("ratingFloat", F.col("rating").cast(FloatType()))
     training, test = ratingSamples.randomSplit((0.8, 0.2))
     # Build the recommendation model using ALS on the training data
@@ -0,0 +1,161 @@
+"""
+=====================================================================================
+MovieLensLoader.py - MovieLens 原始数据的统一加载: 显式 Schema + Parquet 列存缓存
+
+各个入口 (Embedding.py、FeatureEngForRecModel.py、FeatureEngineering.py、CollaborativeFiltering.py)
+原来都用 spark.read.format('csv').option('header', 'true') 读取 ratings.csv / movies.csv:
+    - 所有列都是字符串，各处再临时转换: rating >= 3.5 按字符串比较、cast(IntegerType())、
+      timestamp 转 long 等，容易写错，比如按字符串排序的时间戳
+    - 每次运行都要重新解析 CSV，数据量大时解析本身就是主要耗时
+
+本模块:
+1. 显式 Schema: userId / movieId 为 int，rating 为 double，timestamp 为 long (秒)；
+   读取时校验表头 (enforceSchema=false)，格式错误的行直接报错 (FAILFAST)，而不是变成 null
+   注意 ID 现在是 int: Embedding 文件、Redis key、TransitionGraph 节点、Word2Vec 词表都以字符串ID为键，
+   这些边界处需要显式转换 (F.col('movieId').cast('string') 或 str(id))
+2. Parquet 缓存: 第一次读取时把 CSV 转成 Parquet，缓存目录名包含 CSV 内容的 SHA-256，
+   之后的运行直接读 Parquet，完全跳过 CSV 解析；CSV 内容或 Schema 变化时哈希随之变化，自动重建
+3. 缓存写到临时目录后再整体改名，中途失败不会留下半个缓存
+
+缓存位置:
+    默认为 CSV 所在目录下的 _parquetCache/ (Spark 读取目录时会忽略 _ 开头的文件)，
+    可以用环境变量 SPARROW_PARQUET_CACHE 或 cacheDir 参数指定其他目录；
+    只有本地文件 (无前缀或 file://) 会被缓存，HDFS / S3 等路径直接按 Schema 读取 CSV
+
+用法 (其他目录的模块需要先把本目录加入 sys.path):
+    from MovieLensLoader import loadMovies, loadRatings
+    ratingSamples = loadRatings(spark, file_path + '/webroot/sampledata/ratings.csv')
+=====================================================================================
+"""
+
+import hashlib
+import os
+import shutil
+import uuid
+
+from pyspark.sql.types import DoubleType, IntegerType, LongType, StringType, StructField, StructType
+
+RATINGS_SCHEMA = StructType([
+    StructField('userId', IntegerType()),
+    StructField('movieId', IntegerType()),
+    StructField('rating', DoubleType()),
+    StructField('timestamp', LongType()),
+])
+
+MOVIES_SCHEMA = StructType([
+    StructField('movieId', IntegerType()),
+    StructField('title', StringType()),
+    StructField('genres', StringType()),
+])
+
+LINKS_SCHEMA = StructType([
+    StructField('movieId', IntegerType()),
+    StructField('imdbId', StringType()),
+    StructField('tmdbId', IntegerType()),
+])
+
+CACHE_DIR_ENV = 'SPARROW_PARQUET_CACHE'
+CACHE_DIR_NAME = '_parquetCache'
+HASH_CHUNK_BYTES = 1 << 20
+
+
+def localPath(path):
+    """本地文件返回去掉 file:// 前缀的路径，其他文件系统 (hdfs:// 等) 返回 None"""
+    if path.startswith('file://'):
+        return path[len('file://'):]
+    if '://' in path:
+        return None
+    return path
+
+
+def dataFiles(path):
+    """CSV 文件本身，或者目录下的所有数据文件 (Spark 输出的 part-* 等，忽略 _ 和 . 开头的文件)"""
+    if not os.path.isdir(path):
+        return [path]
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(('_', '.')))
+        files.extend(os.path.join(root, name) for name in sorted(names) if not name.startswith(('_', '.')))
+    return files
+
+
+def fileHash(path, schema):
+    """
+    计算缓存 key: 所有数据文件内容和 Schema 的 SHA-256
+
+    参数:
+        path: 本地 CSV 文件或目录
+        schema: 读取使用的 StructType，Schema 变化时缓存同样失效
+    """
+    digest = hashlib.sha256(schema.json().encode('utf-8'))
+    for filePath in dataFiles(path):
+        digest.update(os.path.relpath(filePath, path).encode('utf-8'))
+        with open(filePath, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def readTypedCsv(spark, path, schema):
+    """按显式 Schema 读取 CSV，校验表头并在遇到格式错误的行时失败"""
+    return spark.read.format('csv') \
+        .option('header', 'true') \
+        .option('enforceSchema', 'false') \
+        .option('mode', 'FAILFAST') \
+        .schema(schema) \
+        .load(path)
+
+
+def loadCsvCached(spark, path, schema, cacheDir=None, numPartitions=None):
+    """
+    读取 CSV，优先使用对应的 Parquet 缓存
+
+    参数:
+        path: CSV 文件或目录，可以带 file:// 前缀
+        schema: 列的 Schema (RATINGS_SCHEMA / MOVIES_SCHEMA / LINKS_SCHEMA)
+        cacheDir: 缓存根目录，默认见模块说明
+        numPartitions: 写缓存时的分区 (part 文件) 数，默认沿用读取 CSV 时的分区
+
+    返回:
+        DataFrame，列类型与 schema 一致
+    """
+    local = localPath(path)
+    if local is None or not os.path.exists(local):
+        return readTypedCsv(spark, path, schema)
+
+    cacheRoot = cacheDir or os.environ.get(CACHE_DIR_ENV) or \
+        os.path.join(os.path.dirname(os.path.abspath(local.rstrip('/'))), CACHE_DIR_NAME)
+    name = os.path.splitext(os.path.basename(local.rstrip('/')))[0]
+    cachePath = os.path.join(cacheRoot, '%s-%s' % (name, fileHash(local, schema)[:16]))
+
+    if not os.path.exists(os.path.join(cachePath, '_SUCCESS')):
+        tmpPath = '%s.tmp-%s' % (cachePath, uuid.uuid4().hex[:8])
+        samples = readTypedCsv(spark, path, schema)
+        if numPartitions:
+            samples = samples.repartition(numPartitions)
+        samples.write.mode('overwrite').parquet('file://' + os.path.abspath(tmpPath))
+        if os.path.exists(cachePath):
+            # 上次写入没有完成 (缺少 _SUCCESS)
+            shutil.rmtree(cachePath, ignore_errors=True)
+        try:
+            os.replace(tmpPath, cachePath)
+        except OSError:
+            # 另一个进程已经写好了同一份缓存
+            shutil.rmtree(tmpPath, ignore_errors=True)
+        print("cached %s as parquet in %s" % (path, cachePath))
+    return spark.read.schema(schema).parquet('file://' + os.path.abspath(cachePath))
+
+
+def loadRatings(spark, path, cacheDir=None, numPartitions=None):
+    """读取 ratings.csv (userId int, movieId int, rating double, timestamp long)"""
+    return loadCsvCached(spark, path, RATINGS_SCHEMA, cacheDir, numPartitions)
+
+
+def loadMovies(spark, path, cacheDir=None, numPartitions=None):
+    """读取 movies.csv (movieId int, title string, genres string)"""
+    return loadCsvCached(spark, path, MOVIES_SCHEMA, cacheDir, numPartitions)
+
+
+def loadLinks(spark, path, cacheDir=None, numPartitions=None):
+    """读取 links.csv (movieId int, imdbId string, tmdbId int)"""
+    return loadCsvCached(spark, path, LINKS_SCHEMA, cacheDir, numPartitions)
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                                'src', 'com', 'sparrowrecsys', 'offline', 'pyspark', 'embedding'))
+import SimilarItems  # noqa: E402
+from EmbeddingStore import writeTextEmbeddings  # noqa: E402
+
+
+def writeEmbeddingFile(tmp_path, numItems=6, dim=4):
+    vectors = np.random.default_rng(0).normal(size=(numItems, dim)).astype(np.float32)
+    path = str(tmp_path / 'item2vecEmb.csv')
+    writeTextEmbeddings(path, [str(i) for i in range(numItems)], vectors)
+    return path
+
+
+def test_small_catalog_uses_exact_path_without_spark(tmp_path, monkeypatch):
+    def noSpark():
+        raise AssertionError('the exact path must not start spark')
+
+    monkeypatch.setattr(SimilarItems, 'getSparkSession', noSpark)
+    table = SimilarItems.computeSimilarItems(writeEmbeddingFile(tmp_path), k=3)
+    assert table.neighbors.shape == (6, 3)
+    assert all(row not in table.neighbors[row] for row in range(6))
+
+
+def test_large_catalog_dispatches_to_lsh_with_a_session(tmp_path, monkeypatch):
+    session = object()
+    calls = []
+
+    def fakeLshTopK(spark, itemIds, vectors, k, **lshParams):
+        calls.append((spark, len(itemIds), k, lshParams))
+        return np.zeros((len(itemIds), k), dtype=np.int32), np.zeros((len(itemIds), k), dtype=np.float32)
+
+    monkeypatch.setattr(SimilarItems, 'getSparkSession', lambda: session)
+    monkeypatch.setattr(SimilarItems, 'lshTopK', fakeLshTopK)
+    table = SimilarItems.computeSimilarItems(writeEmbeddingFile(tmp_path), k=2, exactMaxItems=5, bucketLength=0.5)
+    assert calls == [(session, 6, 2, {'bucketLength': 0.5})]
+    assert table.neighbors.shape == (6, 2)
@@ -0,0 +1,82 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                                'src', 'com', 'sparrowrecsys', 'offline', 'pyspark', 'embedding'))
+from TransitionGraph import IncrementalGraphStore, TransitionGraph  # noqa: E402
+
+
+def emptyGraph():
+    return TransitionGraph.fromEdges(np.zeros(0, dtype=str), np.zeros(0, dtype=np.int32),
+                                     np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+
+
+def test_repeated_ingest_with_int_ids_reuses_nodes():
+    graph = emptyGraph()
+    graph.addEdgeCounts([1, 2], [2, 3], [1, 1])
+    graph.addEdgeCounts([1], [2], [1])
+    assert graph.numNodes() == 3
+    assert graph.itemIds.tolist() == ['1', '2', '3']
+    row = graph.itemIds.tolist().index('1')
+    start, end = graph.indptr[row], graph.indptr[row + 1]
+    assert graph.counts[start:end].tolist() == [2.0]
+
+
+def test_int_and_string_ids_refer_to_the_same_node():
+    graph = emptyGraph()
+    graph.addEdgeCounts(['1'], ['2'], [1])
+    graph.addEdgeCounts([2], [1], [1])
+    assert graph.numNodes() == 2
+
+
+def edgeDict(graph):
+    edges = {}
+    for row, itemId in enumerate(graph.itemIds):
+        for pos in range(graph.indptr[row], graph.indptr[row + 1]):
+            edges[(str(itemId), str(graph.itemIds[graph.indices[pos]]))] = (float(graph.counts[pos]),
+                                                                           float(graph.probs[pos]))
+    return edges
+
+
+def test_incremental_edge_counts_match_a_full_rebuild():
+    history = [(1, 2, 2), (2, 3, 1), (2, 4, 1)]
+    delta = [(2, 3, 1), (4, 1, 1), (5, 2, 3)]
+    incremental = emptyGraph()
+    incremental.addEdgeCounts(*zip(*history))
+    incremental.addEdgeCounts(*zip(*delta))
+
+    totals = {}
+    for src, dst, cnt in history + delta:
+        totals[(str(src), str(dst))] = totals.get((str(src), str(dst)), 0) + cnt
+    itemIds = sorted({item for pair in totals for item in pair})
+    index = {item: i for i, item in enumerate(itemIds)}
+    rebuilt = TransitionGraph.fromEdges(np.asarray(itemIds), np.array([index[s] for s, _ in totals], dtype=np.int32),
+                                        np.array([index[d] for _, d in totals], dtype=np.int32),
+                                        np.array(list(totals.values()), dtype=np.float32))
+
+    incrementalEdges, rebuiltEdges = edgeDict(incremental), edgeDict(rebuilt)
+    assert incrementalEdges.keys() == rebuiltEdges.keys()
+    for edge in rebuiltEdges:
+        assert np.allclose(incrementalEdges[edge], rebuiltEdges[edge])
+
+
+def test_commit_publishes_graph_and_watermark_together(tmp_path):
+    store = IncrementalGraphStore(str(tmp_path))
+    store.graph.addEdgeCounts([1], [2], [1])
+    store.commit(100)
+
+    # a run that dies after writing its graph but before swapping state.json must not be visible
+    store.graph.addEdgeCounts([1], [2], [1])
+    store.graph.save(os.path.join(str(tmp_path), IncrementalGraphStore.graphFileName(store.version + 1)))
+
+    reopened = IncrementalGraphStore(str(tmp_path))
+    assert reopened.version == 1
+    assert reopened.watermark == 100
+    assert edgeDict(reopened.graph)[('1', '2')][0] == 1.0
+
+    reopened.graph.addEdgeCounts([1], [2], [1])
+    reopened.commit(200)
+    assert sorted(os.listdir(str(tmp_path))) == ['graph-00002.npz', 'state.json']
+    assert edgeDict(IncrementalGraphStore(str(tmp_path)).graph)[('1', '2')][0] == 2.0
@@ -1,5 +1,7 @@
 import tensorflow as tf
 
+from ShardedSamples import get_sharded_dataset, is_sharded_sample_dir
+
 # Training samples path, change to your local path
 training_samples_file_path = tf.keras.utils.get_file("trainingSamples.csv",
                                                      "file:///Users/spike/Projects/SparrowRecSys/src/main"
@@ -12,6 +14,10 @@ test_samples_file_path = tf.keras.utils.get_file("testSamples.csv",
 
 # 优化1: 数据管道优化 - 添加 shuffle, cache, prefetch
 def get_dataset(file_path, is_training=False):
+    # 分片样本目录 (saveSamples 的 tfrecord / parquet 输出): 多个分片并行交错读取，不再解析 CSV
+    if is_sharded_sample_dir(file_path):
+        return get_sharded_dataset(file_path, batch_size=64, is_training=is_training)
+
     dataset = tf.data.experimental.make_csv_dataset(
         file_path,
         batch_size=64,
@@ -0,0 +1,72 @@
+import json
+import os
+
+import tensorflow as tf
+
+# Reader for the sharded sample output of FeatureEngForRecModel.saveSamples (outputFormat='tfrecord' / 'parquet').
+# Instead of one big csv that make_csv_dataset has to reparse on every epoch, the samples are split into
+# compressed shards plus a featureSpec.json describing every column:
+#   {"format": "tfrecord", "compression": "GZIP", "filePattern": "part-*.tfrecord*",
+#    "features": [{"name": "movieId", "dtype": "int64", "default": 0}, ...]}
+# Shards are read in parallel with interleave, and records are parsed in batches.
+
+FEATURE_SPEC_FILE = 'featureSpec.json'
+
+TF_DTYPES = {'int64': tf.int64, 'float32': tf.float32, 'string': tf.string}
+
+
+def load_feature_spec(sample_dir):
+    with tf.io.gfile.GFile(os.path.join(sample_dir, FEATURE_SPEC_FILE)) as f:
+        return json.load(f)
+
+
+def is_sharded_sample_dir(path):
+    return tf.io.gfile.isdir(path) and tf.io.gfile.exists(os.path.join(path, FEATURE_SPEC_FILE))
+
+
+def parsing_spec(spec):
+    return {f['name']: tf.io.FixedLenFeature([], TF_DTYPES[f['dtype']], default_value=f['default'])
+            for f in spec['features']}
+
+
+def get_sharded_dataset(sample_dir, batch_size=64, label_name='label', is_training=False, shuffle_buffer=10000,
+                        num_parallel_reads=tf.data.AUTOTUNE, num_epochs=1):
+    """
+    Returns batches of (features dict, label), the same structure make_csv_dataset(label_name=...) produces.
+
+    Training reads shards in a shuffled, non-deterministic interleaved order. Evaluation keeps a
+    deterministic order.
+    """
+    spec = load_feature_spec(sample_dir)
+    files = tf.data.Dataset.list_files(os.path.join(sample_dir, spec['filePattern']), shuffle=is_training)
+
+    if spec['format'] == 'tfrecord':
+        compression = spec.get('compression') or ''
+        records = files.interleave(lambda f: tf.data.TFRecordDataset(f, compression_type=compression),
+                                   cycle_length=num_parallel_reads, num_parallel_calls=tf.data.AUTOTUNE,
+                                   deterministic=not is_training)
+        if is_training:
+            records = records.shuffle(buffer_size=shuffle_buffer)
+        features = parsing_spec(spec)
+        dataset = records.repeat(num_epochs).batch(batch_size) \
+            .map(lambda batch: tf.io.parse_example(batch, features), num_parallel_calls=tf.data.AUTOTUNE)
+    elif spec['format'] == 'parquet':
+        # parquet needs tensorflow-io (tensorflow-io==0.36.0 in requirements.txt, matching tensorflow 2.15)
+        import tensorflow_io as tfio
+        columns = {f['name']: tf.TensorSpec(tf.TensorShape([]), TF_DTYPES[f['dtype']]) for f in spec['features']}
+        rows = files.interleave(lambda f: tfio.IODataset.from_parquet(f, columns=columns),
+                                cycle_length=num_parallel_reads, num_parallel_calls=tf.data.AUTOTUNE,
+                                deterministic=not is_training)
+        rows = rows.map(lambda row: {name: row[name] for name in columns})
+        if is_training:
+            rows = rows.shuffle(buffer_size=shuffle_buffer)
+        dataset = rows.repeat(num_epochs).batch(batch_size)
+    else:
+        raise ValueError("unknown sample format %r in %s" % (spec['format'], sample_dir))
+
+    def split_label(batch):
+        batch = dict(batch)
+        label = batch.pop(label_name)
+        return batch, label
+
+    return dataset.map(split_label, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)